@@ -0,0 +1,132 @@
+# File: access_drivers.py
+# Notes: Sources of enter/exit requests for running the publisher without anyone typing them in,
+#        from a script file, from a replay of a sensor log or from a synthetic generator. Every
+#        source yields (delay, action, user_code, door) tuples, delay being the seconds to wait
+#        after the previous request and door None for the publisher's own door
+
+
+# Imports
+import csv
+import random
+from timestamps import parse_timestamp
+
+
+def script_requests(file_path):
+    """
+    Requests read from a script file, one per line as "<enter|exit> <user code> [<door>]",
+    a "wait <seconds>" line delays the next request, blank lines and lines starting
+    with # are skipped
+    """
+    delay = 0.0
+    with open(file_path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            words = line.split()
+            if not words or words[0].startswith('#'):
+                continue
+
+            if words[0] == 'wait' and len(words) == 2:
+                delay += float(words[1])
+            elif words[0] in ('enter', 'exit') and len(words) in (2, 3):
+                yield delay, words[0], words[1], words[2] if len(words) == 3 else None
+                delay = 0.0
+            else:
+                raise ValueError("{0}:{1}: not a request: {2}".format(file_path, line_number, line.strip()))
+
+
+def replay_requests(log_path, speed=1.0):
+    """
+    Requests replaying the access periods recorded in a csv sensor log (either schema), an
+    enter at the first reading of each access period and an exit at its last, spaced out
+    as they were in the log divided by speed (0 replays them as fast as possible)
+    """
+    periods = []
+    with open(log_path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            # An empty log, so there is nothing to replay
+            return
+        epoch_column = header[1]
+
+        user = start = end = None
+        for row in reader:
+            if not row or not row[0]:
+                # A blank row (or one with no user) marks the end of an access period
+                if user is not None:
+                    periods.append((start, end, user))
+                user = None
+                continue
+
+            epoch = int(float(row[1])) if epoch_column == 'Epoch' else parse_timestamp(row[1])
+            if user is not None and row[0] != user:
+                periods.append((start, end, user))
+                user = None
+            if user is None:
+                user, start = row[0], epoch
+            end = epoch
+
+        if user is not None:
+            periods.append((start, end, user))
+
+    # An exit goes before an enter in the same second, as the access period it ends was over
+    # before the next one started (the next user may only enter once the last one has left)
+    events = sorted([(start, 'enter', user) for start, _, user in periods] +
+                    [(end + 1, 'exit', user) for _, end, user in periods],
+                    key=lambda event: (event[0], event[1] != 'exit'))
+
+    previous = None
+    for epoch, action, user in events:
+        delay = (epoch - previous) / speed if previous is not None and speed else 0.0
+        previous = epoch
+        yield delay, action, user, None
+
+
+def synthetic_users(users):
+    return ["U{0:05d}".format(i) for i in range(users)]
+
+
+def synthetic_doors(doors):
+    return ["door-{0:04d}".format(i) for i in range(doors)]
+
+
+def synthetic_requests(count, rate=0.0, users=100, doors=1, seed=None, roaming=True):
+    """
+    count random requests at rate requests a second (0 for as fast as possible) from a
+    population of users (see synthetic_users()) at a number of doors (see synthetic_doors()),
+    a door that is occupied is usually left by its occupant, a free door is entered by a
+    user who is not inside another door, about one request in twenty is refused (entering
+    an occupied door or leaving one without being inside). Unless roaming is True every
+    user only uses one door, so the requests come out the same whatever order the requests
+    at different doors are decided in
+    """
+    generator = random.Random(seed)
+    user_codes = synthetic_users(users)
+    door_ids = synthetic_doors(doors)
+    delay = 1.0 / rate if rate else 0.0
+
+    occupants = {}
+    inside = set()
+    for _ in range(count):
+        if roaming:
+            door = generator.choice(door_ids)
+            user = generator.choice(user_codes)
+        else:
+            user_index = generator.randrange(users)
+            door = door_ids[user_index % doors]
+            user = user_codes[user_index]
+        occupant = occupants.get(door)
+
+        if generator.random() < 0.05:
+            # Refused, whoever is inside stays inside
+            yield delay, 'exit' if occupant is None else 'enter', user, door
+        elif occupant is not None:
+            del occupants[door]
+            inside.discard(occupant)
+            yield delay, 'exit', occupant, door
+        elif user not in inside:
+            occupants[door] = user
+            inside.add(user)
+            yield delay, 'enter', user, door
+        else:
+            # Already inside another door, so this one is refused
+            yield delay, 'enter', user, door
@@ -0,0 +1,211 @@
+# File: access_engine.py
+# Notes: Access decisions for any number of doors, made from any number of threads at once, each
+#        door has its own lock so requests at different doors never wait for each other, and the
+#        access events of the requests allowed are published in batches from a thread of its own
+
+
+# Imports
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from access_events import AccessEvent
+
+
+class _Result:
+    """
+    The result of a call made straight away, with the result() of a Future that is done
+    (creating a real Future costs more than most access decisions)
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def result(self, timeout=None):
+        return self.value
+
+
+class AccessEngine:
+    """
+    The occupant of every door and the door every user inside is at. A door can only be
+    entered by a valid user (checked with authorization, see authorization.py) when nobody
+    is inside and the user is not inside another door, and only left by its occupant, so
+    each decision is made holding the lock of its door, with the user's own door claimed
+    under a second lock that is always taken after a door lock (never the other way round).
+    Each request allowed becomes an AccessEvent, timed with clock_ms (epoch milliseconds)
+    and numbered in the order of its door's events, door None being default_door.
+
+    Once start() has been called the events are queued and publish_events is called on
+    the publisher thread with lists of up to batch_size of them, in the order they were
+    decided for every door, so making a decision never waits for the network. Before that
+    (and after stop()) publish_events is called with each event as it is decided.
+
+    With workers threads, submit() hands requests to them, the requests at a door always
+    go to the same worker so they are decided in the order they were submitted
+    """
+    def __init__(self, authorization, publish_events, clock_ms, default_door, batch_size=256, workers=0):
+        self.authorization = authorization
+        self.publish_events = publish_events
+        self.clock_ms = clock_ms
+        self.default_door = default_door
+        self.batch_size = batch_size
+
+        self.occupants = {}
+        self.inside = {}
+        self.seqs = {}  # Sequence number of the next access event of every door
+        self.door_locks = {}
+        self.door_locks_lock = threading.Lock()
+        self.inside_lock = threading.Lock()
+
+        self.pending = []  # (AccessEvent, perf_counter() when decided) waiting to be published
+        self.pending_condition = threading.Condition()
+        self.publisher_thread = None
+        self.stopping = False
+
+        self.workers = [ThreadPoolExecutor(max_workers=1, thread_name_prefix="access-worker")
+                        for _ in range(workers)]
+
+        # Publishing metrics, only updated on the publisher thread
+        self.batches = 0
+        self.events_published = 0
+        self.max_batch = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.failed_batches = 0
+
+    @property
+    def mean_batch(self):
+        return self.events_published / self.batches if self.batches else 0.0
+
+    @property
+    def mean_latency(self):
+        return self.total_latency / self.events_published if self.events_published else 0.0
+
+    def _door_lock(self, door):
+        lock = self.door_locks.get(door)
+        if lock is None:
+            with self.door_locks_lock:
+                lock = self.door_locks.setdefault(door, threading.Lock())
+
+        return lock
+
+    def occupant(self, door=None):
+        """
+        Return the user code of the occupant of a door (None for the default door), None if
+        nobody is inside
+        """
+        return self.occupants.get(self.default_door if door is None else door)
+
+    def decide(self, action, user_code, door=None):
+        """
+        Decide whether a user may enter or exit (action is 'enter' or 'exit') a door (None for
+        the default door), if so the occupants are updated and the access event is queued to
+        be published. Returns None if it is allowed, otherwise the reason it is not
+        """
+        if action not in ('enter', 'exit'):
+            return "Invalid choice. Please type 'enter' or 'exit'."
+        if not self.authorization.is_valid(user_code):
+            return "Invalid user code."
+
+        door = self.default_door if door is None else door
+        with self._door_lock(door):
+            occupant = self.occupants.get(door)
+
+            if action == 'enter':
+                if occupant is not None:
+                    # If the controlled area is occupied by another user, deny access
+                    return "Access denied to {0}. Controlled area is currently occupied.".format(user_code)
+                with self.inside_lock:
+                    if user_code in self.inside:
+                        return "Access denied. You are already inside."
+                    self.inside[user_code] = door
+                self.occupants[door] = user_code
+
+            else:
+                if occupant != user_code:
+                    return "Access denied to {0}. You are not the current occupant.".format(user_code)
+                del self.occupants[door]
+                with self.inside_lock:
+                    del self.inside[user_code]
+
+            # Still holding the door lock, so the door's events are numbered and queued in order
+            seq = self.seqs.get(door, 0)
+            self.seqs[door] = seq + 1
+            self._queue(AccessEvent(door, user_code, action, self.clock_ms(), seq))
+
+        return None
+
+    def submit(self, door, fn, *args):
+        """
+        Call fn(*args) on the worker that decides the requests at a door (None for the
+        default door), returns a Future of its result. Without workers fn is called straight
+        away, and an object with the Future's result() method is returned
+        """
+        if not self.workers:
+            return _Result(fn(*args))
+
+        door = self.default_door if door is None else door
+        return self.workers[hash(door) % len(self.workers)].submit(fn, *args)
+
+    def _queue(self, event):
+        if self.publisher_thread is None:
+            self.publish_events([event])
+            return
+
+        with self.pending_condition:
+            self.pending.append((event, time.perf_counter()))
+            if len(self.pending) == 1:
+                self.pending_condition.notify()
+
+    def start(self):
+        """
+        Start publishing the access events in batches on the publisher thread
+        """
+        self.stopping = False
+        self.publisher_thread = threading.Thread(target=self._publish_loop, name="access-publisher")
+        self.publisher_thread.daemon = True
+        self.publisher_thread.start()
+        return self
+
+    def stop(self):
+        """
+        Wait for the workers to finish the requests submitted to them and for the events
+        queued to be published, then stop the publisher thread
+        """
+        for worker in self.workers:
+            worker.shutdown(wait=True)
+
+        if self.publisher_thread is not None:
+            with self.pending_condition:
+                self.stopping = True
+                self.pending_condition.notify()
+            self.publisher_thread.join()
+            self.publisher_thread = None
+
+    def _publish_loop(self):
+        while True:
+            with self.pending_condition:
+                while not self.pending and not self.stopping:
+                    self.pending_condition.wait()
+                if not self.pending:
+                    return
+
+                batch = self.pending[:self.batch_size]
+                del self.pending[:self.batch_size]
+
+            try:
+                self.publish_events([event for event, _ in batch])
+            except Exception as e:
+                # The batch is dropped rather than retried, it would only fail again
+                self.failed_batches += 1
+                print("Failed to publish {0} access events: {1}".format(len(batch), e))
+                continue
+
+            published = time.perf_counter()
+            self.batches += 1
+            self.events_published += len(batch)
+            self.max_batch = max(self.max_batch, len(batch))
+            for _, decided in batch:
+                latency = published - decided
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
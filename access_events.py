@@ -0,0 +1,59 @@
+# File: access_events.py
+# Notes: The access event message a door publishes when someone enters or exits, a single binary
+#        MQTT payload that carries the door, user code, action, time and sequence number together
+
+
+# Imports
+import struct
+from collections import namedtuple
+
+# Version of the payload format, written as its first byte so the format can change without
+# old subscribers misreading new payloads
+EVENT_VERSION = 1
+
+# Action codes, and the door event each one is
+ACTIONS = {1: 'enter', 2: 'exit'}
+_ACTION_CODES = {action: code for code, action in ACTIONS.items()}
+
+# Version, action code, epoch milliseconds, sequence number, then the length of the door id and
+# of the user code, which follow the header as utf-8
+_HEADER = struct.Struct('!BBqIBB')
+
+AccessEvent = namedtuple('AccessEvent', ('door', 'user', 'action', 'epoch_ms', 'seq'))
+
+
+def encode_event(door, user, action, epoch_ms, seq):
+    """
+    Return the payload of an access event, action is 'enter' or 'exit' and seq is the
+    number of the event among those published by the door (it wraps at 2**32)
+    """
+    door_bytes = door.encode('utf-8')
+    user_bytes = user.encode('utf-8')
+    if len(door_bytes) > 255 or len(user_bytes) > 255:
+        raise ValueError("Door ids and user codes must be at most 255 bytes long")
+
+    return (_HEADER.pack(EVENT_VERSION, _ACTION_CODES[action], epoch_ms, seq & 0xFFFFFFFF, len(door_bytes),
+                         len(user_bytes)) + door_bytes + user_bytes)
+
+
+def decode_event(payload):
+    """
+    Return the AccessEvent held in a payload, raises ValueError if the payload is not an
+    access event of a version this module can read
+    """
+    try:
+        version, action, epoch_ms, seq, door_length, user_length = _HEADER.unpack_from(payload)
+    except struct.error:
+        raise ValueError("Access event payload is too short") from None
+
+    if version != EVENT_VERSION:
+        raise ValueError("Unsupported access event version: {0}".format(version))
+    if action not in ACTIONS:
+        raise ValueError("Unknown access event action: {0}".format(action))
+
+    door_end = _HEADER.size + door_length
+    if len(payload) != door_end + user_length:
+        raise ValueError("Access event payload length does not match its header")
+
+    return AccessEvent(payload[_HEADER.size:door_end].decode('utf-8'), payload[door_end:].decode('utf-8'),
+                       ACTIONS[action], epoch_ms, seq)
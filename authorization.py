@@ -0,0 +1,234 @@
+# File: authorization.py
+# Notes: The user codes the publisher lets through its doors, held in a dict indexed by code and
+#        loaded from a codes file (only when first needed), with revocations, expiry windows and
+#        reloading of the lines appended to the file while the publisher is running
+
+
+# Imports
+import hashlib
+import math
+import os
+import threading
+import time
+
+# Validity window of a code that is valid at any time, shared by all such codes
+_ALWAYS = (None, None)
+
+
+class BloomFilter:
+    """
+    Set of strings that can answer "definitely not in the set" without holding the strings,
+    any string added is always found but a string that was not added is wrongly found
+    about error_rate of the time once capacity strings have been added
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, text):
+        # Double hashing, all the positions come from the two halves of one digest
+        digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, text):
+        for position in self._positions(text):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, text):
+        bits = self.bits
+        for position in self._positions(text):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class AuthorizationStore:
+    """
+    The valid user codes, read from a codes file with one line per code:
+
+        <code>[,<valid from>[,<valid until>]]   the code is valid between the two times
+                                                (epoch seconds, either may be left out)
+        -<code>                                 the code is revoked
+        # ...                                   comment
+
+    A later line for a code replaces what earlier lines said about it, so codes are added,
+    changed and revoked by appending lines to the file. The file is read the first time a
+    code is checked, after that reload() (called by is_valid() at most every
+    reload_interval seconds) reads only the lines appended since, unless the file has
+    been replaced or shortened, when it is read again from the start. Codes can also be
+    added in memory with add(). With bloom_filter=True, codes that were never in the store
+    are turned away by a Bloom filter before the dict is looked at. clock returns the
+    current epoch seconds the expiry windows are checked against. Codes can be checked
+    from any number of threads, only one of them reads the file at a time
+    """
+    def __init__(self, file_path=None, bloom_filter=False, reload_interval=5.0, clock=time.time):
+        self.file_path = file_path
+        self.use_bloom_filter = bloom_filter
+        self.reload_interval = reload_interval
+        self.clock = clock
+
+        self.codes = None
+        self.bloom_filter = None
+        self.offset = 0
+        self.file_id = None
+        self.last_reload = 0.0
+        self.lock = threading.RLock()
+
+        self.lines_read = 0
+        self.bad_lines = 0  # Lines of the codes file ignored as they could not be read
+        self.reloads = 0
+
+    def _ensure_loaded(self):
+        if self.codes is None:
+            with self.lock:
+                if self.codes is None:
+                    self.load()
+
+    def load(self):
+        """
+        Read the whole codes file, any codes added in memory are forgotten
+        """
+        with self.lock:
+            # Read into a new dict that replaces the old one once it is complete, so codes
+            # checked meanwhile are checked against the old codes
+            codes = {}
+            self.offset = 0
+            self.file_id = None
+            self.last_reload = time.monotonic()
+            self._read_appended(codes)
+
+            bloom_filter = None
+            if self.use_bloom_filter:
+                bloom_filter = BloomFilter(len(codes) * 2)
+                for code in codes:
+                    bloom_filter.add(code)
+            self.codes, self.bloom_filter = codes, bloom_filter
+
+    def reload(self):
+        """
+        Apply the lines appended to the codes file since it was last read, returns the
+        number of lines applied
+        """
+        with self.lock:
+            self.last_reload = time.monotonic()
+            if self.codes is None:
+                self.load()
+                return self.lines_read
+
+            if self.file_path is None:
+                return 0
+
+            try:
+                stat = os.stat(self.file_path)
+            except FileNotFoundError:
+                return 0
+
+            if self.file_id is not None and ((stat.st_dev, stat.st_ino) != self.file_id or
+                                             stat.st_size < self.offset):
+                # Replaced or shortened, so what has been read so far may no longer be in it
+                lines = self.lines_read
+                self.load()
+                return self.lines_read - lines
+
+            if stat.st_size == self.offset:
+                return 0
+
+            self.reloads += 1
+            return self._read_appended(self.codes)
+
+    def _read_appended(self, codes):
+        if self.file_path is None or not os.path.isfile(self.file_path):
+            return 0
+
+        with open(self.file_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.file_id = (stat.st_dev, stat.st_ino)
+            f.seek(self.offset)
+            data = f.read()
+
+        # Only whole lines are applied, a line still being written is read next time
+        end = data.rfind(b'\n') + 1
+        applied = 0
+        for line in data[:end].splitlines():
+            try:
+                line = line.decode('utf-8').strip()
+                if not line or line.startswith('#'):
+                    continue
+
+                if line.startswith('-'):
+                    codes.pop(line[1:].strip(), None)
+                else:
+                    fields = line.split(',')
+                    code = fields[0].strip()
+                    if not code:
+                        raise ValueError("no code")
+                    valid_from = int(fields[1]) if len(fields) > 1 and fields[1].strip() else None
+                    valid_until = int(fields[2]) if len(fields) > 2 and fields[2].strip() else None
+                    codes[code] = _ALWAYS if valid_from is None and valid_until is None else (valid_from,
+                                                                                             valid_until)
+                    if self.bloom_filter is not None and codes is self.codes:
+                        self.bloom_filter.add(code)
+                applied += 1
+            except ValueError as e:
+                # A bad line (UnicodeDecodeError is a ValueError too) is skipped, never the lines after it
+                self.bad_lines += 1
+                print("Ignored line of {0}: {1!r} ({2})".format(self.file_path, line, e))
+
+        # Every whole line has been applied or skipped, so reading carries on after them
+        self.offset += end
+
+        self.lines_read += applied
+        return applied
+
+    def add(self, code, valid_from=None, valid_until=None):
+        """
+        Make a code valid between two epoch seconds (None for no limit), in memory only
+        """
+        with self.lock:
+            self._ensure_loaded()
+            self.codes[code] = _ALWAYS if valid_from is None and valid_until is None else (valid_from, valid_until)
+            if self.bloom_filter is not None:
+                self.bloom_filter.add(code)
+
+    def revoke(self, code):
+        """
+        Revoke a code, in memory only
+        """
+        with self.lock:
+            self._ensure_loaded()
+            self.codes.pop(code, None)
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self.codes)
+
+    def is_valid(self, code, now=None):
+        """
+        Return True if a code is valid at epoch seconds now (by default the clock's time)
+        """
+        if self.codes is None:
+            self._ensure_loaded()
+        elif self.reload_interval is not None and time.monotonic() - self.last_reload >= self.reload_interval:
+            # Only one thread reloads, the others carry on with the codes as they are
+            if self.lock.acquire(blocking=False):
+                try:
+                    self.reload()
+                finally:
+                    self.lock.release()
+
+        if self.bloom_filter is not None and code not in self.bloom_filter:
+            return False
+
+        window = self.codes.get(code)
+        if window is None:
+            return False
+        if window is _ALWAYS:
+            return True
+
+        now = self.clock() if now is None else now
+        valid_from, valid_until = window
+        return (valid_from is None or now >= valid_from) and (valid_until is None or now < valid_until)
@@ -0,0 +1,680 @@
+# File: benchmarks.py
+# Notes: Micro benchmarks for the hot paths of the door access apps and the report generator, run
+#        "python benchmarks.py" for all of them or "python benchmarks.py <name> ..." for some
+
+
+# Imports
+import argparse
+import random
+import time
+
+
+def _best_of(fn, repeat=5):
+    """
+    Run fn repeat times and return the fastest run in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def _report(name, seconds, count, unit="op"):
+    print("  {0:<40} {1:>10.1f} ns/{2:<8} {3:>12,.0f} {2}s/s".format(name, seconds * 1e9 / count, unit,
+                                                                      count / seconds))
+
+
+def bench_timestamps(count=100000):
+    """
+    Parsing "dd/mm/YYYY HH:MM:SS" timestamps, one at a time as the subscriber does for the
+    MQTT enter/exit payloads, and as a whole log column as the report does
+    """
+    from datetime import datetime
+    import pandas as pd
+    from timestamps import TIMESTAMP_FORMAT, format_timestamp, parse_datetime, parse_timestamps
+
+    start = 1683849600  # 12/05/2023 00:00:00
+    texts = [format_timestamp(start + i) for i in range(count)]
+
+    print("Timestamp parsing ({0:,} timestamps)".format(count))
+    _report("datetime.strptime", _best_of(lambda: [datetime.strptime(t, TIMESTAMP_FORMAT) for t in texts]),
+            count, "parse")
+    _report("timestamps.parse_datetime", _best_of(lambda: [parse_datetime(t) for t in texts]), count, "parse")
+
+    column = pd.Series(texts)
+    epochs = pd.Series(range(start, start + count))
+    # Without a format the first timestamp decides it, and "12/05/2023" reads as month first,
+    # so dayfirst is needed for the column to parse at all
+    _report("pd.to_datetime, format inferred", _best_of(lambda: pd.to_datetime(column, dayfirst=True), 3),
+            count, "row")
+    _report("pd.to_datetime, fixed format",
+            _best_of(lambda: pd.to_datetime(column, format=TIMESTAMP_FORMAT), 3), count, "row")
+    _report("timestamps.parse_timestamps", _best_of(lambda: pd.to_datetime(parse_timestamps(column), unit='s'), 3),
+            count, "row")
+    _report("pd.to_datetime, epoch column", _best_of(lambda: pd.to_datetime(epochs, unit='s'), 3), count, "row")
+
+
+def _synthetic_log(path, rows, users=50, days=30):
+    """
+    Write a csv sensor log of access periods of random users spread over a number of days
+    """
+    import csv
+
+    start = 1683849600  # 12/05/2023 00:00:00
+    step = days * 86400 // rows or 1
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['User', 'Epoch', 'Temperature (C)', 'Humidity (%)'])
+
+        t = start
+        while rows > 0:
+            user = "U{0:04d}".format(random.randrange(users))
+            for _ in range(min(rows, random.randint(5, 60))):
+                writer.writerow([user, t, round(random.uniform(20, 30), 1), float(random.randint(30, 60))])
+                t += 1
+                rows -= 1
+
+            writer.writerow(['', '', '', ''])
+            t += step * 30
+
+
+def _directory_size(path):
+    import os
+
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def bench_neopixel(ticks=20000):
+    """
+    NeoPixel updates as the subscriber makes them, a fill() and write() of the 32 NeoPixels
+    every loop, with the colour mostly unchanged from the tick before (it changes every 100
+    ticks) and with it changing every tick, the labels stand in for the Tk labels of the GUI
+    and count the config() calls that would go to Tk
+    """
+    from neopixel import NeoPixel
+
+    class Label:
+        config_calls = 0
+
+        def __init__(self):
+            self.bg = "#708090"
+
+        def __getitem__(self, key):
+            return self.bg
+
+        def config(self, bg=None):
+            Label.config_calls += 1
+            self.bg = bg
+
+    class App:
+        def __init__(self):
+            self.neopixel_lbls = [Label() for _ in range(32)]
+
+        def gui_post(self, key, command, *args, **kwargs):
+            command(*args, **kwargs)
+
+        def neopixel_write(self):
+            pass
+
+    colours = [(0, 255, 0), (255, 191, 0), (255, 0, 0)]
+
+    print("NeoPixel updates ({0:,} ticks of fill() and write())".format(ticks))
+    for name, every in (("colour changing every 100 ticks", 100), ("colour changing every tick", 1)):
+        npm = NeoPixel(None, 32, bpp=3, timing=1, app=App())
+
+        def run():
+            for tick in range(ticks):
+                npm.fill(colours[(tick // every) % len(colours)])
+                npm.write()
+
+        Label.config_calls = 0
+        seconds = _best_of(run, 3)
+        _report(name, seconds, ticks, "tick")
+        print("  {0:<40} {1:>10.2f} Tk config() calls/tick".format("", Label.config_calls / 3 / ticks))
+
+
+def bench_oled(frames=20000):
+    """
+    OLED frames as the subscriber draws them, oled_clear(), five lines of oled_text() and
+    oled_display() every loop, with only the date/time changing (every 10 frames) and the
+    readings now and then, and with the access period line also changing every frame (its
+    duration). The frames are applied on the GUI side (gui_apply()) after every frame, and
+    after every 10 frames as when the loop runs faster than the GUI's frame rate, the canvas
+    stands in for the Tk canvas of the GUI and counts the calls that would go to Tk
+    """
+    from iot_app import IoTApp
+
+    class Canvas:
+        calls = 0
+
+        def __init__(self):
+            self.next_item = 1
+
+        def config(self, **kwargs):
+            Canvas.calls += 1
+
+        def create_text(self, x, y, **kwargs):
+            Canvas.calls += 1
+            self.next_item += 1
+            return self.next_item
+
+        def itemconfig(self, item, **kwargs):
+            Canvas.calls += 1
+
+        def delete(self, *items):
+            Canvas.calls += 1
+
+    print("OLED frames ({0:,} frames of oled_clear(), oled_text() and oled_display())".format(frames))
+    for name, period in (("no access period", False), ("access period", True)):
+        for apply_every in (1, 10):
+            app = IoTApp("bench", debug_on=False)
+            app.oled_canvas = Canvas()
+
+            def run():
+                for frame in range(frames):
+                    app.oled_clear()
+                    app.oled_text("Date/Time: 01/02/2024 10:{0:02d}:{1:02d}".format(frame // 600 % 60,
+                                                                                   frame // 10 % 60), 0, 0)
+                    app.oled_text("Temperature: {0:.2f}c".format(20 + frame // 50 % 10 * 0.1), 0, 10)
+                    app.oled_text("Relative Humidity: {0:.2f}%rh".format(50 + frame // 70 % 10 * 0.1), 0, 20)
+                    if period:
+                        app.oled_text("MJ235AA entered: 0:00:{0:02d}.{1:06d}".format(
+                            frame // 10 % 60, frame * 100003 % 1000000), 0, 30)
+                    else:
+                        app.oled_text("Access Period: -", 0, 30)
+                    app.oled_text("=", 120, 20)
+                    app.oled_display()
+                    if frame % apply_every == 0:
+                        app.gui_apply()
+
+            Canvas.calls = 0
+            seconds = _best_of(run, 3)
+            _report("{0}, applied every {1}".format(name, apply_every), seconds, frames, "frame")
+            print("  {0:<40} {1:>10.2f} Tk canvas calls/frame".format("", Canvas.calls / 3 / frames))
+
+
+def bench_outbox(count=100000):
+    """
+    Keeping access events in the outbox while disconnected, then draining the backlog in
+    batches of different sizes once connected (sent to a send() that throws them away)
+    """
+    import os
+    import tempfile
+    from access_events import encode_event
+    from outbox import Outbox
+
+    payloads = [encode_event("door-1", "MJ235AA", "exit" if i % 2 else "enter", 1683849600000 + i * 1000, i)
+                for i in range(count)]
+
+    print("Outbox ({0:,} access events)".format(count))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for batch_size in (1, 50, 500, 5000):
+            db_path = os.path.join(temp_dir, "outbox_{0}.db".format(batch_size))
+            connected = [False]
+            outbox = Outbox(db_path, lambda topic, payload: True, lambda: connected[0], max_messages=count,
+                            batch_size=batch_size, drain_seconds=3600)
+
+            start = time.perf_counter()
+            for payload in payloads:
+                outbox.publish("uos/door-1/door/event", payload)
+            if batch_size == 1:
+                _report("kept while disconnected", time.perf_counter() - start, count, "message")
+                print("  database size {0:,.1f} MB".format(os.path.getsize(db_path) / 1e6))
+
+            connected[0] = True
+            start = time.perf_counter()
+            outbox.drain()
+            _report("drained, batches of {0}".format(batch_size), time.perf_counter() - start, count, "message")
+            outbox.close()
+
+
+def bench_startup(repeat=5):
+    """
+    Starting the apps in a fresh interpreter each time: importing each app module, and for
+    the headless subscriber the time from the import starting to its first loop() (the
+    first reading), and from the process starting to its first loop(), the network comes up
+    on the local broker in the background meanwhile
+    """
+    import os
+    import subprocess
+    import sys
+    import tempfile
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    child = ("import os, time\n"
+             "started = time.perf_counter()\n"
+             "import mqtt_sub_simulated as sub\n"
+             "def loop(self):\n"
+             "    print(time.perf_counter() - started, flush=True)\n"
+             "    os._exit(0)\n"
+             "sub.MainApp.loop = loop\n"
+             "sub.MainApp(name='bench', start_verbose=False, debug_on=False, headless=True).run()\n")
+
+    def best_of_runs(code):
+        results = []
+        with tempfile.TemporaryDirectory() as temp_dir:
+            env = dict(os.environ, PYTHONPATH=here, MQTT_ADDR='local')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                output = subprocess.run([sys.executable, '-c', code], cwd=temp_dir, env=env, check=True,
+                                        capture_output=True, text=True).stdout
+                results.append((float(output.split()[-1]), time.perf_counter() - start))
+
+        return min(result[0] for result in results), min(result[1] for result in results)
+
+    print("App startup (best of {0} fresh interpreters)".format(repeat))
+    for module in ('mqtt_sub_simulated', 'mqtt_pub_simulated'):
+        seconds, _ = best_of_runs("import time\nstarted = time.perf_counter()\nimport {0}\n"
+                                  "print(time.perf_counter() - started)\n".format(module))
+        print("  {0:<44} {1:>8.1f} ms".format("import " + module, seconds * 1000))
+
+    seconds, process_seconds = best_of_runs(child)
+    print("  {0:<44} {1:>8.1f} ms".format("headless subscriber, import to first loop", seconds * 1000))
+    print("  {0:<44} {1:>8.1f} ms".format("headless subscriber, process to first loop", process_seconds * 1000))
+
+
+def bench_storage(rows=1000000):
+    """
+    Time to find the access periods of the whole log, and of one user over one day, when
+    reading from the csv log, the Parquet history and the SQLite database, and the size
+    of each on disk
+    """
+    import os
+    import tempfile
+    import pandas as pd
+    from generate_report_2 import find_access_periods, prepare_readings
+    from parquet_log import convert_csv_to_parquet, read_parquet_readings
+    from sqlite_log import SqliteLogWriter, query_readings
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_path = os.path.join(temp_dir, 'log.csv')
+        history_dir = os.path.join(temp_dir, 'history')
+        db_path = os.path.join(temp_dir, 'log.db')
+
+        _synthetic_log(csv_path, rows)
+        convert_csv_to_parquet(csv_path, history_dir)
+        writer = SqliteLogWriter(db_path, flush_rows=10000)
+        for chunk in pd.read_csv(csv_path, chunksize=100000):
+            for user, epoch, temperature, humidity in chunk.dropna().itertuples(index=False):
+                writer.write(user, int(epoch), temperature, humidity)
+        writer.close()
+
+        start = 1683849600 + 10 * 86400
+        query = dict(user="U0007", start=start, end=start + 86400)
+
+        def csv_user():
+            df = prepare_readings(pd.read_csv(csv_path))
+            df = df[(df['User'] == query['user']) & (df['Epoch'] >= query['start']) & (df['Epoch'] < query['end'])]
+            find_access_periods(df)
+
+        print("Access periods from storage ({0:,} readings)".format(rows))
+        for name, path, whole, one_user in (
+                ("csv", csv_path, lambda: find_access_periods(prepare_readings(pd.read_csv(csv_path))), csv_user),
+                ("parquet", history_dir,
+                 lambda: find_access_periods(prepare_readings(read_parquet_readings(history_dir))),
+                 lambda: find_access_periods(prepare_readings(read_parquet_readings(history_dir, **query)))),
+                ("sqlite", db_path,
+                 lambda: find_access_periods(prepare_readings(query_readings(db_path))),
+                 lambda: find_access_periods(prepare_readings(query_readings(db_path, **query))))):
+            print("  {0:<8} whole log {1:8.3f} s   one user, one day {2:8.3f} s   size {3:8.1f} MB".format(
+                name, _best_of(whole, 3), _best_of(one_user, 3), _directory_size(path) / 1e6))
+
+
+def bench_doors(counts=(1, 10, 100, 1000, 10000), messages=100000):
+    """
+    Routing MQTT messages to the access period of their door, as the multi-door subscriber
+    does, for a growing number of doors (each door sends user, enter and exit in turn)
+    """
+    from door_access import DoorTable
+    from timestamps import format_timestamp
+
+    start = 1683849600  # 12/05/2023 00:00:00
+    print("Door message dispatch ({0:,} messages)".format(messages))
+    for count in counts:
+        doors = ["door-{0:05d}".format(i) for i in range(count)]
+        msgs = []
+        for i in range(messages):
+            door = doors[random.randrange(count)]
+            step = i % 3
+            if step == 0:
+                msgs.append(("uos/{0}/door/user".format(door), b"MJ235AA"))
+            else:
+                msgs.append(("uos/{0}/door/{1}".format(door, "enter" if step == 1 else "exit"),
+                             format_timestamp(start + i).encode()))
+
+        def dispatch():
+            table = DoorTable()
+            handle = table.handle
+            for topic, msg in msgs:
+                handle(topic, msg)
+
+        _report("door count {0:,}".format(count), _best_of(dispatch, 3), messages, "msg")
+
+
+def _mqtt_sink():
+    """
+    Start a TCP server on localhost that accepts one MQTT connection, acknowledges it and
+    then reads and throws away everything sent to it, returns the port it listens on
+    """
+    import socket
+    import threading
+
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+
+    def sink():
+        connection, _ = server.accept()
+        server.close()
+        with connection:
+            connection.recv(4096)  # CONNECT
+            connection.sendall(b'\x20\x02\x00\x00')  # CONNACK, connection accepted
+            while connection.recv(65536):
+                pass
+
+    threading.Thread(target=sink, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def bench_events(count=50000):
+    """
+    Publishing entries and exits as single access events and on the legacy enter/exit/user
+    topics (two messages for an entry), and handling them in the subscriber
+    """
+    import paho.mqtt.client as mqtt
+    from access_events import encode_event
+    from door_access import DoorTable
+    from timestamps import format_timestamp
+
+    start = 1683849600000  # 12/05/2023 00:00:00 in milliseconds
+
+    def publish_legacy(client):
+        for i in range(count):
+            ct = format_timestamp((start + i * 1000) // 1000)
+            if i % 2 == 0:
+                client.publish("uos/door-1/door/user", "MJ235AA")
+                client.publish("uos/door-1/door/enter", ct)
+            else:
+                client.publish("uos/door-1/door/exit", ct)
+
+    def publish_events(client):
+        for i in range(count):
+            client.publish("uos/door-1/door/event",
+                           encode_event("door-1", "MJ235AA", "exit" if i % 2 else "enter", start + i * 1000, i))
+
+    print("Access event publishing ({0:,} entries and exits)".format(count))
+    for name, publish in (("legacy topics, publish", publish_legacy), ("access events, publish", publish_events)):
+        # Without a network thread paho writes each message to the socket as it is published
+        client = mqtt.Client("bench")
+        client.connect('127.0.0.1', _mqtt_sink())
+        while not client.is_connected():
+            client.loop(0.1)
+
+        _report(name, _best_of(lambda: publish(client), 3), count, "event")
+        client.disconnect()
+
+    legacy, events = [], []
+    for i in range(count):
+        ct = format_timestamp((start + i * 1000) // 1000).encode()
+        if i % 2 == 0:
+            legacy += [("uos/door-1/door/user", b"MJ235AA"), ("uos/door-1/door/enter", ct)]
+        else:
+            legacy.append(("uos/door-1/door/exit", ct))
+        events.append(("uos/door-1/door/event",
+                       encode_event("door-1", "MJ235AA", "exit" if i % 2 else "enter", start + i * 1000, i)))
+
+    for name, msgs in (("legacy topics, handle", legacy), ("access events, handle", events)):
+        def handle():
+            table = DoorTable()
+            for topic, msg in msgs:
+                table.handle(topic, msg)
+
+        _report(name, _best_of(handle, 3), count, "event")
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def bench_broker(count=20000, rate=2000):
+    """
+    End to end through the local broker, access events published by one client and handled
+    by a subscriber running the network thread (as the subscriber app does). Throughput is
+    measured publishing as fast as possible, latency (publish to handled) publishing at a
+    steady rate
+    """
+    from access_events import encode_event
+    from door_access import DoorTable
+    from local_broker import LocalBroker
+    from mqtt_simple_ex import MQTTClientEx
+
+    broker = LocalBroker(port=0).start()
+
+    def run(paced):
+        sent = {}
+        latencies = []
+        table = DoorTable(legacy_topics=False)
+
+        def handle(topic, msg):
+            handled = table.handle(topic, msg)
+            latencies.append(time.perf_counter() - sent[handled[1].last_seq])
+
+        subscriber = MQTTClientEx("bench-sub")
+        subscriber.msg_callback = handle
+        subscriber.connect('127.0.0.1', broker.port)
+        subscriber.start_network_thread()
+        subscriber.subscribe("uos/+/door/+")
+
+        publisher = MQTTClientEx("bench-pub")
+        publisher.connect('127.0.0.1', broker.port)
+        publisher.start_network_thread()
+        while not (subscriber.is_connected() and publisher.is_connected()):
+            time.sleep(0.01)
+        time.sleep(0.1)  # For the subscription to be in place
+
+        start = time.perf_counter()
+        for i in range(count):
+            if paced:
+                while time.perf_counter() < start + i / rate:
+                    subscriber.check_msg(timeout=0)
+            sent[i] = time.perf_counter()
+            publisher.publish("uos/door-1/door/event",
+                              encode_event("door-1", "MJ235AA", "exit" if i % 2 else "enter", int(time.time() * 1000), i))
+
+        while len(latencies) < count and time.perf_counter() - start < 60:
+            subscriber.check_msg(timeout=0)
+            time.sleep(0.0005)
+        elapsed = time.perf_counter() - start
+
+        publisher.disconnect()
+        subscriber.disconnect()
+        return elapsed, latencies, subscriber.max_queue_depth
+
+    print("Local broker, end to end ({0:,} access events)".format(count))
+    elapsed, latencies, depth = run(paced=False)
+    print("  as fast as possible: {0:,.0f} events/s, {1:,} of {2:,} handled, max queue depth {3}".format(
+        len(latencies) / elapsed, len(latencies), count, depth))
+
+    elapsed, latencies, depth = run(paced=True)
+    print("  at {0:,} events/s: latency p50 {1:.2f} ms, p99 {2:.2f} ms, max {3:.2f} ms, max queue depth {4}".format(
+        rate, _percentile(latencies, 0.5) * 1000, _percentile(latencies, 0.99) * 1000, max(latencies) * 1000, depth))
+
+    broker.stop()
+
+
+def bench_access(count=200000, doors=1000, users=10000):
+    """
+    Access decisions by the publisher's access engine, at many doors from a number of
+    worker threads, with the access events thrown away, then published with paho one at a
+    time as they are decided or in batches from the publisher thread. Also checks that when
+    many threads try to enter the same door at once only one of them gets in
+    """
+    import threading
+    import paho.mqtt.client as mqtt
+    from access_drivers import synthetic_requests, synthetic_users
+    from access_engine import AccessEngine
+    from access_events import encode_event
+    from authorization import AuthorizationStore
+    from door_access import door_topic
+
+    authorization = AuthorizationStore(reload_interval=None)
+    for user_code in synthetic_users(users):
+        authorization.add(user_code)
+    requests = [(action, user, door) for _, action, user, door in
+                synthetic_requests(count, users=users, doors=doors, seed=1, roaming=False)]
+
+    def decide_all(engine):
+        # The requests are handed to the workers as they would be by the publisher's driver
+        futures = [engine.submit(door, engine.decide, action, user, door) for action, user, door in requests]
+        engine.stop()
+        return sum(future.result() is None for future in futures)
+
+    print("Access decisions ({0:,} requests at {1:,} doors)".format(count, doors))
+    for workers in (0, 1, 4, 8):
+        engine = AccessEngine(authorization, lambda events: None, lambda: 0, "door", workers=workers)
+        start = time.perf_counter()
+        allowed = decide_all(engine)
+        _report("{0} workers, {1:,} allowed".format(workers, allowed), time.perf_counter() - start, count,
+                "decision")
+
+    def publisher(client):
+        def publish_events(events):
+            for event in events:
+                client.publish(door_topic(event.door, 'event'), encode_event(*event))
+        return publish_events
+
+    for name, batched in (("published as decided", False), ("published in batches", True)):
+        # Without a network thread paho writes each message to the socket as it is published
+        client = mqtt.Client("bench")
+        client.connect('127.0.0.1', _mqtt_sink())
+        while not client.is_connected():
+            client.loop(0.1)
+
+        engine = AccessEngine(authorization, publisher(client), lambda: 0, "door")
+        if batched:
+            engine.start()
+        start = time.perf_counter()
+        futures = [engine.submit(door, engine.decide, action, user, door) for action, user, door in requests]
+        decided = time.perf_counter()
+        engine.stop()
+        published = time.perf_counter()
+        allowed = sum(future.result() is None for future in futures)
+        _report(name + ", decided", decided - start, count, "decision")
+        _report(name + ", all published", published - start, count, "decision")
+        if batched:
+            print("  {0:,} allowed, {1} batches of {2:.1f} events on average".format(allowed, engine.batches,
+                                                                                 engine.mean_batch))
+        else:
+            print("  {0:,} allowed".format(allowed))
+        client.disconnect()
+
+    # Threads let go at the same moment all try to enter the same free door
+    admitted_twice = 0
+    for trial in range(200):
+        engine = AccessEngine(authorization, lambda events: None, lambda: 0, "door")
+        barrier = threading.Barrier(8)
+        results = []
+
+        def enter(user):
+            barrier.wait()
+            results.append(engine.decide('enter', user, "door-contended"))
+
+        threads = [threading.Thread(target=enter, args=(user,)) for user in synthetic_users(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if results.count(None) != 1:
+            admitted_twice += 1
+    print("  8 threads entering one door at once, 200 trials: {0} with more than one user admitted".format(
+        admitted_twice))
+
+
+def bench_authorization(codes=1000000, checks=200000):
+    """
+    Checking user codes against an authorization store of a million codes (a tenth of them
+    with an expiry window, a hundredth revoked), for codes in the store and unknown codes,
+    with and without the Bloom filter, compared with the list of codes the publisher used
+    to scan
+    """
+    import os
+    import tempfile
+    from authorization import AuthorizationStore
+
+    user_codes = ["B{0:07d}".format(i) for i in range(codes)]
+    known = [random.choice(user_codes) for _ in range(checks)]
+    unknown = ["X{0:07d}".format(random.randrange(codes)) for _ in range(checks)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = os.path.join(temp_dir, 'user_codes.txt')
+        with open(file_path, 'w') as f:
+            for i, code in enumerate(user_codes):
+                f.write("{0},1683849600,1999999999\n".format(code) if i % 10 == 0 else code + "\n")
+            for code in user_codes[::100]:
+                f.write("-" + code + "\n")
+
+        print("Authorization store ({0:,} codes)".format(codes))
+        for bloom_filter in (False, True):
+            name = "with Bloom filter" if bloom_filter else "dict only"
+            load_time = _best_of(lambda: AuthorizationStore(file_path, bloom_filter=bloom_filter).load(), 1)
+            store = AuthorizationStore(file_path, bloom_filter=bloom_filter, reload_interval=None)
+            store.load()
+            print("  {0}: loaded in {1:.2f} s".format(name, load_time))
+            _report("known codes, " + name, _best_of(lambda: [store.is_valid(c, 1700000000) for c in known], 3),
+                    checks, "check")
+            _report("unknown codes, " + name, _best_of(lambda: [store.is_valid(c, 1700000000) for c in unknown], 3),
+                    checks, "check")
+
+        # Appending to the file and picking up just the new lines
+        with open(file_path, 'a') as f:
+            for i in range(1000):
+                f.write("N{0:07d}\n".format(i))
+        _report("incremental reload of 1,000 lines", _best_of(store.reload, 1), 1000, "line")
+
+    # The old list scan, at a thousandth of the size and on a hundredth of the checks
+    scan_codes = user_codes[:codes // 1000]
+    scan_checks = unknown[:checks // 100]
+    _report("list scan ({0:,} codes), unknown codes".format(len(scan_codes)),
+            _best_of(lambda: [c in scan_codes for c in scan_checks], 3), len(scan_checks), "check")
+
+
+BENCHMARKS = {
+    'access': bench_access,
+    'authorization': bench_authorization,
+    'broker': bench_broker,
+    'doors': bench_doors,
+    'events': bench_events,
+    'neopixel': bench_neopixel,
+    'oled': bench_oled,
+    'outbox': bench_outbox,
+    'startup': bench_startup,
+    'storage': bench_storage,
+    'timestamps': bench_timestamps,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the micro benchmarks")
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help="benchmarks to run: {0} (default: all)".format(", ".join(sorted(BENCHMARKS))))
+    args = parser.parse_args()
+
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: {0}".format(name))
+
+    random.seed(0)
+    for name in args.names or sorted(BENCHMARKS):
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
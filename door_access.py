@@ -0,0 +1,175 @@
+# File: door_access.py
+# Notes: Access period state of every door the MQTT subscriber hears about, the messages published
+#        on the uos/<door>/door/<event> topics are routed to the state of their door
+
+
+# Imports
+import re
+from access_events import decode_event
+from timestamps import parse_timestamp, datetime_from_epoch
+
+# Events published by a door, the last level of its topics, 'event' carries a whole access event
+# (see access_events.py) and 'enter', 'exit' and 'user' are the legacy topics that carry the
+# time entered, the time exited and the user code as separate messages
+DOOR_EVENTS = ('event', 'enter', 'exit', 'user')
+
+# Door ids come from the network and name the directory of a door's partitions in a partitioned
+# log (see log_partitions.py), so only these characters are allowed, never a path separator
+DOOR_ID = re.compile(r'[A-Za-z0-9_-]+')
+
+
+def is_valid_door(door):
+    """
+    Return True if door is a valid door id
+    """
+    return isinstance(door, str) and DOOR_ID.fullmatch(door) is not None
+
+
+class AccessPeriod:
+    """
+    The current (or last) access period at a door, with the help of this class I can create
+    an access period, start it and stop it
+    """
+    def __init__(self, door):
+        self.door = door
+        self.active = False
+        self.start_time = None
+        self.elapsed_time = None
+        self.end_time = None
+        self.user_code = None
+        self.last_seq = None  # Sequence number of the last access event from the door
+        self.last_event = None
+
+
+def door_topic(door, event):
+    """
+    Return the topic a door publishes an event on
+    """
+    return "uos/{0}/door/{1}".format(door, event)
+
+
+def split_door_topic(topic):
+    """
+    Return the (door, event) of a uos/<door>/door/<event> topic, or None for any other topic
+    """
+    levels = topic.split('/')
+    if len(levels) != 4 or levels[0] != 'uos' or levels[2] != 'door' or levels[3] not in DOOR_EVENTS:
+        return None
+
+    return levels[1], levels[3]
+
+
+class DoorTable:
+    """
+    The access periods of any number of doors, in a dict keyed by door id so routing a
+    message to its door is a single lookup however many doors there are. The doors
+    with an access period under way are kept in a dict of their own too, so that the
+    subscriber loop only ever visits those. Messages on the legacy topics are only acted
+    on when legacy_topics is True. An access event that is the same as the door's last
+    event is dropped as a duplicate (counted in duplicate_events). A sequence number of 0,
+    or one going backwards, means the door's publisher has restarted and numbers its
+    events from the start again (counted in restarts), any other jump in the sequence
+    numbers is counted in missed_events
+    """
+    def __init__(self, legacy_topics=True):
+        self.legacy_topics = legacy_topics
+        self.doors = {}
+        self.active = {}
+
+        self.duplicate_events = 0
+        self.missed_events = 0
+        self.restarts = 0
+
+    def __len__(self):
+        return len(self.doors)
+
+    def door(self, door):
+        """
+        Return the access period of a door, a door is added the first time it is heard from,
+        raises ValueError for an invalid door id
+        """
+        access_period = self.doors.get(door)
+        if access_period is None:
+            if not is_valid_door(door):
+                raise ValueError("Invalid door id: {0!r}".format(door))
+            access_period = self.doors[door] = AccessPeriod(door)
+
+        return access_period
+
+    def handle(self, topic, msg):
+        """
+        Apply a message received on a door topic to the access period of its door. Returns
+        the event ('enter', 'exit' or 'user'), the AccessPeriod and the epoch seconds of an
+        enter or exit (None for a user code), or None if the message is not acted on. Raises
+        ValueError for a message that can not be acted on (eg. an invalid door id)
+        """
+        door_event = split_door_topic(topic)
+        if door_event is None:
+            return None
+
+        door, event = door_event
+        if event == 'event':
+            access_event = decode_event(msg)
+            if access_event.door != door:
+                # Only ever act on an event for the door whose topic it was published on
+                raise ValueError("Access event for door {0!r} on the topic of door {1!r}".format(
+                    access_event.door, door))
+            return self.handle_event(access_event)
+
+        if not self.legacy_topics:
+            return None
+
+        access_period = self.door(door)
+        msg_string = msg.decode('utf-8')
+        msg_epoch = None
+
+        if event == 'enter':
+            msg_epoch = parse_timestamp(msg_string)
+            self._enter(access_period, msg_epoch)
+
+        elif event == 'exit':
+            msg_epoch = parse_timestamp(msg_string)
+            self._exit(access_period, msg_epoch)
+
+        else:
+            access_period.user_code = msg_string
+
+        return event, access_period, msg_epoch
+
+    def handle_event(self, access_event):
+        """
+        Apply an AccessEvent to the access period of its door, returns the same as handle()
+        """
+        access_period = self.door(access_event.door)
+
+        last_event = access_period.last_event
+        if last_event is not None:
+            if access_event == last_event:
+                self.duplicate_events += 1
+                return None
+            if access_event.seq != (last_event.seq + 1) & 0xFFFFFFFF:
+                if access_event.seq == 0 or access_event.seq <= last_event.seq:
+                    self.restarts += 1
+                else:
+                    self.missed_events += 1
+        access_period.last_seq = access_event.seq
+        access_period.last_event = access_event
+
+        # The user code comes with the time, so there is no relying on the order of messages
+        access_period.user_code = access_event.user
+        if access_event.action == 'enter':
+            self._enter(access_period, access_event.epoch_ms / 1000)
+        else:
+            self._exit(access_period, access_event.epoch_ms / 1000)
+
+        return access_event.action, access_period, access_event.epoch_ms // 1000
+
+    def _enter(self, access_period, epoch):
+        access_period.start_time = datetime_from_epoch(epoch)
+        access_period.active = True  # Start the access period
+        self.active[access_period.door] = access_period
+
+    def _exit(self, access_period, epoch):
+        access_period.end_time = datetime_from_epoch(epoch)
+        access_period.active = False  # End the access period
+        self.active.pop(access_period.door, None)
@@ -1,4 +1,14 @@
+import argparse
+import io
+import json
+import os.path
+import sys
+
 import pandas as pd
+from log_partitions import read_partitioned_readings
+from parquet_log import read_parquet_readings
+from sqlite_log import query_readings
+from timestamps import TIMESTAMP_FORMAT, parse_timestamps
 
 # a function \that calculates the dew point based on temperature and humidity values.
 def calculate_dew_point(temperature, humidity):
@@ -6,114 +16,361 @@ def calculate_dew_point(temperature, humidity):
     return dew_point
 
 
+def find_access_periods(df):
+    """
+    Split the readings of every staff member into access periods, a new access period
+    starts whenever there is a gap of more than 1 second between two consecutive
+    readings of the same staff member. This is done for all staff members at once with
+    a single groupby on the 'User' column, the readings must already be sorted by time.
+    Returns the readings that were used (with their 'Dew Point' and 'Period' number
+    added) and one row per access period, in the order the periods first appear
+    """
+    # Readings with no temperature or humidity can't be used
+    readings = df.dropna(subset=['Temperature (C)', 'Humidity (%)'])
+    readings = readings.assign(**{'Dew Point': calculate_dew_point(readings['Temperature (C)'],
+                                                                  readings['Humidity (%)'])})
+
+    # The first reading of a staff member (no previous reading) or one more than a second
+    # after the previous reading starts a new period, counting them up per staff member
+    # gives every reading the number of the access period it belongs to
+    by_user = readings.groupby('User', sort=False)
+    gaps = by_user['Timestamp'].diff()
+    new_period = gaps.isna() | (gaps > pd.Timedelta(seconds=1))
+    readings = readings.assign(Period=new_period.astype(int).groupby(readings['User'], sort=False).cumsum())
+
+    periods = readings.groupby(['User', 'Period'], sort=False).agg(**{
+        'Start Time': ('Timestamp', 'first'),
+        'End Time': ('Timestamp', 'last'),
+        'Highest Temperature': ('Temperature (C)', 'max'),
+        'Lowest Dew Point': ('Dew Point', 'min'),
+    }).reset_index()
+    periods['Duration (seconds)'] = [(end_time - start_time).total_seconds() for start_time, end_time
+                                     in zip(periods['Start Time'], periods['End Time'])]
+
+    return readings, periods
+
+
+def access_period_lines(access_period):
+    return [f"Access Period:",
+            f"  Start Time: {access_period['Start Time']}",
+            f"  End Time: {access_period['End Time']}",
+            f"  Duration (seconds): {access_period['Duration (seconds)']}",
+            f"  Highest Temperature: {access_period['Highest Temperature']}",
+            f"  Lowest Dew Point: {access_period['Lowest Dew Point']}"]
+
+
+def staff_member_total_lines(access_periods):
+    # The total is added up in period order and the lowest dew point reported is the one
+    # of the last access period, as they always have been
+    total_time = sum(access_period['Duration (seconds)'] for access_period in access_periods)
+    lowest_dew_point = access_periods[-1]['Lowest Dew Point'] if access_periods else float('inf')
+
+    return [f"Total Time: {total_time}",
+            f"Lowest Dew Point Recorded: {lowest_dew_point}\n"]
+
+
 def process_access_periods(df):
-    # find the staff member code from the 'User' column
-    staff_members = df['User'].unique()
-
-    for staff_member in staff_members:
-        # filter the data for the current staff member
-        staff_data = df[df['User'] == staff_member]
-
-        ## Initialize variables for tracking access periods
-        access_periods = []
-        total_time = 0
-        lowest_dew_point = float('inf')
-
-        start_time = None
-        end_time = None
-        highest_temperature = float('-inf')
-        access_readings = []
-
-        # iterating over each row in the staff member's data
-        for _, row in staff_data.iterrows():
-            timestamp = pd.to_datetime(row['Timestamp'])
-            temperature = row['Temperature (C)']
-            humidity = row['Humidity (%)']
-
-            if pd.isnull(temperature) or pd.isnull(humidity):
-                continue
-            # Check if it's the first row for an access period
-            if start_time is None:
-                start_time = timestamp
-                end_time = timestamp
-                highest_temperature = temperature
-            else:
-                # Check if the time gap between the current row and the previous row is more than 1 second
-
-                if (timestamp - end_time).total_seconds() > 1:
-                    access_periods.append({
-                        'Staff Member': staff_member,
-                        'Start Time': start_time,
-                        'End Time': end_time,
-                        'Duration (seconds)': (end_time - start_time).total_seconds(),
-                        'Highest Temperature': highest_temperature,
-                        'Lowest Dew Point': lowest_dew_point,
-                        'Readings': access_readings
-                    })
-
-                    # Update total time and reset variables for the next access period
-
-                    total_time += (end_time - start_time).total_seconds()
-                    lowest_dew_point = float('inf')
-
-                    start_time = timestamp
-                    highest_temperature = temperature
-                    access_readings = []
-
-            end_time = timestamp
-            highest_temperature = max(highest_temperature, temperature)
-            dew_point = calculate_dew_point(temperature, humidity)
-            lowest_dew_point = min(lowest_dew_point, dew_point)
-            access_readings.append({
-                'Timestamp': timestamp,
-                'Temperature': temperature,
-                'Humidity': humidity,
-                'Dew Point': dew_point
-            })
-
-        # Add the last access period if it's ongoing at the end of the data
-
-        if start_time is not None:
-            access_periods.append({
-                'Staff Member': staff_member,
-                'Start Time': start_time,
-                'End Time': end_time,
-                'Duration (seconds)': (end_time - start_time).total_seconds(),
-                'Highest Temperature': highest_temperature,
-                'Lowest Dew Point': lowest_dew_point,
-                'Readings': access_readings
-            })
-
-            total_time += (end_time - start_time).total_seconds()
+    readings, periods = find_access_periods(df)
+
+    # Positions of the readings of each access period, in time order
+    period_readings = readings.groupby(['User', 'Period'], sort=False).indices
+    timestamps = readings['Timestamp'].tolist()
+    temperatures = readings['Temperature (C)'].tolist()
+    humidities = readings['Humidity (%)'].tolist()
+    dew_points = readings['Dew Point'].tolist()
+
+    periods_by_user = {}
+    for access_period in periods.to_dict('records'):
+        periods_by_user.setdefault(access_period['User'], []).append(access_period)
+
+    for staff_member in df['User'].unique():
+        access_periods = periods_by_user.get(staff_member, [])
 
         # Print the results for the staff member
-        print(f"Staff Member: {staff_member}")
+        lines = [f"Staff Member: {staff_member}"]
+        for access_period in access_periods:
+            lines.extend(access_period_lines(access_period))
+            lines.append(f"  Readings:")
+            for i in period_readings[(staff_member, access_period['Period'])]:
+                lines.append(
+                    f"    Timestamp: {timestamps[i]}, Temperature: {temperatures[i]}, Humidity: {humidities[i]}, Dew Point: {dew_points[i]}")
+
+        lines.extend(staff_member_total_lines(access_periods))
+        print("\n".join(lines))
+
+class AccessPeriodTracker:
+    """
+    Keeps the running state of the access periods so that readings can be added to it a
+    batch at a time, the summaries of the access periods that have ended are kept along
+    with, for every staff member, the access period that is still open (the one that the
+    next readings may continue). Readings must be added in time order
+    """
+    _PERIOD_FIELDS = ('Start Time', 'End Time', 'Highest Temperature', 'Lowest Dew Point')
+
+    def __init__(self):
+        self.staff_members = []
+        self.closed_periods = {}
+        self.open_periods = {}
+
+    def update(self, readings):
+        _, periods = find_access_periods(readings)
+
+        for period in periods.to_dict('records'):
+            staff_member = period['User']
+            period = {field: period[field] for field in self._PERIOD_FIELDS}
+
+            open_period = self.open_periods.get(staff_member)
+            if open_period is None:
+                if staff_member not in self.closed_periods:
+                    self.staff_members.append(staff_member)
+                    self.closed_periods[staff_member] = []
+            elif (period['Start Time'] - open_period['End Time']).total_seconds() > 1:
+                self.closed_periods[staff_member].append(open_period)
+            else:
+                # The first access period in these readings carries on the open one
+                period['Start Time'] = open_period['Start Time']
+                period['Highest Temperature'] = max(open_period['Highest Temperature'],
+                                                    period['Highest Temperature'])
+                period['Lowest Dew Point'] = min(open_period['Lowest Dew Point'], period['Lowest Dew Point'])
+
+            self.open_periods[staff_member] = period
+
+    def access_periods(self, staff_member):
+        access_periods = list(self.closed_periods[staff_member])
+        if staff_member in self.open_periods:
+            access_periods.append(self.open_periods[staff_member])
+
+        return [dict(access_period,
+                     **{'Duration (seconds)': (access_period['End Time'] -
+                                               access_period['Start Time']).total_seconds()})
+                for access_period in access_periods]
+
+    def to_dict(self):
+        def encode(period):
+            return dict(period, **{'Start Time': period['Start Time'].isoformat(),
+                                   'End Time': period['End Time'].isoformat()})
+
+        return {'staff_members': self.staff_members,
+                'closed_periods': {staff_member: [encode(period) for period in periods]
+                                   for staff_member, periods in self.closed_periods.items()},
+                'open_periods': {staff_member: encode(period)
+                                 for staff_member, period in self.open_periods.items()}}
+
+    @classmethod
+    def from_dict(cls, state):
+        def decode(period):
+            return dict(period, **{'Start Time': pd.Timestamp(period['Start Time']),
+                                   'End Time': pd.Timestamp(period['End Time'])})
+
+        tracker = cls()
+        tracker.staff_members = list(state['staff_members'])
+        tracker.closed_periods = {staff_member: [decode(period) for period in periods]
+                                  for staff_member, periods in state['closed_periods'].items()}
+        tracker.open_periods = {staff_member: decode(period)
+                                for staff_member, period in state['open_periods'].items()}
+        return tracker
+
+
+def print_access_period_summary(tracker):
+    """
+    Print the report from the tracked access periods, the same as the full report but
+    without the individual readings
+    """
+    for staff_member in tracker.staff_members:
+        access_periods = tracker.access_periods(staff_member)
+
+        lines = [f"Staff Member: {staff_member}"]
         for access_period in access_periods:
-            print(f"Access Period:")
-            print(f"  Start Time: {access_period['Start Time']}")
-            print(f"  End Time: {access_period['End Time']}")
-            print(f"  Duration (seconds): {access_period['Duration (seconds)']}")
-            print(f"  Highest Temperature: {access_period['Highest Temperature']}")
-            print(f"  Lowest Dew Point: {access_period['Lowest Dew Point']}")
-            print(f"  Readings:")
-            for reading in access_period['Readings']:
-                print(
-                    f"    Timestamp: {reading['Timestamp']}, Temperature: {reading['Temperature']}, Humidity: {reading['Humidity']}, Dew Point: {reading['Dew Point']}")
-
-        print(f"Total Time: {total_time}")
-        print(f"Lowest Dew Point Recorded: {lowest_dew_point}\n")
-
-# Read the CSV file into a pandas DataFrame
-df = pd.read_csv('bme680_data.csv')
-
-# Drop any rows with missing values
-df = df.dropna()
-
-# Convert the 'Timestamp' column to datetime format
-df['Timestamp'] = pd.to_datetime(df['Timestamp'])
-
-# Sort the DataFrame by timestamp
-df = df.sort_values(by='Timestamp')
-
-# Process the access periods
-process_access_periods(df)
+            lines.extend(access_period_lines(access_period))
+
+        lines.extend(staff_member_total_lines(access_periods))
+        print("\n".join(lines))
+
+
+def parse_log_timestamps(df):
+    """
+    Return the time of every row of the log as a datetime, newer logs hold epoch seconds
+    in an 'Epoch' column, legacy logs hold "dd/mm/YYYY HH:MM:SS" strings in 'Timestamp'
+    which are parsed with that fixed format (so that the day and month are never swapped)
+    """
+    if 'Epoch' in df.columns:
+        return pd.to_datetime(df['Epoch'], unit='s')
+
+    epochs = parse_timestamps(df['Timestamp'])
+    if epochs is None:
+        # Let pandas find (and report) the timestamps that are not in the expected format
+        return pd.to_datetime(df['Timestamp'], format=TIMESTAMP_FORMAT)
+
+    return pd.Series(pd.to_datetime(epochs, unit='s'), index=df.index)
+
+
+def prepare_readings(df):
+    # Drop any rows with missing values
+    df = df.dropna()
+
+    # Convert the 'Timestamp' column to datetime format
+    df = df.assign(Timestamp=parse_log_timestamps(df))
+
+    # Sort the DataFrame by timestamp, the subscriber logs the rows in time order so this is
+    # only needed when some rows are found out of order
+    if not df['Timestamp'].is_monotonic_increasing:
+        df = df.sort_values(by='Timestamp')
+
+    return df
+
+
+def filter_readings(df, user=None, since=None, until=None):
+    if user is not None:
+        df = df[df['User'] == user]
+    if since is not None:
+        df = df[df['Timestamp'] >= since]
+    if until is not None:
+        df = df[df['Timestamp'] < until]
+
+    return df
+
+
+def load_checkpoint(checkpoint_path, file_path):
+    if os.path.isfile(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+
+        if checkpoint['log_file'] == os.path.abspath(file_path):
+            return checkpoint['offset'], AccessPeriodTracker.from_dict(checkpoint['tracker'])
+
+    return 0, AccessPeriodTracker()
+
+
+def save_checkpoint(checkpoint_path, file_path, offset, tracker):
+    # Written to a temporary file first so that an interrupted run never leaves a broken
+    # checkpoint behind
+    temp_path = checkpoint_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'log_file': os.path.abspath(file_path), 'offset': offset, 'tracker': tracker.to_dict()}, f)
+
+    os.replace(temp_path, checkpoint_path)
+
+
+def run_incremental(file_path, checkpoint_path):
+    """
+    Bring the access periods saved in the checkpoint up to date with the rows appended
+    to the log since the last run, only those new bytes are read and parsed
+    """
+    offset, tracker = load_checkpoint(checkpoint_path, file_path)
+
+    # A log that is now smaller than the checkpointed offset has been replaced, start again
+    if os.path.getsize(file_path) < offset:
+        offset, tracker = 0, AccessPeriodTracker()
+
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        if not header.endswith(b'\n'):
+            # Nothing has been logged yet
+            return tracker
+
+        columns = pd.read_csv(io.BytesIO(header), nrows=0).columns.tolist()
+        f.seek(max(offset, f.tell()))
+        offset = f.tell()
+        data = f.read()
+
+    # Only whole rows are used, a partly written last row is picked up by the next run
+    data = data[:data.rfind(b'\n') + 1]
+
+    if data:
+        new_rows = pd.read_csv(io.BytesIO(data), names=columns, header=None)
+        tracker.update(prepare_readings(new_rows))
+
+    save_checkpoint(checkpoint_path, file_path, offset + len(data), tracker)
+
+    return tracker
+
+
+def run_chunked(file_path, chunksize):
+    """
+    Find the access periods by streaming the log chunksize rows at a time, the open access
+    periods are carried from one chunk to the next so only one chunk (and the period
+    summaries) is ever held in memory. Returns None if rows are found out of time order
+    across chunks, which can only be put right by sorting the whole log
+    """
+    tracker = AccessPeriodTracker()
+    last_timestamp = None
+
+    for chunk in pd.read_csv(file_path, chunksize=chunksize):
+        readings = prepare_readings(chunk)
+        if readings.empty:
+            continue
+
+        if last_timestamp is not None and readings['Timestamp'].iloc[0] < last_timestamp:
+            return None
+
+        tracker.update(readings)
+        last_timestamp = readings['Timestamp'].iloc[-1]
+
+    return tracker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the access periods recorded in the sensor log")
+    parser.add_argument('log_file', nargs='?', default='bme680_data.csv')
+    parser.add_argument('--incremental', action='store_true',
+                        help="only process the rows added since the last run, the access periods found so far "
+                             "are kept in the checkpoint file, the readings themselves are not reported")
+    parser.add_argument('--checkpoint', help="checkpoint file used by --incremental (default: <log_file>.report.json)")
+    parser.add_argument('--chunksize', type=int,
+                        help="read the log this many rows at a time to keep memory use bounded, the readings "
+                             "themselves are not reported")
+    parser.add_argument('--sqlite', metavar='DB', help="read the readings from this SQLite log database instead")
+    parser.add_argument('--parquet', metavar='DIR', help="read the readings from this Parquet history instead")
+    parser.add_argument('--partitions', metavar='DIR', help="read the readings from this partitioned log instead")
+    parser.add_argument('--door', help="only report on this door (partitioned or SQLite log only)")
+    parser.add_argument('--user', help="only report on this staff member")
+    parser.add_argument('--since', type=pd.Timestamp, help="only report on readings from this time on, eg. 2023-05-12")
+    parser.add_argument('--until', type=pd.Timestamp, help="only report on readings before this time")
+    args = parser.parse_args()
+
+    # The access periods found incrementally or chunk by chunk are kept for the whole log, so the
+    # readings can not be filtered by user or time in those modes
+    if (args.incremental or args.chunksize) and (args.user or args.since is not None or args.until is not None):
+        parser.error("--user, --since and --until can not be used with --incremental or --chunksize")
+
+    if args.incremental:
+        tracker = run_incremental(args.log_file, args.checkpoint or args.log_file + '.report.json')
+        print_access_period_summary(tracker)
+        return
+
+    if args.chunksize:
+        tracker = run_chunked(args.log_file, args.chunksize)
+        if tracker is None:
+            print("Rows are out of time order across chunks, reading the whole log instead", file=sys.stderr)
+            tracker = AccessPeriodTracker()
+            tracker.update(prepare_readings(pd.read_csv(args.log_file)))
+
+        print_access_period_summary(tracker)
+        return
+
+    if args.door and not (args.partitions or args.sqlite):
+        parser.error("--door needs --partitions or --sqlite")
+
+    if args.sqlite or args.parquet or args.partitions:
+        # The user and time range are part of the query, so only the matching rows are read
+        query = dict(user=args.user,
+                     start=int(args.since.timestamp()) if args.since is not None else None,
+                     end=int(args.until.timestamp()) if args.until is not None else None)
+        if args.sqlite:
+            df = query_readings(args.sqlite, door=args.door, **query)
+        elif args.parquet:
+            df = read_parquet_readings(args.parquet, **query)
+        else:
+            df = read_partitioned_readings(args.partitions, door=args.door, **query)
+        process_access_periods(prepare_readings(df))
+        return
+
+    # Read the CSV file into a pandas DataFrame
+    df = pd.read_csv(args.log_file)
+
+    # Process the access periods
+    process_access_periods(filter_readings(prepare_readings(df), args.user, args.since, args.until))
+
+
+if __name__ == "__main__":
+    main()
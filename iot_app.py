@@ -9,12 +9,17 @@ Notes: Base module for all simulated ESP32 MicroPython application code used on
 """
 # Imports
 import datetime
+import os
+import random
 import threading
+import time
 import uuid
 from time import sleep
-from tkinter import *
 from machine import Pin
-from mqtt_simple_ex import MQTTClientEx
+from scheduler import Scheduler
+
+# tkinter is only imported by run_gui(), and paho (by way of mqtt_simple_ex) by register_to_mqtt(), so
+# a headless app does not load the GUI at all and the MQTT client is loaded on the network thread
 
 # Change this to get a good size for your OLED font to fit 16 characters by 3 lines, for a 4K screen the value
 # 18 is about right, for a 1080 screen 36 is about the right size, screens of other sizes should be able to
@@ -57,17 +62,114 @@ class RunStates:
     DEINITIALISING = 5
     SHUTTING_DOWN = 6
 
+def retry_with_backoff(attempt, deadline, initial_delay=0.5, max_delay=8.0):
+    """
+    Call attempt() until it returns True or the time.monotonic() deadline has passed,
+    waiting twice as long after each failure, from initial_delay up to max_delay (less a
+    random part of it, so apps restarted together do not all retry together), an OSError
+    raised by attempt() counts as a failure. Returns True if attempt() succeeded
+    """
+    delay = initial_delay
+    while True:
+        try:
+            if attempt():
+                return True
+        except OSError:
+            pass
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+
+        sleep(min(remaining, delay * random.uniform(0.5, 1.0)))
+        delay = min(delay * 2, max_delay)
+
+
+class _HeadlessCanvas:
+    """
+    Stands in for the OLED canvas of the GUI when the app is headless, it keeps the text
+    items on it and, when log is True, show() prints their text (top to bottom, left to right)
+    when it differs from the text last printed, at most every interval seconds (apps display
+    the OLED many times a second)
+    """
+    def __init__(self, log=False, interval=1.0):
+        self.log = log
+        self.interval = interval
+        self.items = {}
+        self.next_item = 1
+        self.shown = []
+        self.last_shown = None
+
+    def config(self, **kwargs):
+        pass
+
+    def create_text(self, x, y, text="", **kwargs):
+        item = self.next_item
+        self.next_item += 1
+        self.items[item] = [y, x, text]
+        return item
+
+    def itemconfig(self, item, text=None, **kwargs):
+        if text is not None:
+            self.items[item][2] = text
+
+    def delete(self, *items):
+        for item in items:
+            if item == "all":
+                self.items.clear()
+            else:
+                self.items.pop(item, None)
+
+    def show(self):
+        if not self.log:
+            return
+
+        texts = [text for _, _, text in sorted(self.items.values())]
+        if texts == self.shown:
+            return
+
+        now = time.monotonic()
+        if self.last_shown is None or now - self.last_shown >= self.interval:
+            self.shown = texts
+            self.last_shown = now
+            print("OLED: {0}".format(" | ".join(texts)))
+
+
+class _HeadlessLabel:
+    """
+    Stands in for the label of a NeoPixel in the GUI when the app is headless, it only
+    remembers its colour
+    """
+    def __init__(self):
+        self.bg = "#708090"
+
+    def __getitem__(self, key):
+        return self.bg
+
+    def config(self, bg=None, **kwargs):
+        if bg is not None:
+            self.bg = bg
+
+
 class IoTApp:
-    _DEFAULT_LOOP_SLEEP_TIME = 0.1
+    _DEFAULT_LOOP_SLEEP_TIME = 0.1  # Seconds from the start of one loop() to the next, 0 for back-to-back
+    _DEFAULT_NETWORK_DEADLINE = 30
+    _DEFAULT_GUI_FRAME_RATE = 30  # Most GUI updates a second, any more are coalesced
+    _DEFAULT_GUI_TIMEOUT = 30  # Seconds allowed for the GUI to be built before the app gives up on it
 
     _NTP_DEFAULT_PORT = 123
     _NTP_DEFAULT_TIMEOUT = 1
     _DAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
 
     def __init__(self, name, has_oled_board=True, i2c_freq=None, finish_button="C",
-                 start_verbose=True, apply_bst=True, debug_on=True):
+                 start_verbose=True, apply_bst=True, debug_on=True, headless=False, log_display=False,
+                 gui_frame_rate=_DEFAULT_GUI_FRAME_RATE, loop_period=_DEFAULT_LOOP_SLEEP_TIME):
+        # A headless app has no GUI (so no Tk, and no display needed), the OLED and NeoPixels are
+        # drawn on stand-ins that do nothing or, with log_display, print what they show
         self.name = name if len(name) < 15 else name[:15]
         self.start_verbose = start_verbose
+        self.headless = headless
+        self.log_display = log_display
 
         self.rig = Rig()
         self.has_oled_board = has_oled_board
@@ -79,7 +181,26 @@ class IoTApp:
         self.oled_foreground = 1
         self.oled_on = True
 
+        # The OLED is retained, oled_clear() and oled_text() only build the next frame (the text
+        # at each position and the background) and oled_display() hands it to the GUI, which
+        # changes just the canvas items whose text or colour differ from the frame displayed
+        # before
+        self.oled_lock = threading.Lock()
+        self.oled_bg = "#000000"
+        self.oled_texts = {}  # (x, y) on the canvas -> (text, fill) of the next frame
+        self.oled_bg_shown = None
+        self.oled_items = {}  # (x, y) on the canvas -> [item, text, fill] displayed, GUI thread only
+        self.oled_frames = 0
+        self.oled_changes = 0  # Canvas calls made to display the frames
+        self.oled_render_time = 0.0
+        self.oled_max_render_time = 0.0
+
         self.finished = False
+
+        # loop() is run every loop_period seconds by the scheduler, along with any tasks the app
+        # adds to it in init() to run at rates of their own, eg. self.scheduler.add("name", 0.5, fn)
+        self.loop_period = loop_period
+        self.scheduler = Scheduler()
         
         self.cmd_btn_a = self.btnA_handler
         self.cmd_btn_b = self.btnB_handler
@@ -107,12 +228,34 @@ class IoTApp:
         self.btn_c = None
         self.oled_canvas = None
         self.neopixel_lbls = []
-        self.gui_ready = False
+        self.neopixels_shown = None
+        self.gui_ready = threading.Event()  # Set once the GUI's widgets are built (or building them failed)
+        self.gui_error = None
+
+        # Tk widgets are only touched on the GUI thread, every change to the display is posted as
+        # a command (see gui_post()) and the commands are applied together by gui_update() at most
+        # gui_frame_rate times a second, a command replacing any still waiting with the same key
+        self.gui_frame_rate = gui_frame_rate
+        self.gui_lock = threading.Lock()
+        self.gui_commands = {}  # Key -> (command, args, kwargs) waiting to be applied, in the order posted
+        self.gui_posted = 0
+        self.gui_applied = 0
+        self.gui_frames = 0
 
         self.wifi = False
         self.rtc = RTC()
         self.mqtt_id = "{0}-{1}".format("".join(self.name.split()), self.rig.id)
         self.mqtt_client = None
+
+        # Set by start_network() once the network is up (or has run out of time), network_status
+        # holds whether each step succeeded and network_times when it finished, in seconds from
+        # the start of run_loop()
+        self.network_thread = None
+        self.network_ready = threading.Event()
+        self.network_status = {}
+        self.network_times = {}
+        self.run_started = None
+        self.first_loop_time = None
         
         self.exit_code = 0
         self.run_state = RunStates.NOT_STARTED
@@ -122,14 +265,48 @@ class IoTApp:
         self.wifi = True
 
     def run(self):
-        self.gui_thread.start()
-
-        while not self.gui_ready:
-            pass
+        # The GUI is built on its thread while startup() and init() run, what they display is
+        # posted (see gui_post()) and shown once it is ready, run_loop() waits for it before the
+        # first loop()
+        if self.headless:
+            self.run_headless()
+        else:
+            self.gui_thread.start()
 
         self.run_loop()
 
+    def run_headless(self):
+        self.oled_canvas = _HeadlessCanvas(log=self.log_display)
+        self.neopixel_lbls.extend(_HeadlessLabel() for _ in range(32))
+        self.gui_ready.set()
+
+    def wait_for_gui(self, timeout=_DEFAULT_GUI_TIMEOUT):
+        # Returns True once the GUI is ready, False if it failed or is still not ready after timeout
+        if not self.gui_ready.wait(timeout):
+            print("GUI not ready after {0} s".format(timeout))
+            return False
+        if self.gui_error is not None:
+            print("GUI could not be built: {0}".format(self.gui_error))
+            return False
+
+        return True
+
     def run_gui(self):
+        try:
+            self.build_gui()
+        except Exception as e:
+            # Wakes run_loop() rather than leaving it to wait for a GUI that will never be ready
+            self.gui_error = e
+            self.gui_ready.set()
+            return
+
+        self.gui_ready.set()
+        self.root.after(0, self.gui_update)
+        self.root.mainloop()
+
+    def build_gui(self):
+        from tkinter import Tk, Frame, Button, Canvas, Label
+
         self.root = Tk()
         self.root.iconbitmap("mcu.ico")
         self.root.title(self.name)
@@ -163,22 +340,87 @@ class IoTApp:
             self.neopixel_lbls.append(Label(self.neopixel_frame, text="", bg="#708090"))
             self.neopixel_lbls[i].place(x=68 + ((i % 8) * 54), y=8 + ((i // 8) * 54), width=50, height=50)
 
-        self.gui_ready = True
-        self.root.mainloop()
+    def gui_post(self, key, command, *args, **kwargs):
+        """
+        Have command(*args, **kwargs) change the display on the GUI thread, replacing any command
+        with the same key not yet applied, so only the latest change of anything shown is made.
+        Can be called from any thread, it never waits for the GUI. A headless app has no GUI
+        thread, so the command is applied straight away
+        """
+        with self.gui_lock:
+            self.gui_posted += 1
+            if self.headless:
+                self.gui_applied += 1
+                command(*args, **kwargs)
+                return
+
+            # Moved to the end, so the commands are still applied in the order they were posted
+            self.gui_commands.pop(key, None)
+            self.gui_commands[key] = (command, args, kwargs)
+
+    def gui_apply(self):
+        """
+        Apply the commands posted since the last call, on the GUI thread, returns how many
+        """
+        with self.gui_lock:
+            commands = self.gui_commands
+            self.gui_commands = {}
+
+        for command, args, kwargs in commands.values():
+            command(*args, **kwargs)
+
+        self.gui_applied += len(commands)
+        return len(commands)
+
+    def gui_update(self):
+        started = time.perf_counter()
+        if self.gui_apply():
+            self.gui_frames += 1
+
+        # Every 1 / gui_frame_rate seconds however long applying the commands took
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.root.after(max(1, int(1000 / self.gui_frame_rate - elapsed_ms)), self.gui_update)
 
     def run_loop(self):
+        self.run_started = time.perf_counter()
         self.run_state = RunStates.STARTING
         self.startup()
             
         self.run_state = RunStates.INITIALISING
         self.init()
 
+        if not self.wait_for_gui():
+            # Nothing to loop with, so clean up and end with the code of the state it got to
+            self.deinit()
+            self.exit_code = self.run_state
+            print("\nTerminated with code: {0} <ERROR>".format(self.exit_code))
+            return
+
         self.run_state = RunStates.LOOPING
-        while not self.finished:
-            self.loop()
+        self.first_loop_time = time.perf_counter() - self.run_started
+        if self.debug_on:
+            print("First loop {0:.3f} s after starting".format(self.first_loop_time))
+
+        # Added last, so when tasks are due at the same time as loop() they run before it
+        self.scheduler.add("loop", self.loop_period, self.loop)
+        self.scheduler.run(lambda: self.finished)
             
         self.run_state = RunStates.DEINITIALISING
         self.deinit()
+
+        if self.debug_on:
+            # A task run once, like a loop() that does all its work without returning, has no rate
+            # to report on
+            for task in self.scheduler.tasks:
+                if task.runs > 1:
+                    print(task.metrics())
+        if self.debug_on and self.gui_frames:
+            print("GUI: {0} frames, {1} of {2} commands applied (the rest coalesced)".format(
+                self.gui_frames, self.gui_applied, self.gui_posted))
+        if self.debug_on and self.oled_frames:
+            print("OLED: {0} frames displayed, {1:.1f} us/frame (max {2:.1f} us), {3:.2f} canvas changes/frame".format(
+                self.oled_frames, self.oled_render_time / self.oled_frames * 1e6, self.oled_max_render_time * 1e6,
+                self.oled_changes / self.oled_frames))
             
         self.run_state = RunStates.SHUTTING_DOWN
         self.shutdown()
@@ -190,10 +432,12 @@ class IoTApp:
         
     def startup(self):
         if self.oled_on:
-            if self.start_verbose:
+            # There is nobody to see the name shown when headless, so no waiting for them to
+            if self.start_verbose and not self.headless:
                 self.oled_invert()
                 self.oled_clear()
                 self.oled_text(self.name, int((128 - (len(self.name) * 8)) / 2), 12)
+                self.oled_display()
                 sleep(2)
                 self.oled_invert()
             else:
@@ -218,19 +462,78 @@ class IoTApp:
         if self.oled_on:
             self.oled_background = 0 if self.oled_background else 1
             self.oled_foreground = 0 if self.oled_foreground else 1
-            self.oled_canvas.config(bg="#000000" if not self.oled_background else "#ffffff")
+
+            # Without waiting for oled_display(), as on the OLED itself
+            with self.oled_lock:
+                self.oled_bg = "#000000" if not self.oled_background else "#ffffff"
+                self.gui_post("oled_bg", self._oled_render_bg, self.oled_bg)
 
     def oled_display(self):
-        pass
+        with self.oled_lock:
+            # A copy, as oled_text() can go on adding to the frame before it is rendered
+            self.gui_post("oled", self._oled_render, self.oled_bg, dict(self.oled_texts))
+
+    def _oled_render_bg(self, bg):
+        if bg != self.oled_bg_shown:
+            self.oled_canvas.config(bg=bg)
+            self.oled_bg_shown = bg
+            self.oled_changes += 1
+
+    def _oled_render(self, bg, texts):
+        # Called on the GUI thread with the latest frame displayed
+        started = time.perf_counter()
+        canvas = self.oled_canvas
+        items = self.oled_items
+        changes = 0
+
+        self._oled_render_bg(bg)
+
+        for position, (text, fill) in texts.items():
+            item = items.get(position)
+            if item is None:
+                items[position] = [canvas.create_text(position[0], position[1], anchor="nw", fill=fill,
+                                                      font=("Lucida Console", OLED_FONT_SIZE), text=text),
+                                   text, fill]
+            elif item[1] != text or item[2] != fill:
+                canvas.itemconfig(item[0], text=text, fill=fill)
+                item[1] = text
+                item[2] = fill
+            else:
+                continue
+            changes += 1
+
+        # Every position of the frame has an item now, so any more are left over from before
+        if len(items) > len(texts):
+            for position in [position for position in items if position not in texts]:
+                canvas.delete(items.pop(position)[0])
+                changes += 1
+
+        if self.headless:
+            canvas.show()
+
+        elapsed = time.perf_counter() - started
+        self.oled_frames += 1
+        self.oled_changes += changes
+        self.oled_render_time += elapsed
+        self.oled_max_render_time = max(self.oled_max_render_time, elapsed)
+
+    def neopixel_write(self):
+        # Called by NeoPixel.write(), only the headless stand-ins have anything to print
+        if self.headless and self.log_display:
+            colours = [label["bg"] for label in self.neopixel_lbls]
+            if colours != self.neopixels_shown:
+                self.neopixels_shown = colours
+                print("NeoPixels: {0}".format(" ".join(colours)))
 
     def oled_clear(self, colour=None):
         if self.oled_on:
-            if colour:
-                self.oled_canvas.config(bg="#000000" if colour == 0 else "#ffffff")
-            else:
-                self.oled_canvas.config(bg="#000000" if not self.oled_background else "#ffffff")
+            with self.oled_lock:
+                if colour:
+                    self.oled_bg = "#000000" if colour == 0 else "#ffffff"
+                else:
+                    self.oled_bg = "#000000" if not self.oled_background else "#ffffff"
 
-            self.oled_canvas.delete("all")
+                self.oled_texts = {}
 
     def oled_pixel(self, x, y, colour=None):
         pass
@@ -259,9 +562,9 @@ class IoTApp:
             if colour:
                 fill = "#000000" if colour == 0 else "#ffffff"
 
-            self.oled_canvas.create_text(xpos, ypos, anchor="nw", fill=fill,
-                                         font=("Lucida Console", OLED_FONT_SIZE),
-                                         text=text)
+            # Text at the same position as text earlier in the frame replaces it
+            with self.oled_lock:
+                self.oled_texts[(xpos, ypos)] = (text, fill)
 
     def oled_scroll(self, dx=0, dy=0):
         if self.oled_on:
@@ -317,13 +620,88 @@ class IoTApp:
         return self._set_rtc()
     
     def register_to_mqtt(self, server, port=0, last_will=None, sub_callback=None, user=None, password=None,
-                         keepalive=0, ssl=False, ssl_params={}):
-        self.mqtt_client = MQTTClientEx(client_id=self.mqtt_id)
+                         keepalive=0, ssl=False, ssl_params={}, network_thread=False):
+        # The MQTT_ADDR environment variable overrides the broker asked for, either way "local"
+        # selects the local broker, which is started in this process if it is not running yet
+        from local_broker import LOCAL_BROKER, start_local_broker
+        from mqtt_simple_ex import MQTTClientEx
 
-        if sub_callback:
-            self.mqtt_client.msg_callback = sub_callback
+        server = os.environ.get('MQTT_ADDR', server)
+        if server == LOCAL_BROKER:
+            server, port = start_local_broker(port or 1883)
 
-        self.mqtt_client.connect(server, port, keepalive=60)
+        mqtt_client = MQTTClientEx(client_id=self.mqtt_id)
+
+        if sub_callback:
+            mqtt_client.msg_callback = sub_callback
+
+        mqtt_client.connect(server, port, keepalive=60)
+
+        if network_thread:
+            mqtt_client.start_network_thread()
+
+        # Only set once connected, so an app bringing the network up on another thread can take
+        # a client that is there to mean one that is connected
+        self.mqtt_client = mqtt_client
+
+    def start_network(self, wifi_settings, mqtt_settings=None, ntp_settings=None, deadline=_DEFAULT_NETWORK_DEADLINE):
+        """
+        Bring the network up on a thread of its own, so that init() can carry on setting up
+        the sensor and NeoPixels and loop() can start taking readings straight away. WiFi
+        is connected first, then the MQTT broker is registered with (register_to_mqtt()
+        with the mqtt_settings keyword arguments) and the RTC is set from NTP
+        (set_rtc_by_ntp() with the ntp_settings keyword arguments) at the same time, either
+        can be left out. Every step is retried with exponential backoff until it succeeds or
+        deadline seconds have passed, network_event() is called as each step finishes and
+        network_ready is set once they all have
+        """
+        give_up = time.monotonic() + deadline
+
+        def step(name, attempt):
+            ok = retry_with_backoff(attempt, give_up)
+            self.network_status[name] = ok
+            self.network_times[name] = time.perf_counter() - (self.run_started or started)
+            self.network_event(name, ok)
+            return ok
+
+        def connect_wifi():
+            self.connect_to_wifi(wifi_settings=wifi_settings)
+            return self.is_wifi_connected()
+
+        def register():
+            self.register_to_mqtt(**mqtt_settings)
+            return True
+
+        def bring_up():
+            try:
+                if step('wifi', connect_wifi):
+                    steps = []
+                    if mqtt_settings is not None:
+                        steps.append(threading.Thread(target=step, args=('mqtt', register), daemon=True))
+                    if ntp_settings is not None:
+                        steps.append(threading.Thread(target=step, args=('ntp', lambda: self.set_rtc_by_ntp(
+                            **ntp_settings)), daemon=True))
+                    for thread in steps:
+                        thread.start()
+                    for thread in steps:
+                        thread.join()
+            finally:
+                self.network_ready.set()
+
+        started = time.perf_counter()
+        self.network_ready.clear()
+        self.network_thread = threading.Thread(target=bring_up, name="network", daemon=True)
+        self.network_thread.start()
+        return self.network_thread
+
+    def network_event(self, step, ok):
+        """
+        Called on the network thread as each step started by start_network() finishes, step
+        is 'wifi', 'mqtt' or 'ntp' and ok is whether it succeeded, override it to act on the
+        network coming up (subscribe to topics once the MQTT broker is registered with, for
+        instance)
+        """
+        pass
 
     def init(self):
         pass
@@ -0,0 +1,273 @@
+# File: local_broker.py
+# Notes: Small MQTT 3.1.1 broker for running the publisher and subscriber offline, it implements
+#        the part of MQTT the apps use (connect, subscribe with + and # wildcards, unsubscribe,
+#        publish at QoS 0 to 2, ping and disconnect), there are no retained messages, wills or
+#        persistent sessions and messages are always delivered at QoS 0. Run it on its own with
+#        "python local_broker.py", or set MQTT_ADDR to "local" to have an app start it
+
+
+# Imports
+import argparse
+import errno
+import socketserver
+import struct
+import threading
+
+# Value of MQTT_ADDR (the class constant or the environment variable) that selects the local broker
+LOCAL_BROKER = "local"
+
+_CONNECT = 1
+_PUBLISH = 3
+_PUBACK = 4
+_PUBREC = 5
+_PUBREL = 6
+_PUBCOMP = 7
+_SUBSCRIBE = 8
+_UNSUBSCRIBE = 10
+_PINGREQ = 12
+_DISCONNECT = 14
+
+
+def topic_matches(topic_filter, topic):
+    """
+    Return True if a topic matches a subscription topic filter
+    """
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels) or (level != '+' and level != topic_levels[i]):
+            return False
+
+    return len(filter_levels) == len(topic_levels)
+
+
+def _encode_length(length):
+    encoded = bytearray()
+    while True:
+        length, digit = divmod(length, 128)
+        encoded.append(digit | 0x80 if length else digit)
+        if not length:
+            return bytes(encoded)
+
+
+def _packet(first_byte, body):
+    return bytes((first_byte,)) + _encode_length(len(body)) + body
+
+
+def _string(data, offset):
+    length, = struct.unpack_from('!H', data, offset)
+    return data[offset + 2:offset + 2 + length].decode('utf-8'), offset + 2 + length
+
+
+class _ClientHandler(socketserver.BaseRequestHandler):
+    """
+    Serves one client connection, packets are read and handled one at a time on the
+    connection's own thread
+    """
+    def setup(self):
+        self.broker = self.server.broker
+        self.send_lock = threading.Lock()
+        self.subscriptions = set()
+
+    def send(self, data):
+        with self.send_lock:
+            self.request.sendall(data)
+
+    def _read_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def _read_packet(self):
+        first_byte = self._read_exactly(1)[0]
+        length = 0
+        for shift in range(0, 28, 7):
+            digit = self._read_exactly(1)[0]
+            length |= (digit & 0x7F) << shift
+            if not digit & 0x80:
+                break
+
+        return first_byte, self._read_exactly(length) if length else b''
+
+    def handle(self):
+        try:
+            first_byte, body = self._read_packet()
+            if first_byte >> 4 != _CONNECT:
+                return
+            self.send(b'\x20\x02\x00\x00')  # CONNACK, connection accepted
+
+            self.broker._add_client(self)
+            while True:
+                first_byte, body = self._read_packet()
+                packet_type = first_byte >> 4
+
+                if packet_type == _PUBLISH:
+                    self._handle_publish(first_byte, body)
+                elif packet_type == _PUBREL:
+                    self.send(_packet(0x70, body[:2]))  # PUBCOMP
+                elif packet_type == _SUBSCRIBE:
+                    self._handle_subscribe(body)
+                elif packet_type == _UNSUBSCRIBE:
+                    self._handle_unsubscribe(body)
+                elif packet_type == _PINGREQ:
+                    self.send(b'\xd0\x00')  # PINGRESP
+                elif packet_type == _DISCONNECT:
+                    return
+        except (EOFError, OSError):
+            pass
+        finally:
+            self.broker._remove_client(self)
+
+    def _handle_publish(self, first_byte, body):
+        qos = (first_byte >> 1) & 3
+        topic, offset = _string(body, 0)
+        if qos:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+            self.send(_packet(0x40 if qos == 1 else 0x50, packet_id))  # PUBACK or PUBREC
+
+        self.broker.publish(topic, body[offset:])
+
+    def _handle_subscribe(self, body):
+        offset = 2
+        granted = bytearray()
+        while offset < len(body):
+            topic_filter, offset = _string(body, offset)
+            offset += 1  # Requested QoS, only QoS 0 is granted
+            self.subscriptions.add(topic_filter)
+            granted.append(0)
+
+        self.send(_packet(0x90, body[:2] + bytes(granted)))  # SUBACK
+
+    def _handle_unsubscribe(self, body):
+        offset = 2
+        while offset < len(body):
+            topic_filter, offset = _string(body, offset)
+            self.subscriptions.discard(topic_filter)
+
+        self.send(_packet(0xB0, body[:2]))  # UNSUBACK
+
+
+class _BrokerServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class LocalBroker:
+    """
+    MQTT broker serving clients on a TCP port of this machine, each connection is served on
+    a thread of its own and a published message is passed on straight away to every client
+    subscribed to a matching topic filter. Port 0 picks a free port, which is then held in
+    port once the broker is started. Counts the messages published and delivered
+    """
+    def __init__(self, host='127.0.0.1', port=1883):
+        self.host = host
+        self.port = port
+
+        self.clients = set()
+        self.clients_lock = threading.Lock()
+        self.messages_published = 0
+        self.messages_delivered = 0
+
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        self.server = _BrokerServer((self.host, self.port), _ClientHandler)
+        self.server.broker = self
+        self.port = self.server.server_address[1]
+
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mqtt-broker")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def _add_client(self, client):
+        with self.clients_lock:
+            self.clients.add(client)
+
+    def _remove_client(self, client):
+        with self.clients_lock:
+            self.clients.discard(client)
+
+    def publish(self, topic, payload):
+        """
+        Pass a message on to every client subscribed to a matching topic filter, at QoS 0
+        """
+        with self.clients_lock:
+            self.messages_published += 1
+            clients = list(self.clients)
+
+        topic_bytes = topic.encode('utf-8')
+        message = _packet(0x30, struct.pack('!H', len(topic_bytes)) + topic_bytes + payload)
+
+        delivered = 0
+        for client in clients:
+            if any(topic_matches(topic_filter, topic) for topic_filter in list(client.subscriptions)):
+                try:
+                    client.send(message)
+                    delivered += 1
+                except OSError:
+                    pass
+
+        # Every client's thread publishes, so the count is only added to under the lock
+        with self.clients_lock:
+            self.messages_delivered += delivered
+
+
+_local_broker = None
+_local_broker_lock = threading.Lock()
+
+
+def start_local_broker(port=1883):
+    """
+    Start the local broker in this process on a port of localhost, unless it is already
+    running here or another process (another app, or local_broker.py run on its own) is
+    already listening on that port, in which case that broker is used. Returns the host
+    and port to connect to
+    """
+    global _local_broker
+
+    with _local_broker_lock:
+        if _local_broker is None:
+            try:
+                _local_broker = LocalBroker(port=port).start()
+            except OSError as e:
+                if e.errno != errno.EADDRINUSE:
+                    raise
+                return '127.0.0.1', port
+
+        return _local_broker.host, _local_broker.port
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the local MQTT broker")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    parser.add_argument('--port', type=int, default=1883, help="port to listen on")
+    args = parser.parse_args()
+
+    broker = LocalBroker(args.host, args.port).start()
+    print("Local MQTT broker listening on {0}:{1}".format(broker.host, broker.port))
+    try:
+        broker.thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+# File: log_partitions.py
+# Notes: Sensor log split into one csv file per door per day, with a manifest that records what
+#        each file holds so that neither the subscriber nor the report has to open the files
+#        to find out
+
+
+# Imports
+import argparse
+import json
+import os
+import os.path
+import time
+from door_access import is_valid_door
+from log_writer import BufferedLogWriter, LogWriter, LOG_COLUMNS
+
+_SECONDS_PER_DAY = 86400
+
+
+def _day_name(day):
+    return time.strftime("%Y-%m-%d", time.gmtime(day * _SECONDS_PER_DAY))
+
+
+class LogManifest:
+    """
+    Index of the partitions of a partitioned sensor log, kept as manifest.json in the log
+    directory. For every partition file (named by its path relative to the log directory)
+    it records the door and date, the first and last epoch logged, the users seen and
+    the number of readings. It is loaded on first use and saved with an atomic replace,
+    so a crash never leaves a half written manifest behind
+    """
+    FILE_NAME = 'manifest.json'
+
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self.path = os.path.join(log_dir, self.FILE_NAME)
+        self.partitions = None
+
+    def load(self):
+        if self.partitions is None:
+            try:
+                with open(self.path, 'r') as f:
+                    self.partitions = json.load(f)['partitions']
+            except FileNotFoundError:
+                self.partitions = {}
+
+        return self.partitions
+
+    def save(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'partitions': self.load()}, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    def record(self, name, door, day, epochs, users):
+        """
+        Add the epochs and users of readings just written to a partition to its entry
+        """
+        entry = self.load().setdefault(name, {'door': door, 'date': _day_name(day), 'start': None, 'end': None,
+                                              'users': [], 'rows': 0})
+        first, last = min(epochs), max(epochs)
+        entry['start'] = first if entry['start'] is None else min(entry['start'], first)
+        entry['end'] = last if entry['end'] is None else max(entry['end'], last)
+        entry['users'] = sorted(set(entry['users']).union(users))
+        entry['rows'] += len(epochs)
+
+    def select(self, door=None, user=None, start=None, end=None):
+        """
+        Return the paths of the partitions that may hold readings of the door and user (or
+        all of them) between the start and end epoch seconds, oldest first
+        """
+        selected = []
+        for name, entry in self.load().items():
+            if entry['rows'] == 0:
+                continue
+            if door is not None and entry['door'] != door:
+                continue
+            if user is not None and user not in entry['users']:
+                continue
+            if (start is not None and entry['end'] < start) or (end is not None and entry['start'] >= end):
+                continue
+            selected.append((entry['start'], os.path.join(self.log_dir, name)))
+
+        return [path for _, path in sorted(selected)]
+
+
+class PartitionedLogWriter(BufferedLogWriter):
+    """
+    Writes the readings of each door to one csv file per day (<log_dir>/<door>/<YYYY-MM-DD>.csv,
+    in the same format as the single csv log), moving on to the door's next file when a
+    reading of a new day is written, readings written without a door go to the files of
+    the default door. The manifest entry of a partition is brought up to date every time
+    readings are written to it, and that is the only file read when logging starts. The
+    manifest is saved when a partition is opened (a new door, a new day or one closed
+    earlier), at most manifest_interval seconds after it last changed otherwise, and on
+    close(), rather than on every write, as saving it rewrites the whole of it. At most
+    max_open partitions are kept open, the one written to least recently is closed when
+    another has to be opened
+    """
+    def __init__(self, log_dir='bme680_log', door='door', flush_rows=10, flush_interval=5.0, manifest=None,
+                 max_open=64, manifest_interval=60.0):
+        super().__init__(flush_rows, flush_interval)
+        self.log_dir = log_dir
+        self.door = door
+        self.manifest = manifest if manifest is not None else LogManifest(log_dir)
+        self.max_open = max_open
+        self.manifest_interval = manifest_interval
+
+        self.manifest_changed = False
+        self.manifest_saved = time.monotonic()
+        self.partition_opened = False
+        self.rejected_rows = 0
+
+        # Door -> (day, LogWriter) of the open partitions, least recently written first
+        self.partitions = {}
+
+    def _partition_for(self, door, epoch):
+        # Rotate to the partition of the day the reading was taken on
+        day = epoch // _SECONDS_PER_DAY
+        partition = self.partitions.pop(door, None)
+        if partition is not None and partition[0] != day:
+            partition[1].close()
+            partition = None
+
+        if partition is None:
+            # The door names a directory in log_dir, so it must never be able to lead out of it
+            if not is_valid_door(door):
+                raise ValueError("Invalid door id: {0!r}".format(door))
+
+            if len(self.partitions) >= self.max_open:
+                self.partitions.pop(next(iter(self.partitions)))[1].close()
+
+            os.makedirs(os.path.join(self.log_dir, door), exist_ok=True)
+            partition = (day, LogWriter(os.path.join(self.log_dir, door, _day_name(day) + '.csv'),
+                                        columns=LOG_COLUMNS))
+            self.partition_opened = True
+
+        self.partitions[door] = partition
+        return partition[1]
+
+    def end_access_period(self, user, end_time, door=None):
+        self.flush()
+
+        # The blank row goes to the partition the last readings of the door went to
+        door = self.door if door is None else door
+        partition = self.partitions.get(door)
+        partition = partition[1] if partition is not None else self._partition_for(door, end_time)
+        partition.write_separator()
+
+    def _write_pending(self):
+        # Group the readings by door and day, keeping them in the order they were taken
+        groups = {}
+        for row, door in zip(self.pending.rows(), self.pending.column('Door')):
+            door = self.door if door is None else door
+            groups.setdefault((door, row[1] // _SECONDS_PER_DAY), []).append(row)
+
+        for (door, day), rows in groups.items():
+            try:
+                partition = self._partition_for(door, rows[0][1])
+            except ValueError as e:
+                # Dropped, rather than holding up the readings of every other door
+                self.rejected_rows += len(rows)
+                print("Readings not logged: {0}".format(e))
+                continue
+            for row in rows:
+                partition.pending.append(*row)
+            partition.flush()
+
+            self.manifest.record(os.path.relpath(partition.file_path, self.log_dir), door, day,
+                                 [row[1] for row in rows], [row[0] for row in rows])
+            self.manifest_changed = True
+
+        if self.partition_opened or time.monotonic() - self.manifest_saved >= self.manifest_interval:
+            self._save_manifest()
+
+    def _save_manifest(self):
+        if self.manifest_changed:
+            self.manifest.save()
+            self.manifest_changed = False
+
+        self.manifest_saved = time.monotonic()
+        self.partition_opened = False
+
+    def close(self):
+        self.flush()
+        self._save_manifest()
+
+        for _, partition in self.partitions.values():
+            partition.close()
+        self.partitions = {}
+
+
+def rebuild_manifest(log_dir):
+    """
+    Write the manifest of a partitioned log from scratch by reading every partition, for
+    when it has been lost or the partitions have been changed by hand. Returns the
+    number of partitions found
+    """
+    import pandas as pd
+
+    manifest = LogManifest(log_dir)
+    manifest.partitions = {}
+
+    for door in sorted(os.listdir(log_dir)):
+        door_dir = os.path.join(log_dir, door)
+        if not os.path.isdir(door_dir):
+            continue
+
+        for file_name in sorted(os.listdir(door_dir)):
+            if not file_name.endswith('.csv'):
+                continue
+
+            readings = pd.read_csv(os.path.join(door_dir, file_name), usecols=['User', 'Epoch']).dropna()
+            epochs = readings['Epoch'].astype('int64')
+            if len(epochs):
+                manifest.record(os.path.join(door, file_name), door, int(epochs.iloc[0]) // _SECONDS_PER_DAY,
+                                epochs.tolist(), readings['User'].astype(str).unique().tolist())
+
+    manifest.save()
+    return len(manifest.partitions)
+
+
+def read_partitioned_readings(log_dir, door=None, user=None, start=None, end=None):
+    """
+    Return the readings of a door and user (or all of them) between the start and end
+    epoch seconds as a DataFrame with the columns of the csv log. Only the partitions the
+    manifest says may hold matching readings are read
+    """
+    import pandas as pd
+
+    manifest = LogManifest(log_dir)
+    if not os.path.isfile(manifest.path):
+        raise FileNotFoundError("No manifest in the partitioned log: '{0}'".format(log_dir))
+
+    frames = [pd.read_csv(path, usecols=LOG_COLUMNS).dropna() for path in manifest.select(door, user, start, end)]
+    if not frames:
+        return pd.DataFrame(columns=LOG_COLUMNS)
+
+    df = pd.concat(frames, ignore_index=True)
+    df['Epoch'] = df['Epoch'].astype('int64')
+
+    keep = pd.Series(True, index=df.index)
+    if user is not None:
+        keep &= df['User'] == user
+    if start is not None:
+        keep &= df['Epoch'] >= start
+    if end is not None:
+        keep &= df['Epoch'] < end
+
+    # Partitions of different doors overlap in time
+    return df[keep].sort_values('Epoch', kind='stable', ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the manifest of a partitioned sensor log")
+    parser.add_argument('log_dir', nargs='?', default='bme680_log', help="directory holding the partitioned log")
+    args = parser.parse_args()
+
+    print("{0}: {1} partitions found".format(args.log_dir, rebuild_manifest(args.log_dir)))
+
+
+if __name__ == "__main__":
+    main()
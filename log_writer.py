@@ -0,0 +1,232 @@
+# File: log_writer.py
+# Notes: Append-only, buffered writers for the sensor log recorded by the MQTT subscriber
+
+
+# Imports
+import csv
+import os.path
+import queue
+import threading
+import time
+from reading_buffer import ReadingBuffer, NAN
+
+# Columns of the sensor log, in the order they are written to the csv file, times are logged as
+# epoch seconds
+LOG_COLUMNS = ['User', 'Epoch', 'Temperature (C)', 'Humidity (%)']
+
+# Columns of logs written before the epoch column was introduced, these hold the formatted
+# "dd/mm/YYYY HH:MM:SS" timestamp instead
+LEGACY_LOG_COLUMNS = ['User', 'Timestamp', 'Temperature (C)', 'Humidity (%)']
+
+
+class BufferedLogWriter:
+    """
+    Base class for the storage backends of the sensor log. Readings are buffered in a
+    ReadingBuffer and written out in batches, either when flush_rows readings are
+    pending, when flush_interval seconds have passed since the last flush, or when
+    flush() is called explicitly. Subclasses write the batches out in _write_pending()
+    and are told when access periods start and end
+    """
+    def __init__(self, flush_rows=10, flush_interval=5.0):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+
+        self.pending = ReadingBuffer(capacity=max(flush_rows, 1))
+        self.rows_written = 0
+        self.last_flush = time.monotonic()
+
+    def write(self, user, timestamp, temperature, humidity, pressure=NAN, gas_resistance=NAN, door=None):
+        """
+        Buffer a single reading, timestamp is in epoch seconds, door is the door whose
+        access period the reading was taken during (None when there is only the one door)
+        """
+        self.pending.append(user, timestamp, temperature, humidity, pressure, gas_resistance, door)
+        self.flush_if_due()
+
+    def start_access_period(self, user, start_time, door=None):
+        """
+        Called when an access period starts, start_time is in epoch seconds
+        """
+        pass
+
+    def end_access_period(self, user, end_time, door=None):
+        """
+        Called when an access period ends, end_time is in epoch seconds, the readings taken
+        during the access period are written out
+        """
+        self.flush()
+
+    def flush_if_due(self):
+        if len(self.pending) >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all the buffered readings to the log
+        """
+        self.last_flush = time.monotonic()
+
+        if not self.pending:
+            return
+
+        self._write_pending()
+        self.rows_written += len(self.pending)
+        self.pending.clear()
+
+    def _write_pending(self):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+
+class LogWriter(BufferedLogWriter):
+    """
+    Writes the readings taken during access periods to the csv log file. The file is
+    only ever appended to, it is opened once (when the first rows are flushed) and
+    kept open until close() is called. New files are written with the given columns, an
+    existing file keeps the columns found in its header (so legacy logs carry on being
+    written as they were). The end of each access period is marked by a blank row
+    """
+    def __init__(self, file_path='bme680_data.csv', columns=LOG_COLUMNS, flush_rows=10, flush_interval=5.0):
+        super().__init__(flush_rows, flush_interval)
+        self.file_path = file_path
+        self.columns = list(columns)
+
+        self.file = None
+        self.csv_writer = None
+
+    def _open(self):
+        # A new (or empty) file needs the header row first, an existing file that was
+        # not terminated with a new line needs one before anything is appended to it
+        needs_header = not os.path.isfile(self.file_path) or os.path.getsize(self.file_path) == 0
+        needs_newline = False
+        if not needs_header:
+            with open(self.file_path, 'r', newline='') as f:
+                self.columns = next(csv.reader(f))
+            with open(self.file_path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b'\n'
+
+        self.file = open(self.file_path, 'a', newline='')
+        self.csv_writer = csv.writer(self.file, lineterminator='\n')
+
+        if needs_header:
+            self.csv_writer.writerow(self.columns)
+        elif needs_newline:
+            self.file.write('\n')
+
+    def end_access_period(self, user, end_time, door=None):
+        self.write_separator()
+
+    def write_separator(self):
+        """
+        Append the blank row that marks the end of an access period in the log, any
+        readings still buffered are written out first
+        """
+        self.flush()
+
+        if self.file is None:
+            self._open()
+
+        self.csv_writer.writerow([''] * len(self.columns))
+        self.file.flush()
+
+    def _write_pending(self):
+        if self.file is None:
+            self._open()
+
+        self.csv_writer.writerows(self.pending.rows(self.columns))
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.csv_writer = None
+
+
+class BackgroundLogWriter:
+    """
+    Owns a log writer on a thread of its own so that the app loop never waits on the
+    disk. Readings, access period events, flushes and console output are put on a
+    bounded queue and carried out in order by the writer thread. When the queue is full
+    readings are either dropped (drop_when_full=True, they are counted in dropped_rows)
+    or the caller blocks until there is room, nothing else is ever dropped
+    """
+    def __init__(self, writer, max_queue=1000, drop_when_full=False):
+        self.writer = writer
+        self.drop_when_full = drop_when_full
+        self.queue = queue.Queue(maxsize=max_queue)
+
+        self.dropped_rows = 0
+        self.max_queue_depth = 0
+
+        self.thread = threading.Thread(target=self._run, name="log-writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def _put(self, command, args=(), rows=0):
+        if rows and self.drop_when_full:
+            try:
+                self.queue.put_nowait((command, args))
+            except queue.Full:
+                self.dropped_rows += rows
+                return False
+        else:
+            self.queue.put((command, args))
+
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return True
+
+    def write(self, user, timestamp, temperature, humidity, pressure=NAN, gas_resistance=NAN, door=None):
+        return self._put(self.writer.write, (user, timestamp, temperature, humidity, pressure, gas_resistance, door),
+                         rows=1)
+
+    def start_access_period(self, user, start_time, door=None):
+        self._put(self.writer.start_access_period, (user, start_time, door))
+
+    def end_access_period(self, user, end_time, door=None):
+        self._put(self.writer.end_access_period, (user, end_time, door))
+
+    def flush(self):
+        self._put(self.writer.flush)
+
+    def print(self, text):
+        """
+        Print to the console from the writer thread
+        """
+        self._put(print, (text,))
+
+    def _run(self):
+        while True:
+            # Waking up at least once every flush_interval means buffered rows are still
+            # written out on time when nothing new is being logged
+            try:
+                command, args = self.queue.get(timeout=self.writer.flush_interval)
+            except queue.Empty:
+                command, args = self.writer.flush_if_due, ()
+
+            if command is None:
+                break
+
+            try:
+                command(*args)
+            except Exception as e:
+                print("Log writer error: {0}".format(e))
+
+    def close(self):
+        """
+        Carry out everything still queued, then close the log and stop the writer thread, the
+        log is closed on the writer thread as some logs (SQLite) can only be used by the
+        thread that opened them
+        """
+        self.queue.put((self.writer.close, ()))
+        self.queue.put((None, ()))
+        self.thread.join()
@@ -3,14 +3,20 @@
 # Date: May 2023
 
 # Imports
-from time import sleep
+import argparse
 from machine import Pin
 from neopixel import NeoPixel
 from iot_app import IoTApp
 from bme680 import BME680, OS_2X, OS_4X, OS_8X, FILTER_SIZE_3, ENABLE_GAS_MEAS
-
-import pandas as pd
-from datetime import datetime
+from access_drivers import script_requests, replay_requests, synthetic_requests, synthetic_users
+from access_engine import AccessEngine
+from access_events import encode_event
+from authorization import AuthorizationStore
+from outbox import Outbox
+from door_access import door_topic
+from timestamps import epoch_ms_from_rtc, format_timestamp
+
+import os.path
 import time
 import threading
 
@@ -33,7 +39,7 @@ class MainApp(IoTApp):
     AP_SSID = "DCETLocalVOIP"
     AP_PSWD = ""
     AP_TOUT = 5000
-    MQTT_ADDR = "broker.hivemq.com"  # DNS of the public MQTT server
+    MQTT_ADDR = "broker.hivemq.com"  # DNS of the public MQTT server, or "local" for the local broker (local_broker.py)
     MQTT_PORT = 1883
     NTP_ADDR = "13.86.101.172"  # IP address of time.windows.com, NTP server at Microsoft
     NTP_PORT = 123  # NTP server port number (by default this is port 123)
@@ -63,12 +69,46 @@ class MainApp(IoTApp):
     MQTT_TOPIC_1 = "uos/cet235-bi10sg/door/enter"  # Topic name for time entered
     MQTT_TOPIC_2 = "uos/cet235-bi10sg/door/exit"  # Topic name for time exited
     MQTT_TOPIC_3 = "uos/cet235-bi10sg/door/user"  # Topic name for user code
+    MQTT_TOPIC_4 = "uos/cet235-bi10sg/door/event"  # Topic name for access events (user, action and time together)
+    MQTT_DOOR = "cet235-bi10sg"  # Door id sent in the access events
+    MQTT_LEGACY_TOPICS = False  # Publish on the legacy enter/exit/user topics instead of access events
+
+    USER_CODES_FILE = "user_codes.txt"  # Valid user codes, with revocations and expiry (see authorization.py)
+    USER_CODES_BLOOM_FILTER = False  # Turn away unknown user codes with a Bloom filter before looking them up
+    USER_CODES_RELOAD_INTERVAL = 5.0  # Seconds between checks for lines appended to the user codes file
+    PUBLISH_BATCH_SIZE = 256  # Most access events published at a time by the access engine's publisher thread
+    OUTBOX_DB = "outbox_pub.db"  # Access events kept while there is no connection to the broker (see outbox.py)
+    OUTBOX_MAX_MESSAGES = 100000  # Most messages kept, the oldest are dropped beyond this
+
+    def __init__(self, name, driver=None, driver_users=(), workers=0, **kwargs):
+        """
+        The driver argument is an iterable of (delay, action, user_code, door) requests (see
+        access_drivers.py) to carry out instead of asking for them to be typed in, the user
+        codes in driver_users are added to the valid ones, and with workers the driver's
+        requests are decided on that many threads, the other arguments are passed on to IoTApp
+        """
+        super().__init__(name, **kwargs)
+        self.driver = driver
+        self.driver_users = driver_users
+        self.workers = workers
 
     def init(self):
 
         """
         initialize measurements
         """
+        # WiFi, the MQTT broker and NTP are brought up on a thread of their own while the sensor and
+        # NeoPixels are set up, each step retried with exponential backoff, a driver keeps
+        # publishing for longer than the keep alive time so the MQTT network thread is needed to
+        # keep the connection open, until the broker is registered with the access events are kept
+        # in the outbox
+        self.wifi_msg = "Connect WIFI"
+        self.ntp_msg = "No NTP - RTC bad"
+        self.start_network(wifi_settings=(self.AP_SSID, self.AP_PSWD, True, self.AP_TOUT),
+                           mqtt_settings=dict(server=self.MQTT_ADDR, port=self.MQTT_PORT,
+                                              network_thread=self.driver is not None),
+                           ntp_settings=dict(ntp_ip=self.NTP_ADDR, ntp_port=self.NTP_PORT))
+
         # Initialise the BME680 driver instance with the I2C bus from the ProtoRig instance and
         # with the I2C address where the BME680 device is found on the shared I2C bus (0x76 hex,
         # 118 decimal), note: the I2C object is encapsulated in an I2CAdapter object, you do
@@ -149,70 +189,69 @@ class MainApp(IoTApp):
         self.temperature_str = ""
 
 
-        #initialize connection with wifi
-        self.wifi_msg = "No WIFI"
-        connect_count = 0
-        # Try to connect to WiFi 5 times, if unsuccessful then only try again if button A on
-        # the OLED is pressed
-        while connect_count < 5 and not self.is_wifi_connected():
-            self.oled_clear()
-            self.wifi_msg = "Connect WIFI:{0}".format(connect_count + 1)
-            self.oled_text(self.wifi_msg, 0, 0)
-            self.oled_display()
-            self.connect_to_wifi(wifi_settings=(self.AP_SSID, self.AP_PSWD, True, self.AP_TOUT))
-            connect_count += 1
-
-        if self.is_wifi_connected():
-            self.wifi_msg = "WIFI"
-            # Register to the MQTT broker
-            self.register_to_mqtt(server=self.MQTT_ADDR, port=self.MQTT_PORT)
-        else:
-            self.oled_clear()
-            self.wifi_msg = "No WIFI"
-            self.oled_text(self.wifi_msg, 0, 0)
-            self.oled_display()
-            sleep(2)
-
-        # initialize ntp server settings to get the time from the internet
-
-        self.ntp_msg = "No NTP - RTC bad"
-        connect_count = 0
-        # Try to connect to WiFi 5 times
-        while connect_count < 5 and not self.is_wifi_connected():
-            self.oled_clear()
-            self.oled_text("Connect WIFI:{0}".format(connect_count + 1), 0, 0)
-            self.oled_display()
-            self.connect_to_wifi(wifi_settings=(self.AP_SSID, self.AP_PSWD, True, self.AP_TOUT))
-            connect_count += 1
-
-        if self.is_wifi_connected():
-            self.ntp_msg = "NTP - RTC good"
-            # Contact the NTP server and update the RTC with the correct date and time as
-            # provided by this server, the method set_rtc_by_ntp() is a convenience method
-            # that is implemented in the IoTApp class and therefore inherited by your own
-            # application class
-            self.set_rtc_by_ntp(ntp_ip=self.NTP_ADDR, ntp_port=self.NTP_PORT)
-
-        else:
-            # In this case the NTP server was not able to be contacted so the RTC is not
-            # correct
-            self.oled_clear()
-            self.oled_text("No WIFI", 0, 0)
-            self.oled_display()
-            sleep(4)
-
         # initialize the door opening
 
-        # List of valid user codes
-        valid_user_codes = ["MJ235AA", "CK523BB"]
-
-        # Track whether the controlled area is currently occupied
-        occupied = False
-        current_user = None
+        # Valid user codes, read from USER_CODES_FILE when the first code is checked and kept in
+        # a dict so checking a code takes the same time however many there are, expiry times are
+        # epoch seconds (UTC) so they are checked against time.time() rather than the RTC, which
+        # keeps local time, without a file only these codes are valid
+        self.authorization = AuthorizationStore(self.USER_CODES_FILE, bloom_filter=self.USER_CODES_BLOOM_FILTER,
+                                                reload_interval=self.USER_CODES_RELOAD_INTERVAL)
+        if not os.path.isfile(self.USER_CODES_FILE):
+            for user_code in ("MJ235AA", "CK523BB"):
+                self.authorization.add(user_code)
+
+        # Messages that can not be sent (no WiFi, or the connection to the broker is down) are kept
+        # on disk and sent in order once they can be, so no entry or exit is lost
+        self.outbox = Outbox(self.OUTBOX_DB, lambda topic, payload: self.mqtt_client.publish_now(topic, payload),
+                             lambda: self.is_wifi_connected() and self.mqtt_client is not None,
+                             max_messages=self.OUTBOX_MAX_MESSAGES)
+
+        # Track which doors are currently occupied and by whom, the app's own door is MQTT_DOOR,
+        # the access events of the entries and exits allowed are published in batches on the
+        # engine's publisher thread, numbered per door so the subscriber can spot repeated and
+        # lost events
+        self.engine = AccessEngine(self.authorization, self.publish_events,
+                                   lambda: epoch_ms_from_rtc(self.rtc.datetime()), self.MQTT_DOOR,
+                                   batch_size=self.PUBLISH_BATCH_SIZE, workers=self.workers).start()
+
+        # A driver feeds the requests instead of them being typed in, its users are valid too
+        if self.driver is not None:
+            for user_code in self.driver_users:
+                self.authorization.add(user_code)
+
+    def network_event(self, step, ok):
+        """
+        Called on the network thread as WiFi, the MQTT broker and NTP come up
+        """
+        if step == 'wifi':
+            self.wifi_msg = "WIFI" if ok else "No WIFI"
+        elif step == 'ntp':
+            # When the NTP server could not be contacted the RTC is not correct
+            self.ntp_msg = "NTP - RTC good" if ok else "No NTP - RTC bad"
 
-        self.valid_user_codes = valid_user_codes
-        self.occupied = occupied
-        self.current_user = current_user
+    def publish_events(self, events):
+        """
+        Publish the AccessEvents of entries and exits (called by the access engine), either
+        as single access event messages or on the legacy topics, the app's own door on its
+        own topics, through the outbox so they are kept while they can not be sent
+        """
+        # Anything kept from while the connection was down goes first
+        self.outbox.drain()
+
+        for event in events:
+            own_door = event.door == self.MQTT_DOOR
+            if not self.MQTT_LEGACY_TOPICS:
+                self.outbox.publish(self.MQTT_TOPIC_4 if own_door else door_topic(event.door, 'event'),
+                                    encode_event(*event))
+                continue
+
+            ct = format_timestamp(event.epoch_ms // 1000)
+            if event.action == 'enter':
+                self.outbox.publish(self.MQTT_TOPIC_3 if own_door else door_topic(event.door, 'user'), event.user)
+                self.outbox.publish(self.MQTT_TOPIC_1 if own_door else door_topic(event.door, 'enter'), ct)
+            else:
+                self.outbox.publish(self.MQTT_TOPIC_2 if own_door else door_topic(event.door, 'exit'), ct)
 
     # The function that will run in a separate thread
     # This helps showing current time all the time even when waiting for an input
@@ -228,22 +267,25 @@ class MainApp(IoTApp):
 
             self.oled_text(output_time, 0, 6)
             self.oled_text(self.output, 0, 12)
+            self.oled_display()
             time.sleep(1)
 
     def loop(self):
+        if self.driver is not None:
+            # The driver's requests are timed with the RTC, so wait for it to be set from NTP
+            self.network_ready.wait()
+            self.run_driver()
+            self.finished = True
+            return
 
         # Create and start the time thread
         time_thread = threading.Thread(target=self.display_time, daemon=True)
         time_thread.start()
 
-        #get the door opening values
-        valid_user_codes = self.valid_user_codes
-        occupied = self.occupied
-        current_user = self.current_user
-
         while True:
 
-            if occupied:
+            current_user = self.engine.occupant()
+            if current_user is not None:
                 occupant_str = "Occupant: {0}".format(current_user)
                 output = occupant_str
             else:
@@ -251,72 +293,107 @@ class MainApp(IoTApp):
 
             self.output = output
 
+            # Send anything kept from while the connection was down
+            self.outbox.drain()
+
             user_choice = input("Do you want to enter or exit? Type 'enter' or 'exit': ")
             user_code = input("Please enter your user code: ")
 
-            if user_code in valid_user_codes:
-                if user_choice == 'enter':
-                    if not occupied:
-                        # If the controlled area is not occupied, grant access and publish a message
-                        print("Access Allowed")
-                        self.mqtt_client.publish(self.MQTT_TOPIC_3, user_code)
-                        self.npm.fill((255, 0, 0))  # Red light signifies occupancy
-                        self.npm.write()
-                        # self.oled_clear()
-
-                        occupied = True
-                        current_user = user_code
-
-                        date_ntp_enter = self.rtc.datetime()
-                        ct_enter = "{:02d}/{:02d}/{:04d} {:02d}:{:02d}:{:02d}".format(date_ntp_enter[2],
-                                                                                      date_ntp_enter[1],
-                                                                                      date_ntp_enter[0],
-                                                                                      date_ntp_enter[4],
-                                                                                      date_ntp_enter[5],
-                                                                                      date_ntp_enter[6])
-
-                        print(f"Access granted to {user_code} at {ct_enter}.")
-                        self.mqtt_client.publish(self.MQTT_TOPIC_1, ct_enter)
-
-                    elif user_code == current_user:
-                        print(f"Access denied. You are already inside.")
-
-                    else:
-                        # If the controlled area is occupied by another user, deny access
-                        print(f"Access denied to {user_code}. Controlled area is currently occupied.")
+            refusal = self.engine.decide(user_choice, user_code)
+            if refusal is not None:
+                print(refusal)
 
-                elif user_choice == 'exit':
-                    if user_code == current_user:
-                        # If the controlled area is occupied by the same user, end the access period and publish a message
-                        occupied = False
+            elif user_choice == 'enter':
+                # If the controlled area is not occupied, grant access and publish a message
+                print("Access Allowed")
+                self.npm.fill((255, 0, 0))  # Red light signifies occupancy
+                self.npm.write()
+                # self.oled_clear()
 
-                        date_ntp_exit = self.rtc.datetime()
-                        ct_exit = "{:02d}/{:02d}/{:04d} {:02d}:{:02d}:{:02d}".format(date_ntp_exit[2], date_ntp_exit[1],
-                                                                                     date_ntp_exit[0],
-                                                                                     date_ntp_exit[4], date_ntp_exit[5],
-                                                                                     date_ntp_exit[6])
+                date_ntp_enter = self.rtc.datetime()
+                ct_enter = "{:02d}/{:02d}/{:04d} {:02d}:{:02d}:{:02d}".format(date_ntp_enter[2],
+                                                                              date_ntp_enter[1],
+                                                                              date_ntp_enter[0],
+                                                                              date_ntp_enter[4],
+                                                                              date_ntp_enter[5],
+                                                                              date_ntp_enter[6])
 
-                        print(f"Access period ended for {user_code} at {ct_exit}.")
+                print(f"Access granted to {user_code} at {ct_enter}.")
 
-                        self.mqtt_client.publish(self.MQTT_TOPIC_2, ct_exit)
-                        current_user = None
-
-                        self.npm.fill((0, 255, 0))  # Green light signifies no occupancy
-                        self.npm.write()
-                        self.oled_clear()
+            else:
+                # If the controlled area is occupied by the same user, end the access period and publish a message
+                date_ntp_exit = self.rtc.datetime()
+                ct_exit = "{:02d}/{:02d}/{:04d} {:02d}:{:02d}:{:02d}".format(date_ntp_exit[2], date_ntp_exit[1],
+                                                                             date_ntp_exit[0],
+                                                                             date_ntp_exit[4], date_ntp_exit[5],
+                                                                             date_ntp_exit[6])
 
-                    else:
-                        print(f"Access denied to {user_code}. You are not the current occupant.")
+                print(f"Access period ended for {user_code} at {ct_exit}.")
 
-                else:
-                    print("Invalid choice. Please type 'enter' or 'exit'.")
-
-            else:
-                print("Invalid user code.")
+                self.npm.fill((0, 255, 0))  # Green light signifies no occupancy
+                self.npm.write()
+                self.oled_clear()
+                self.oled_display()
 
             # Wait for a short period before the next iteration
             time.sleep(1)
 
+    def timed_decision(self, user_choice, user_code, door):
+        """
+        Return the access engine's decision on a request and the seconds taken to make it
+        """
+        checked = time.perf_counter()
+        refusal = self.engine.decide(user_choice, user_code, door)
+        return refusal, time.perf_counter() - checked
+
+    def run_driver(self):
+        """
+        Carry out the requests of the driver rather than ones typed in, each one is checked
+        and (if allowed) published as it would be when typed in, but with nothing printed
+        or displayed per request. The requests are paced to the driver's delays against
+        a monotonic clock, so time spent checking and publishing is not added to them, and
+        with workers they are decided on the access engine's worker threads. At the end the
+        requests per second achieved, the time taken to decide them (validation latency)
+        and the time from a decision to its access event being published (publish latency)
+        are printed
+        """
+        decisions = []
+
+        start = due = time.monotonic()
+        for delay, user_choice, user_code, door in self.driver:
+            due += delay
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+            decisions.append(self.engine.submit(door, self.timed_decision, user_choice, user_code, door))
+
+        # Waits for the workers, and for every access event to be published
+        self.engine.stop()
+        elapsed = time.monotonic() - start
+
+        latencies = []
+        refused = 0
+        for decision in decisions:
+            refusal, latency = decision.result()
+            latencies.append(latency)
+            if refusal is not None:
+                refused += 1
+
+        requests = len(decisions)
+        print("Requests: {0} ({1} published, {2} refused) in {3:.2f} s, {4:.0f} requests/s".format(
+            requests, requests - refused, refused, elapsed, requests / elapsed if elapsed else 0))
+        if latencies:
+            latencies.sort()
+            print("Validation latency: mean {0:.1f} us, p50 {1:.1f} us, p99 {2:.1f} us, max {3:.1f} us".format(
+                sum(latencies) / len(latencies) * 1e6, latencies[len(latencies) // 2] * 1e6,
+                latencies[int(len(latencies) * 0.99)] * 1e6, latencies[-1] * 1e6))
+        if self.engine.batches:
+            print("Publish latency: mean {0:.1f} us, max {1:.1f} us, {2} batches of {3:.1f} events on average".format(
+                self.engine.mean_latency * 1e6, self.engine.max_latency * 1e6, self.engine.batches,
+                self.engine.mean_batch))
+        print(self.outbox.metrics())
+
     def deinit(self):
         """
         The deinit() method is called after the loop() method has finished, is designed
@@ -324,9 +401,12 @@ class MainApp(IoTApp):
         properties, for instance shutting down sensor devices. It can also be used to
         display final information on output devices (such as the OLED FeatherWing)
         """
-        # In this specific implementation the deint() method does nothing, only included
-        # for completeness sake
-        pass
+        # Publish any access events still queued, and try once more to send those kept in the
+        # outbox (what can not be sent now is sent by the next run)
+        self.engine.stop()
+        while self.outbox.drain():
+            pass
+        self.outbox.close()
 
     def btnA_handler(self, pin):
         """
@@ -372,8 +452,45 @@ def main():
     #                  used so it can be programmed
     #   start_verbose: set to True and the OLED FeatherWing will display a message as it
     #                  starts up the program
+    #   driver: the requests to carry out instead of asking for them to be typed in, when
+    #           one of the driver options is given on the command line
+    #   workers: the number of threads deciding the driver's requests
+    #   headless: run without the GUI (no display needed), when given on the command line
+    #   log_display: print what the OLED and NeoPixels show when headless
     #
-    app = MainApp(name="MQTT Pub Sim", has_oled_board=True, finish_button=None, start_verbose=True)
+    parser = argparse.ArgumentParser(description="Door access publisher, interactive unless a driver is given")
+    driver_options = parser.add_mutually_exclusive_group()
+    driver_options.add_argument('--script', metavar='FILE', help="carry out the requests in a script file")
+    driver_options.add_argument('--replay', metavar='LOG', help="replay the access periods of a csv sensor log")
+    driver_options.add_argument('--synthetic', type=int, metavar='COUNT', help="carry out COUNT random requests")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed, 0 for as fast as possible")
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help="random requests per second, 0 for as fast as possible")
+    parser.add_argument('--users', type=int, default=100, help="number of users making random requests")
+    parser.add_argument('--doors', type=int, default=1, help="number of doors random requests are made at")
+    parser.add_argument('--seed', type=int, help="seed for the random requests")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="threads deciding the driver's requests, 0 to decide them on the driver's thread")
+    parser.add_argument('--headless', action='store_true', help="run without the GUI")
+    parser.add_argument('--log-display', action='store_true',
+                        help="print what the OLED and NeoPixels show when running without the GUI")
+    args = parser.parse_args()
+
+    driver, driver_users = None, ()
+    if args.script:
+        driver = script_requests(args.script)
+    elif args.replay:
+        driver = replay_requests(args.replay, args.speed)
+    elif args.synthetic:
+        # The requests at different doors are decided in any order on workers, so then the users
+        # are kept to a door each for the decisions to be the same as without workers
+        driver = synthetic_requests(args.synthetic, args.rate, args.users, args.doors, args.seed,
+                                    roaming=not args.workers)
+        driver_users = synthetic_users(args.users)
+
+    app = MainApp(name="MQTT Pub Sim", has_oled_board=True, finish_button=None, start_verbose=True,
+                  driver=driver, driver_users=driver_users, workers=args.workers, headless=args.headless,
+                  log_display=args.log_display)
 
     # Run the app
     app.run()
@@ -8,6 +8,8 @@ Notes: Module for simulated MQTT client for use with simulated ESP32 MicroPython
        uses the Paho MQTT package
 """
 # Imports
+import queue
+import time
 import paho.mqtt.client as MQTTPaho
 
 class MQTTClientEx(MQTTPaho.Client):
@@ -15,9 +17,77 @@ class MQTTClientEx(MQTTPaho.Client):
         super().__init__(client_id)
         self.msg_callback = None
 
-    def check_msg(self):
-        self.loop()
+        # Once start_network_thread() is called the network I/O runs on paho's own thread, received
+        # messages are queued there and handed to msg_callback by check_msg() on the app's thread
+        self.threaded = False
+        self.msg_queue = queue.Queue()
+
+        # Metrics of the queued messages, latency is the time from a message being received to
+        # check_msg() handling it, in seconds
+        self.msgs_handled = 0
+        self.max_queue_depth = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    @property
+    def queue_depth(self):
+        return self.msg_queue.qsize()
+
+    @property
+    def mean_latency(self):
+        return self.total_latency / self.msgs_handled if self.msgs_handled else 0.0
+
+    def start_network_thread(self):
+        self.threaded = True
+        self.loop_start()
+
+    def check_msg(self, timeout=1.0):
+        if not self.threaded:
+            # Blocks for up to timeout seconds waiting for network traffic
+            self.loop(timeout)
+            return
+
+        # Waits for up to timeout seconds for a message, as polling does, so a loop() that relies
+        # on check_msg() to pace it does not spin, then only the messages already queued are
+        # handled so a steady stream of messages can not keep check_msg() from returning
+        try:
+            message = self.msg_queue.get(timeout=timeout) if timeout else self.msg_queue.get_nowait()
+        except queue.Empty:
+            return
+        self._handle_msg(*message)
+
+        for _ in range(self.msg_queue.qsize()):
+            try:
+                message = self.msg_queue.get_nowait()
+            except queue.Empty:
+                break
+            self._handle_msg(*message)
+
+    def _handle_msg(self, topic, payload, received):
+        latency = time.perf_counter() - received
+        self.msgs_handled += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
 
-    def on_message(self, mqttc, obj, msg):
         if self.msg_callback:
+            self.msg_callback(topic, payload)
+
+    def publish_now(self, topic, payload):
+        # Returns False rather than dropping the message when there is no connection to send it on
+        return self.publish(topic, payload).rc == MQTTPaho.MQTT_ERR_SUCCESS
+
+    def on_message(self, mqttc, obj, msg):
+        if self.threaded:
+            self.msg_queue.put((msg.topic, msg.payload, time.perf_counter()))
+            self.max_queue_depth = max(self.max_queue_depth, self.msg_queue.qsize())
+        elif self.msg_callback:
             self.msg_callback(msg.topic, msg.payload)
+
+    def disconnect(self, *args, **kwargs):
+        result = super().disconnect(*args, **kwargs)
+
+        if self.threaded:
+            self.loop_stop()
+            self.threaded = False
+
+        return result
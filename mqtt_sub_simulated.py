@@ -4,15 +4,21 @@
 
 
 # Imports
+import argparse
 import random
 import csv
 from time import sleep
 from machine import Pin
 from neopixel import NeoPixel
-from iot_app import IoTApp
+from iot_app import IoTApp, RunStates
 from bme680 import BME680, OS_2X, OS_4X, OS_8X, FILTER_SIZE_3, ENABLE_GAS_MEAS
+from log_writer import LogWriter, BackgroundLogWriter
+from sqlite_log import SqliteLogWriter
+from log_partitions import LogManifest, PartitionedLogWriter
+from door_access import DoorTable
+from outbox import Outbox
+from timestamps import epoch_from_rtc
 
-import pandas as pd
 from datetime import datetime
 import os.path
         
@@ -34,7 +40,7 @@ class MainApp(IoTApp):
     AP_SSID = "DCETLocalVOIP"
     AP_PSWD = ""
     AP_TOUT = 5000
-    MQTT_ADDR = "broker.hivemq.com"  # DNS of the public MQTT server
+    MQTT_ADDR = "broker.hivemq.com"  # DNS of the public MQTT server, or "local" for the local broker (local_broker.py)
     MQTT_PORT = 1883
     NTP_ADDR = "13.86.101.172"  # IP address of time.windows.com, NTP server at Microsoft
     NTP_PORT = 123  # NTP server port number (by default this is port 123)
@@ -61,82 +67,67 @@ class MainApp(IoTApp):
     #    shutdown and maintenance, it has not done in the time it has been used but this
     #    could happen (hopefully for short periods only), that bridge will be crossed if
     #    it should happen
-    MQTT_TOPIC_1 = "uos/cet235-bi10sg/door/enter"  # Topic name for time entered
-    MQTT_TOPIC_2 = "uos/cet235-bi10sg/door/exit"  # Topic name for time exited
-    MQTT_TOPIC_3 = "uos/cet235-bi10sg/door/user"  # Topic name for user code
+    # Every door publishes each entry and exit as a single access event on its own topic,
+    # uos/<door>/door/event, so for example the door "cet235-bi10sg" publishes on
+    # "uos/cet235-bi10sg/door/event", older publishers use the three legacy topics
+    # uos/<door>/door/enter (time entered), uos/<door>/door/exit (time exited) and
+    # uos/<door>/door/user (user code) instead, a single wildcard subscription covers all the
+    # topics of all the doors
+    MQTT_TOPIC = "uos/+/door/+"  # Topic filter for the topics of every door
+    MQTT_LEGACY_TOPICS = True  # Also act on messages on the legacy topics, for older publishers
+    MQTT_NETWORK_THREAD = True  # Run the MQTT network I/O on its own thread rather than polling it in poll_mqtt()
+    MQTT_POLL_PERIOD = 0.02  # Seconds between checks for MQTT messages, more often than loop() runs
+    SAMPLE_PERIOD = 1.0  # Seconds between runs of loop(), which reads, logs and displays the sensor readings
+    MQTT_TELEMETRY = False  # Publish every reading logged on the telemetry topic of its door
+    MQTT_TELEMETRY_TOPIC = "uos/{0}/telemetry"  # Telemetry topic of a door, outside the door topics subscribed to
+    OUTBOX_DB = "outbox_sub.db"  # Telemetry kept while there is no connection to the broker (see outbox.py)
+    OUTBOX_MAX_MESSAGES = 100000  # Most messages kept, the oldest are dropped beyond this
+
+    LOG_STORAGE = 'csv'  # Where the sensor log is stored, 'csv', 'sqlite' or 'partitioned'
+    LOG_FILE = 'bme680_data.csv'  # Sensor log written during access periods, when stored as csv
+    LOG_DB = 'bme680_data.db'  # Sensor log database, when stored in SQLite
+    LOG_DIR = 'bme680_log'  # Directory of the sensor log, when partitioned into a csv file per door per day
+    LOG_FLUSH_ROWS = 10  # Buffered readings are written to the log once this many are pending
+    LOG_FLUSH_INTERVAL = 5.0  # ...or once this many seconds have passed since the last write
+    LOG_QUEUE_SIZE = 1000  # Maximum number of logging jobs waiting for the log writer thread
+    LOG_DROP_WHEN_FULL = False  # Drop readings when the queue is full, rather than wait for room
+
+    def __init__(self, name, storage=LOG_STORAGE, **kwargs):
+        """
+        The storage argument selects where the sensor log is kept, either 'csv' (the
+        LOG_FILE csv file), 'sqlite' (the LOG_DB database) or 'partitioned' (a csv file
+        per door per day in LOG_DIR), the other arguments are passed on to IoTApp, loop()
+        runs every SAMPLE_PERIOD seconds unless loop_period is given
+        """
+        if storage not in ('csv', 'sqlite', 'partitioned'):
+            raise ValueError("Unknown log storage: {0}".format(storage))
+
+        # The readings are logged in epoch seconds, so sampling any faster than once a second
+        # would only log more rows for the same second
+        kwargs.setdefault('loop_period', self.SAMPLE_PERIOD)
+        super().__init__(name, **kwargs)
+        self.storage = storage
         
     def init(self):
         """
         initialize wifi connection
         """
-        self.wifi_msg = "No WIFI"
-        connect_count = 0
-        # Try to connect to WiFi 5 times, if unsuccessful then only try again if button A on
-        # the OLED is pressed
-        while connect_count < 5 and not self.is_wifi_connected():
-            self.oled_clear()
-            self.wifi_msg = "Connect WIFI:{0}".format(connect_count + 1) 
-            self.oled_text(self.wifi_msg, 0, 0)
-            self.oled_display()
-            self.connect_to_wifi(wifi_settings=(self.AP_SSID, self.AP_PSWD, True, self.AP_TOUT))
-            connect_count += 1
-
-        if self.is_wifi_connected():
-            self.wifi_msg = "WIFI"
-            # Register with the MQTT broker and link the method mqtt_callback() as the callback
-            # when messages are recieved
-            self.register_to_mqtt(server=self.MQTT_ADDR, port=self.MQTT_PORT,
-                                  sub_callback=self.mqtt_callback)
-
-            # Subscribe to topic about time entered
-            self.mqtt_client.subscribe(self.MQTT_TOPIC_1)
-
-            # Subscribe to topic about time exited
-            self.mqtt_client.subscribe(self.MQTT_TOPIC_2)
-
-            # Subscribe to topic about user code
-            self.mqtt_client.subscribe(self.MQTT_TOPIC_3)
-
-            self.oled_clear()
-            self.oled_display()
-        else:
-            self.wifi_msg = "No WIFI"
-            self.oled_clear()
-            self.oled_display()
+        # WiFi, the MQTT broker and NTP are brought up on a thread of their own while the sensor and
+        # NeoPixels are set up, each step retried with exponential backoff, so the first reading is
+        # taken straight away and the subscription is made in network_event() once registered
+        self.wifi_msg = "Connect WIFI"
+        self.ntp_msg = "No NTP - RTC bad"
+        self.start_network(wifi_settings=(self.AP_SSID, self.AP_PSWD, True, self.AP_TOUT),
+                           mqtt_settings=dict(server=self.MQTT_ADDR, port=self.MQTT_PORT,
+                                              sub_callback=self.mqtt_callback,
+                                              network_thread=self.MQTT_NETWORK_THREAD),
+                           ntp_settings=dict(ntp_ip=self.NTP_ADDR, ntp_port=self.NTP_PORT))
 
         # These will hold the most recently received temperatures and times from the relevant MQTT
         # subscriptions, initially a "--------" string until a value for each is received
         self.time_enter_str = "--------"
         self.time_exit_str= "--------"
 
-        # initialize ntp server settings to get the time from the internet
-
-        self.ntp_msg = "No NTP - RTC bad"
-        connect_count = 0
-        # Try to connect to WiFi 5 times
-        while connect_count < 5 and not self.is_wifi_connected():
-            self.oled_clear()
-            self.oled_text("Connect WIFI:{0}".format(connect_count + 1), 0, 0)
-            self.oled_display()
-            self.connect_to_wifi(wifi_settings=(self.AP_SSID, self.AP_PSWD, True, self.AP_TOUT))
-            connect_count += 1
-
-        if self.is_wifi_connected():
-            self.ntp_msg = "NTP - RTC good"
-            # Contact the NTP server and update the RTC with the correct date and time as
-            # provided by this server, the method set_rtc_by_ntp() is a convenience method
-            # that is implemented in the IoTApp class and therefore inherited by your own
-            # application class
-            self.set_rtc_by_ntp(ntp_ip=self.NTP_ADDR, ntp_port=self.NTP_PORT)
-
-        else:
-            # In this case the NTP server was not able to be contacted so the RTC is not
-            # correct
-            self.oled_clear()
-            self.oled_text("No WIFI", 0, 0)
-            self.oled_display()
-            sleep(4)
-
         """
         Here I initialize the measurements       
         """
@@ -195,42 +186,78 @@ class MainApp(IoTApp):
         self.humidity_target = None
         self.gas_resistance_target = None
 
-        # Here I check if this is the first recorded access period.
-        # If I have already recoded previous access periods, a csv file has been already created
-        # So I just load it
-        if os.path.isfile('bme680_data.csv'):
-            df = pd.read_csv('bme680_data.csv')
-
-            # Then I append an empty row to my data frame which indicates the start of a new access periods
-            # This way I can simply keep track of the number of access periods recorded
-            #df = df._append(pd.Series(), ignore_index=True)
+        # Here I check if this is the first recorded access period. The log is only ever appended
+        # to, so there is no need to read it in (let alone write it back out) at startup, for a
+        # partitioned log only the manifest is looked at
+        log_paths = {'csv': self.LOG_FILE, 'sqlite': self.LOG_DB,
+                     'partitioned': LogManifest(self.LOG_DIR).path}
+        if not os.path.isfile(log_paths[self.storage]):
+            print('No previous access period recorded.')
 
-            # Then I write my dataframe to a csv file
-            df.to_csv('bme680_data.csv', index=False)
+        # The log writer keeps the temperature and humidity data in a ReadingBuffer (typed arrays
+        # rather than a pandas dataframe) and appends it to the csv file in batches, so the file
+        # is never read back or rewritten while logging, it runs on its own thread so that loop()
+        # never waits for the disk (or the console)
+        if self.storage == 'sqlite':
+            log_writer = SqliteLogWriter(self.LOG_DB, flush_rows=self.LOG_FLUSH_ROWS,
+                                         flush_interval=self.LOG_FLUSH_INTERVAL)
+        elif self.storage == 'partitioned':
+            log_writer = PartitionedLogWriter(self.LOG_DIR, flush_rows=self.LOG_FLUSH_ROWS,
+                                              flush_interval=self.LOG_FLUSH_INTERVAL)
         else:
-            print('No previous access period recorded.')
+            log_writer = LogWriter(self.LOG_FILE, flush_rows=self.LOG_FLUSH_ROWS,
+                                   flush_interval=self.LOG_FLUSH_INTERVAL)
 
-        # Setting up the  access period class. With the helo of that class I can create an access period, start it and stop it.
-        class AccessPeriod:
-            def __init__(self):
-                self.active = False
-                self.start_time = None
-                self.elapsed_time = None
-                self.end_time = None
-                self.user_code = None
+        self.log_writer = BackgroundLogWriter(log_writer, max_queue=self.LOG_QUEUE_SIZE,
+                                              drop_when_full=self.LOG_DROP_WHEN_FULL)
 
-        # Define empty pandas dataframe to store temperature and humidity data
-        data_log = pd.DataFrame(columns=['User', 'Timestamp', 'Temperature (C)', 'Humidity (%)'])
-        self.data_log = data_log
+        # The access period of every door, keyed by door id, a door is added the first time one
+        # of its messages is received
+        self.doors = DoorTable(legacy_topics=self.MQTT_LEGACY_TOPICS)
 
-        # create an instance of the access period class, and also start the current access period
-        access_period = AccessPeriod()
-        self.access_period = access_period
+        # Telemetry that can not be sent (no WiFi, or the connection to the broker is down) is kept
+        # on disk and sent in order once it can be
+        self.outbox = None
+        if self.MQTT_TELEMETRY:
+            self.outbox = Outbox(self.OUTBOX_DB, lambda topic, payload: self.mqtt_client.publish_now(topic, payload),
+                                 lambda: self.is_wifi_connected() and self.mqtt_client is not None,
+                                 max_messages=self.OUTBOX_MAX_MESSAGES)
+
+        # Messages are checked for at a rate of their own, so the access periods are up to date
+        # within MQTT_POLL_PERIOD rather than a whole loop
+        self.scheduler.add("mqtt", self.MQTT_POLL_PERIOD, self.poll_mqtt)
 
         self.time_enter_str = "--------"
         self.time_exit_str = "--------"
 
-        self.just_ended = False #for when access period ends
+
+    def network_event(self, step, ok):
+        """
+        Called on the network thread as WiFi, the MQTT broker and NTP come up
+        """
+        if step == 'wifi':
+            self.wifi_msg = "WIFI" if ok else "No WIFI"
+        elif step == 'mqtt' and ok:
+            # Subscribe to the topics about time entered, time exited and user code of every door
+            self.mqtt_client.subscribe(self.MQTT_TOPIC)
+        elif step == 'ntp':
+            # When the NTP server could not be contacted the RTC is not correct
+            self.ntp_msg = "NTP - RTC good" if ok else "No NTP - RTC bad"
+
+    def poll_mqtt(self):
+        """
+        Run by the scheduler every MQTT_POLL_PERIOD seconds, on the same thread as loop()
+        """
+        if self.is_wifi_connected() and self.mqtt_client is not None:
+            # Check for any messages received from the MQTT broker, the scheduler paces the polls so
+            # there is no waiting for messages, with the network thread running this only hands over
+            # the messages it has queued (when polling, it reads whatever network traffic is waiting)
+            self.mqtt_client.check_msg(timeout=0)
+
+            # Send some of the telemetry kept from while the connection was down, a long backlog
+            # is sent over a number of polls
+            if self.outbox is not None:
+                self.outbox.drain()
 
     def loop(self):
 
@@ -278,15 +305,16 @@ class MainApp(IoTApp):
             self.oled_text("Relative Humidity: {0:.2f}%rh".format(rh_reading), 0, 20)
             # Also, a visual output of the approximate number of seconds the currently active access period has lasted.
 
-            if self.access_period.active:
-                duration = datetime.now() - self.access_period.start_time
+            if len(self.doors.active) == 1:
+                access_period = next(iter(self.doors.active.values()))
+                duration = datetime.now() - access_period.start_time
                 duration_str = str(duration)
-                self.oled_text(self.access_period.user_code + " entered: " + duration_str, 0, 30)
+                self.oled_text(str(access_period.user_code) + " entered: " + duration_str, 0, 30)
+            elif self.doors.active:
+                self.oled_text("Access Periods: {0}".format(len(self.doors.active)), 0, 30)
             else:
                 self.oled_text("Access Period: -", 0, 30)
 
-            self.oled_display()
-
             # Display current target indicator on OLED
             self.oled_text(self.target_indicator, 120, 20)
 
@@ -324,86 +352,55 @@ class MainApp(IoTApp):
         # Display the sensor readings on the OLED screen
         self.oled_display()
 
-        # access period and data log were initialized at the init method but we also need them at the loop method
-        access_period = self.access_period
-        data_log = self.data_log
-
-
-
-        if self.is_wifi_connected():
-            # Check for any messages received from the MQTT broker, note this is a non-blocking
-            # operation so if no messages are currently present the loop() method continues
-            self.mqtt_client.check_msg()
+        # Check if any door has an active access period
+        if self.doors.active:
 
-
-
-        # Check if access period is active
-        if access_period.active:
-
-            print('-------------------------------------------')
-
-            # Log data only during active access period
+            # Log data only during active access periods, once for every door with one
             date_ntp = self.rtc.datetime()
             ct = "{:02d}/{:02d}/{:04d} {:02d}:{:02d}:{:02d}".format(date_ntp[2], date_ntp[1], date_ntp[0],
                                                                     date_ntp[4], date_ntp[5], date_ntp[6])
-            data_log = data_log._append(
-                {'User': self.access_period.user_code,'Timestamp': ct, 'Temperature (C)': tm_reading, 'Humidity (%)': rh_reading},
-                ignore_index=True)
-
-            # Get elapsed time for current access period
-            access_period.elapsed_time = (datetime.now() - access_period.start_time).total_seconds()
-
-            # Update LED based on elapsed time
-            if access_period.elapsed_time <= 5:
+            epoch = epoch_from_rtc(date_ntp)
+            now = datetime.now()
+            elapsed_time = 0
+            for door, access_period in self.doors.active.items():
+                self.log_writer.write(access_period.user_code, epoch, tm_reading, rh_reading, pa_reading, gr_reading,
+                                      door)
+                if self.outbox is not None:
+                    # User, epoch, temperature, humidity, pressure and gas resistance (empty until stable)
+                    telemetry = "{0},{1},{2:.2f},{3:.2f},{4:.2f},{5}".format(
+                        access_period.user_code, epoch, tm_reading, rh_reading, pa_reading,
+                        "" if gr_reading is None else gr_reading)
+                    self.outbox.publish(self.MQTT_TELEMETRY_TOPIC.format(door), telemetry)
+
+                # Get elapsed time for current access period
+                access_period.elapsed_time = (now - access_period.start_time).total_seconds()
+                elapsed_time = max(elapsed_time, access_period.elapsed_time)
+
+            # Update LED based on elapsed time of the longest running access period
+            if elapsed_time <= 5:
                 self.npm.fill((0, 255, 0))  # Green LED
-            elif access_period.elapsed_time <= 10:
+            elif elapsed_time <= 10:
                 self.npm.fill((255, 191, 0))  # Amber LED
             else:
                 self.npm.fill((255, 0, 0))  # Red LED
 
-            # Display date, time, temperature and humidity on console
-
-            #Getting time from ntp server
-            date_ntp = self.rtc.datetime()
-            ct = "{:02d}/{:02d}/{:04d} {:02d}:{:02d}:{:02d}".format(date_ntp[2], date_ntp[1], date_ntp[0],
-                                                                    date_ntp[4], date_ntp[5], date_ntp[6])
-            print("Time: " + ct)
-            print("Temperature: {:.2f} C".format(tm_reading))
-            print("Humidity: {:.2f} %".format(rh_reading))
+            # Display date, time, temperature and humidity on console, this is printed by the
+            # log writer thread
+            self.log_writer.print("-------------------------------------------\n"
+                                  "Time: {0}\n"
+                                  "Temperature: {1:.2f} C\n"
+                                  "Humidity: {2:.2f} %".format(ct, tm_reading, rh_reading))
 
             # Set up the loop to run every second
             #sleep(1)
 
-            # Write data_log to CSV file only when the access period is active
-            file_path = 'bme680_data.csv'
-            if os.path.isfile(file_path):
-                # Load existing CSV file and append new data
-                df = pd.read_csv(file_path)
-                df = df._append(data_log, ignore_index=True)
-            else:
-                # Create a pandas dataframe with the current data_log
-                df = pd.DataFrame(data_log)
-            # Write data_log to CSV file
-            df.to_csv(file_path, index=False)
-
-            # Clear the data_log for the next access period
-            self.data_log = pd.DataFrame(columns=['User', 'Timestamp', 'Temperature (C)', 'Humidity (%)'])
-
-            # Update the access period of the current instance of the main class with latest data
-            self.access_period = access_period
-
-
         else:
             # Reset LED to off
             self.npm.fill((0, 0, 0))
 
-            if self.just_ended:
-                file_path = 'bme680_data.csv'
-                if os.path.isfile(file_path):
-                    df = pd.read_csv(file_path)
-                    df = df._append(pd.Series(), ignore_index=True)
-                    df.to_csv(file_path, index=False)
-                self.just_ended = False  # Reset the flag
+        # Only the NeoPixels whose colour has changed since the last write are updated, so writing
+        # every loop costs next to nothing while the colour stays the same
+        self.npm.write()
 
 
     def deinit(self):
@@ -417,6 +414,19 @@ class MainApp(IoTApp):
         self.npm.fill((0, 0, 0))
         self.npm.write()
 
+        # Write out any readings still buffered and close the log
+        self.log_writer.close()
+
+        if self.outbox is not None:
+            self.outbox.drain()
+            print(self.outbox.metrics())
+            self.outbox.close()
+
+        if self.mqtt_client is not None and self.MQTT_NETWORK_THREAD:
+            print("MQTT messages handled: {0}, latency mean {1:.1f} ms max {2:.1f} ms, max queue depth {3}".format(
+                self.mqtt_client.msgs_handled, self.mqtt_client.mean_latency * 1000,
+                self.mqtt_client.max_latency * 1000, self.mqtt_client.max_queue_depth))
+
         sleep(2)
 
     # To gracefully stop and shut down the run of my prototype,
@@ -446,27 +456,26 @@ class MainApp(IoTApp):
         """
         #print("Received message on topic {0} payload {1}".format(topic, msg))
 
-        # Parse the datetime string into a datetime object
-        msg_string = msg.decode('utf-8')
-
-
-
-        # Depending on the topic, set the start or end time for the access period
-        if topic == self.MQTT_TOPIC_1:  # If the message was received on the 'enter' topic
-            msg_datetime = datetime.strptime(msg_string, "%d/%m/%Y %H:%M:%S")
-            self.access_period.start_time = msg_datetime
-            self.access_period.active = True  # Start the access period
-            self.just_ended = False  # Reset the flag
+        # The door the message is about is picked out of the topic (or the access event), and
+        # depending on the event the start or end time (or user code) of that door's access
+        # period is set, messages on any other topic are ignored
+        try:
+            handled = self.doors.handle(topic, msg)
+        except ValueError as e:
+            print("Ignored message on topic {0}: {1}".format(topic, e))
+            return
 
-        elif topic == self.MQTT_TOPIC_2:  # If the message was received on the 'exit' topic
-            msg_datetime = datetime.strptime(msg_string, "%d/%m/%Y %H:%M:%S")
-            self.access_period.end_time = msg_datetime
-            self.access_period.active = False  # End the access period
-            self.just_ended = True  # Set the flag to True when an access period ends
+        if handled is None:
+            return
 
+        # The log writer records the start and end too (for a csv log the end of an access
+        # period is marked with a blank row)
+        event, access_period, msg_epoch = handled
+        if event == 'enter':  # If the message was received on the 'enter' topic
+            self.log_writer.start_access_period(access_period.user_code, msg_epoch, access_period.door)
 
-        if topic == self.MQTT_TOPIC_3:  # If the message was received on the 'user code' topic
-            self.access_period.user_code = msg_string
+        elif event == 'exit':  # If the message was received on the 'exit' topic
+            self.log_writer.end_access_period(access_period.user_code, msg_epoch, access_period.door)
 
 
 # Program entrance function
@@ -485,15 +494,30 @@ def main():
     #                  button that sets finished property to True
     #   start_verbose: set to True and the OLED FeatherWing will display a message as it
     #                  starts up the program
+    #   storage: set to "csv" to log the readings to the csv file, "sqlite" to log them
+    #            to the SQLite database, or "partitioned" to log them to a csv file per
+    #            door per day
+    #   headless: run without the GUI (no display needed), when given on the command line
+    #   log_display: print what the OLED and NeoPixels show when headless
     #
-    app = MainApp(name="MQTT Sub Sim", has_oled_board=True, finish_button="C", start_verbose=True)
+    parser = argparse.ArgumentParser(description="Door access subscriber, logs readings during access periods")
+    parser.add_argument('--headless', action='store_true', help="run without the GUI")
+    parser.add_argument('--log-display', action='store_true',
+                        help="print what the OLED and NeoPixels show when running without the GUI")
+    args = parser.parse_args()
+
+    app = MainApp(name="MQTT Sub Sim", has_oled_board=True, finish_button="C", start_verbose=True,
+                  storage=MainApp.LOG_STORAGE, headless=args.headless, log_display=args.log_display)
     
     # Run the app
     try:
         app.run()
     except KeyboardInterrupt:
-        # Gracefully exit the program when closing the gui or pressing ctrl + c
-        pass
+        # Gracefully exit the program when closing the gui or pressing ctrl + c, which stops the
+        # loop before deinit() has written out the readings still buffered or queued and closed
+        # the log, so it is called here instead
+        if app.run_state == RunStates.LOOPING:
+            app.deinit()
     finally:
         # Make sure to always call finish before exiting the program
         app.finish()
@@ -8,33 +8,71 @@ Notes: NeoPixel module for all simulated ESP32 MicroPython application code used
        when NOT able to utilise the prototyping hardware rig
 """
 class NeoPixel:
+    # The colours set are kept in a framebuffer of bpp bytes per NeoPixel and only shown by write(),
+    # as on the real NeoPixels, write() only updates the GUI labels of the NeoPixels whose colour has
+    # changed since they were last updated (on the GUI thread, see IoTApp.gui_post())
     def __init__(self, pin, num, bpp, timing, app):
         self.pin = pin
         self.num = num
         self.bpp = bpp
         self.timing = timing
+        self.app = app
         self.neopixel_lbls = app.neopixel_lbls
 
+        self.buf = bytearray(num * bpp)
+        self.shown = bytearray(num * bpp)  # What was last written, all off to begin with
+        self.labels_shown = bytes(num * bpp)  # What the labels show, only used on the GUI thread
+        self.label_colours = {}  # Label colour of every pixel value written so far
+
+        self.writes = 0
+        self.pixels_written = 0
+
     def __getitem__(self, i):
-        if self.neopixel_lbls:
-            bg_str = self.neopixel_lbls[i]["bg"]
-            return int(bg_str[1:3], 16), int(bg_str[3:5], 16), int(bg_str[5:], 16)
+        offset = i * self.bpp
+        return tuple(self.buf[offset:offset + self.bpp])
 
     def __setitem__(self, i, value):
-        if self.neopixel_lbls:
-            r, g, b = value
+        offset = i * self.bpp
+        self.buf[offset:offset + self.bpp] = bytes(value)
+
+    def fill(self, colour):
+        self.buf[:] = bytes(colour) * self.num
+
+    def write(self):
+        self.writes += 1
+        if self.buf == self.shown or not self.neopixel_lbls:
+            return
+
+        self.shown[:] = self.buf
+        self.app.gui_post("neopixels", self._show, bytes(self.buf))
+        self.app.neopixel_write()
+
+    def _show(self, buf):
+        # Called on the GUI thread with the latest colours written
+        bpp = self.bpp
+        labels_shown = self.labels_shown
+        for i in range(self.num):
+            offset = i * bpp
+            pixel = buf[offset:offset + bpp]
+            if pixel != labels_shown[offset:offset + bpp]:
+                self.neopixel_lbls[i].config(bg=self._label_colour(pixel))
+                self.pixels_written += 1
+
+        self.labels_shown = buf
+
+    def _label_colour(self, pixel):
+        colour = self.label_colours.get(pixel)
+        if colour is None:
+            r, g, b = pixel[:3]
 
             if r == 0 and g == 0 and b == 0:
                 r = 112
                 g = 128
                 b = 144
 
-            self.neopixel_lbls[i].config(bg="#{0}{1}{2}".format("%02x" % r, "%02x" % g, "%02x" % b))
+            if len(self.label_colours) >= 1024:
+                # Colours worked out from readings could otherwise fill it without end
+                self.label_colours.clear()
+            colour = self.label_colours[pixel] = "#{0:02x}{1:02x}{2:02x}".format(r, g, b)
 
-    def fill(self, colour):
-        if self.neopixel_lbls:
-            for i in range(self.num):
-                self[i] = colour
-
-    def write(self):
-        pass
+        return colour
@@ -0,0 +1,172 @@
+# File: outbox.py
+# Notes: Outbound MQTT messages that could not be sent straight away, kept in a SQLite database so
+#        they survive a WiFi outage (and a restart), then sent in order in batches once the
+#        connection is back
+
+
+# Imports
+import os.path
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    queued REAL NOT NULL
+);
+"""
+
+
+class Outbox:
+    """
+    Publishes MQTT messages with send(topic, payload), which returns True once a message
+    is sent, while connected() returns True. Otherwise (or if send() fails) the message is
+    added to the backlog kept in the SQLite database at db_path, and from then on every
+    message goes to the back of the backlog until drain() has sent the backlog, so the
+    messages are always sent in the order they were published. drain() sends the oldest
+    messages in batches of batch_size, each batch removed from the database in a single
+    transaction, and returns after drain_seconds so a long backlog does not hold up the
+    app's loop. The backlog is bounded to max_messages, beyond that the oldest messages
+    are dropped (counted in dropped). The database is only created once a message has to
+    be kept, a backlog left by an earlier run is sent first. Messages can be published
+    and drained from any thread
+    """
+    def __init__(self, db_path, send, connected, max_messages=100000, batch_size=500, drain_seconds=0.1):
+        self.db_path = db_path
+        self.send = send
+        self.connected = connected
+        self.max_messages = max_messages
+        self.batch_size = batch_size
+        self.drain_seconds = drain_seconds
+
+        self.connection = None
+        self.lock = threading.Lock()
+        self.backlog = 0
+
+        self.published = 0
+        self.queued = 0
+        self.drained = 0
+        self.dropped = 0
+        self.max_backlog = 0
+        self.drain_rate = 0.0  # Messages per second sent by the last drain of the whole backlog
+        self.drain_started = None
+        self.drain_count = 0
+
+        if os.path.isfile(db_path):
+            self.backlog = self._connect().execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            self.max_backlog = self.backlog
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(_SCHEMA)
+
+        return self.connection
+
+    def publish(self, topic, payload):
+        """
+        Send a message now if connected and there is no backlog, otherwise add it to the
+        backlog. Returns True if it was sent
+        """
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+
+        with self.lock:
+            self.published += 1
+            if not self.backlog and self.connected() and self._send(topic, payload):
+                return True
+
+            self._queue(topic, payload)
+            return False
+
+    def _send(self, topic, payload):
+        try:
+            return self.send(topic, payload)
+        except OSError:
+            return False
+
+    def _queue(self, topic, payload):
+        connection = self._connect()
+        with connection:
+            connection.execute("INSERT INTO messages (topic, payload, queued) VALUES (?, ?, ?)",
+                               (topic, payload, time.time()))
+            self.backlog += 1
+            self.queued += 1
+
+            if self.backlog > self.max_messages:
+                # Bounded, so the oldest message goes to make room
+                excess = self.backlog - self.max_messages
+                connection.execute("DELETE FROM messages WHERE id IN "
+                                   "(SELECT id FROM messages ORDER BY id LIMIT ?)", (excess,))
+                self.backlog -= excess
+                self.dropped += excess
+
+        self.max_backlog = max(self.max_backlog, self.backlog)
+
+    def drain(self):
+        """
+        Send the backlog, oldest first, while connected and for up to drain_seconds, stops
+        at the first message that can not be sent. Returns the number of messages sent
+        """
+        if not self.backlog or not self.connected():
+            return 0
+
+        sent = 0
+        with self.lock:
+            if self.drain_started is None:
+                self.drain_started = time.perf_counter()
+                self.drain_count = 0
+
+            connection = self._connect()
+            deadline = time.perf_counter() + self.drain_seconds
+            while self.backlog and time.perf_counter() < deadline:
+                batch = connection.execute("SELECT id, topic, payload FROM messages ORDER BY id LIMIT ?",
+                                           (self.batch_size,)).fetchall()
+                if not batch:
+                    # Removed behind our back, so there is nothing left to send
+                    self.backlog = 0
+                    break
+
+                last_sent = None
+                for message_id, topic, payload in batch:
+                    if not self._send(topic, payload):
+                        break
+                    last_sent = message_id
+
+                if last_sent is not None:
+                    with connection:
+                        cursor = connection.execute("DELETE FROM messages WHERE id <= ?", (last_sent,))
+                    self.backlog -= cursor.rowcount
+                    sent += cursor.rowcount
+
+                if last_sent != batch[-1][0]:
+                    break
+
+            self.drained += sent
+            self.drain_count += sent
+            if not self.backlog:
+                elapsed = time.perf_counter() - self.drain_started
+                self.drain_rate = self.drain_count / elapsed if elapsed else 0.0
+                self.drain_started = None
+
+        return sent
+
+    def metrics(self):
+        """
+        Return a line of the backlog metrics for printing
+        """
+        return ("Outbox: {0} published, {1} kept while disconnected, {2} sent later at {3:.0f} messages/s, "
+                "{4} dropped, backlog {5} (max {6})".format(self.published, self.queued, self.drained,
+                                                           self.drain_rate, self.dropped, self.backlog,
+                                                           self.max_backlog))
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,129 @@
+# File: parquet_log.py
+# Notes: Columnar (Parquet) history of the sensor log, partitioned by date and user, with the
+#        converter from csv logs and the reader used by the report generator. Needs pyarrow
+#        (pip install pyarrow), which is only imported when one of these is used
+
+
+# Imports
+import argparse
+import uuid
+from timestamps import parse_timestamps
+
+# Columns kept in the Parquet files, Date and User are the partition columns so they are held
+# in the directory names (Date=2023-05-12/User=MJ235AA/...) rather than in the files
+HISTORY_COLUMNS = ['User', 'Epoch', 'Temperature (C)', 'Humidity (%)']
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+    except ImportError:
+        raise ImportError("The Parquet history needs pyarrow, install it with: pip install pyarrow") from None
+
+    return pyarrow, pyarrow.dataset
+
+
+def _partitioning(pa, ds):
+    return ds.partitioning(pa.schema([('Date', pa.string()), ('User', pa.string())]), flavor='hive')
+
+
+def _log_epochs(df):
+    if 'Epoch' in df.columns:
+        return df['Epoch'].astype('int64')
+
+    epochs = parse_timestamps(df['Timestamp'])
+    if epochs is None:
+        raise ValueError("The log holds timestamps that are not in dd/mm/YYYY HH:MM:SS format")
+
+    return epochs
+
+
+def convert_csv_to_parquet(csv_path, history_dir, chunksize=1000000):
+    """
+    Add the readings of a csv log (either schema) to the Parquet history, chunksize rows
+    at a time. Each conversion adds new files, so a log should only be converted once.
+    Returns the number of readings converted
+    """
+    import pandas as pd
+    pa, ds = _pyarrow()
+
+    # Every file written by this conversion gets the same unique prefix, so they never
+    # overwrite the files of an earlier conversion in the same partition
+    prefix = uuid.uuid4().hex
+    file_options = ds.ParquetFileFormat().make_write_options(compression='zstd')
+    converted = 0
+
+    for n, chunk in enumerate(pd.read_csv(csv_path, chunksize=chunksize)):
+        # The blank rows that separate the access periods are not needed, periods are
+        # found from the gaps between readings
+        chunk = chunk.dropna()
+        if chunk.empty:
+            continue
+
+        readings = pd.DataFrame({'User': chunk['User'].astype(str),
+                                 'Epoch': _log_epochs(chunk),
+                                 'Temperature (C)': chunk['Temperature (C)'].astype('float64'),
+                                 'Humidity (%)': chunk['Humidity (%)'].astype('float64')})
+        readings['Date'] = pd.to_datetime(readings['Epoch'], unit='s').dt.strftime('%Y-%m-%d')
+
+        # Sorted by time so that the Epoch statistics of each row group are tight, which is
+        # what lets a time range filter skip row groups
+        readings = readings.sort_values(['Date', 'User', 'Epoch'], kind='stable')
+
+        ds.write_dataset(pa.Table.from_pandas(readings, preserve_index=False), history_dir, format='parquet',
+                         partitioning=_partitioning(pa, ds), file_options=file_options,
+                         basename_template="part-{0}-{1}-{{i}}.parquet".format(prefix, n),
+                         existing_data_behavior='overwrite_or_ignore')
+        converted += len(readings)
+
+    return converted
+
+
+def read_parquet_readings(history_dir, user=None, start=None, end=None):
+    """
+    Return the readings held in the Parquet history for a user (or all users) between the
+    start and end epoch seconds, as a DataFrame with the columns of the csv log. Only the
+    columns needed are read and the filters are pushed down into the scan, so partitions
+    of other users and dates are never opened and row groups outside the time range are
+    skipped
+    """
+    import pandas as pd
+    pa, ds = _pyarrow()
+
+    dataset = ds.dataset(history_dir, format='parquet', partitioning=_partitioning(pa, ds))
+
+    conditions = []
+    if user is not None:
+        conditions.append(ds.field('User') == user)
+    if start is not None:
+        conditions.append(ds.field('Date') >= pd.Timestamp(start, unit='s').strftime('%Y-%m-%d'))
+        conditions.append(ds.field('Epoch') >= start)
+    if end is not None:
+        conditions.append(ds.field('Date') <= pd.Timestamp(end, unit='s').strftime('%Y-%m-%d'))
+        conditions.append(ds.field('Epoch') < end)
+
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+
+    table = dataset.to_table(columns=HISTORY_COLUMNS, filter=condition)
+
+    # Partitions are read in no particular order
+    return table.to_pandas().sort_values('Epoch', kind='stable', ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add the readings of csv sensor logs to the Parquet history")
+    parser.add_argument('history_dir', help="directory holding the Parquet history")
+    parser.add_argument('log_files', nargs='+', help="csv logs to convert")
+    parser.add_argument('--chunksize', type=int, default=1000000, help="rows converted at a time")
+    args = parser.parse_args()
+
+    for log_file in args.log_files:
+        converted = convert_csv_to_parquet(log_file, args.history_dir, args.chunksize)
+        print("{0}: {1} readings converted".format(log_file, converted))
+
+
+if __name__ == "__main__":
+    main()
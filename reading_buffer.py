@@ -0,0 +1,123 @@
+# File: reading_buffer.py
+# Notes: Compact, columnar in-memory store for the sensor readings logged by the MQTT subscriber
+
+
+# Imports
+from array import array
+from timestamps import format_timestamp
+
+NAN = float('nan')
+
+
+class ReadingBuffer:
+    """
+    Holds sensor readings in typed arrays, one per field, rather than as rows. Appending
+    a reading just stores six numbers (user codes are stored once and referred to by id),
+    the arrays are preallocated and doubled in size when full so append is amortized O(1).
+    Readings are only turned into csv rows or a pandas DataFrame when the buffer is flushed.
+    The door a reading was taken at is kept too (stored once and referred to by id, like
+    user codes), it is not one of the log columns but can be asked for as 'Door'
+    """
+    # Log column name for each field, in the order the fields are passed to append()
+    COLUMNS = ('User', 'Epoch', 'Temperature (C)', 'Humidity (%)', 'Pressure (hPa)', 'Gas Resistance (Ohms)')
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.length = 0
+
+        self.users = []
+        self.user_ids = {}
+        self.doors = []
+        self.door_ids = {}
+
+        self.user_id = array('i', bytes(4 * capacity))
+        self.door_id = array('i', bytes(4 * capacity))
+        self.timestamp = array('q', bytes(8 * capacity))  # Epoch seconds
+        self.temperature = array('d', bytes(8 * capacity))
+        self.humidity = array('d', bytes(8 * capacity))
+        self.pressure = array('d', bytes(8 * capacity))
+        self.gas_resistance = array('d', bytes(8 * capacity))
+
+    def __len__(self):
+        return self.length
+
+    def _grow(self):
+        for values in (self.user_id, self.door_id, self.timestamp, self.temperature, self.humidity, self.pressure,
+                       self.gas_resistance):
+            values.extend(values)
+
+        self.capacity *= 2
+
+    def append(self, user, timestamp, temperature, humidity, pressure=NAN, gas_resistance=NAN, door=None):
+        """
+        Store a single reading, timestamp is in epoch seconds and a None value for any of
+        the readings is stored as NaN
+        """
+        user_id = self.user_ids.get(user)
+        if user_id is None:
+            user_id = self.user_ids[user] = len(self.users)
+            self.users.append(user)
+
+        door_id = self.door_ids.get(door)
+        if door_id is None:
+            door_id = self.door_ids[door] = len(self.doors)
+            self.doors.append(door)
+
+        if self.length == self.capacity:
+            self._grow()
+
+        i = self.length
+        self.user_id[i] = user_id
+        self.door_id[i] = door_id
+        self.timestamp[i] = timestamp
+        self.temperature[i] = NAN if temperature is None else temperature
+        self.humidity[i] = NAN if humidity is None else humidity
+        self.pressure[i] = NAN if pressure is None else pressure
+        self.gas_resistance[i] = NAN if gas_resistance is None else gas_resistance
+        self.length = i + 1
+
+    def clear(self):
+        """
+        Forget all readings, the allocated arrays are kept to be reused
+        """
+        self.length = 0
+
+    def column(self, name):
+        """
+        Return the values of one of the log columns as a list
+        """
+        n = self.length
+
+        if name == 'User':
+            users = self.users
+            return [users[i] for i in self.user_id[:n]]
+        if name == 'Door':
+            doors = self.doors
+            return [doors[i] for i in self.door_id[:n]]
+        if name == 'Epoch':
+            return self.timestamp[:n].tolist()
+        if name == 'Timestamp':
+            # Only legacy logs hold the formatted timestamp
+            return [format_timestamp(t) for t in self.timestamp[:n]]
+        if name == 'Temperature (C)':
+            return self.temperature[:n].tolist()
+        if name == 'Humidity (%)':
+            return self.humidity[:n].tolist()
+        if name == 'Pressure (hPa)':
+            return self.pressure[:n].tolist()
+        if name == 'Gas Resistance (Ohms)':
+            return self.gas_resistance[:n].tolist()
+
+        raise KeyError(name)
+
+    def rows(self, columns=COLUMNS):
+        """
+        Return the readings as rows holding the given log columns
+        """
+        return zip(*[self.column(name) for name in columns])
+
+    def to_dataframe(self, columns=COLUMNS):
+        # pandas is only needed here, so it is not imported until the buffer is converted
+        import pandas as pd
+
+        return pd.DataFrame({name: self.column(name) for name in columns}, columns=list(columns))
@@ -0,0 +1,112 @@
+# File: scheduler.py
+# Notes: Runs the tasks of an app each at a fixed rate on one thread, every task has its own period
+#        and its runs are timed against monotonic deadlines a period apart, so time spent running
+#        it (and oversleeping) does not add up into drift, the thread sleeps until the next deadline
+
+
+# Imports
+import time
+from bisect import bisect_right
+
+# Upper bounds (in seconds) of the buckets of the histogram of how long each run of a task takes,
+# the last bucket takes the rest
+DURATION_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+class Task:
+    """
+    A task run every period seconds (or as often as possible for a period of 0) and the
+    metrics of its runs
+    """
+    def __init__(self, name, period, fn):
+        self.name = name
+        self.period = period
+        self.fn = fn
+        self.deadline = None
+
+        self.runs = 0
+        self.overruns = 0  # Runs that finished after the next run was due
+        self.skipped = 0  # Runs missed altogether catching up after overruns
+        self.max_lateness = 0.0  # Longest a run started after it was due
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * (len(DURATION_BUCKETS) + 1)
+
+    @property
+    def mean_time(self):
+        return self.total_time / self.runs if self.runs else 0.0
+
+    def run(self, now):
+        self.max_lateness = max(self.max_lateness, now - self.deadline)
+        self.fn()
+
+        finished = time.monotonic()
+        elapsed = finished - now
+        self.runs += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.histogram[bisect_right(DURATION_BUCKETS, elapsed)] += 1
+
+        if not self.period:
+            self.deadline = finished
+            return
+
+        # The next deadline is a period after the last one, not after now, so the rate holds
+        self.deadline += self.period
+        if finished > self.deadline:
+            # Behind, the runs already missed (every deadline passed while running) are skipped
+            # rather than made up in a burst, keeping the deadlines on the same grid
+            missed = int((finished - self.deadline) / self.period) + 1
+            self.overruns += 1
+            self.skipped += missed
+            self.deadline += missed * self.period
+
+    def metrics(self):
+        """
+        Return a line of the task's metrics for printing
+        """
+        histogram = " ".join("<{0:g}ms:{1}".format(bound * 1000, count)
+                             for bound, count in zip(DURATION_BUCKETS, self.histogram) if count)
+        if self.histogram[-1]:
+            histogram += " >={0:g}ms:{1}".format(DURATION_BUCKETS[-1] * 1000, self.histogram[-1])
+
+        return ("{0}: {1} runs every {2:g} s, {3} overruns ({4} runs skipped), max {5:.1f} ms late, "
+                "{6:.2f} ms/run (max {7:.2f} ms), durations {8}".format(
+                    self.name, self.runs, self.period, self.overruns, self.skipped, self.max_lateness * 1000,
+                    self.mean_time * 1000, self.max_time * 1000, histogram))
+
+
+class Scheduler:
+    """
+    Runs every task added on the thread that calls run(), each at the rate of its own
+    period, the first time straight away. When more than one task is due they run in the
+    order they were added, in between the thread sleeps until the earliest deadline
+    """
+    def __init__(self):
+        self.tasks = []
+
+    def add(self, name, period, fn):
+        """
+        Run fn() every period seconds, returns its Task
+        """
+        task = Task(name, period, fn)
+        self.tasks.append(task)
+        return task
+
+    def run(self, finished):
+        """
+        Run the tasks until finished() returns True, which is checked after every run
+        """
+        now = time.monotonic()
+        for task in self.tasks:
+            if task.deadline is None:
+                task.deadline = now
+
+        while not finished():
+            now = time.monotonic()
+            due = min(self.tasks, key=lambda task: task.deadline)
+            if due.deadline > now:
+                time.sleep(due.deadline - now)
+                now = time.monotonic()
+
+            due.run(now)
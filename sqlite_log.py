@@ -0,0 +1,191 @@
+# File: sqlite_log.py
+# Notes: SQLite storage backend for the sensor log recorded by the MQTT subscriber, and the
+#        queries used by the report generator to read it back
+
+
+# Imports
+import os.path
+import sqlite3
+from log_writer import BufferedLogWriter
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    user TEXT NOT NULL,
+    epoch INTEGER NOT NULL,
+    temperature REAL,
+    humidity REAL,
+    pressure REAL,
+    gas_resistance REAL,
+    door TEXT
+);
+CREATE INDEX IF NOT EXISTS readings_user_epoch ON readings (user, epoch);
+CREATE INDEX IF NOT EXISTS readings_epoch ON readings (epoch);
+
+CREATE TABLE IF NOT EXISTS access_periods (
+    id INTEGER PRIMARY KEY,
+    user TEXT,
+    start_epoch INTEGER NOT NULL,
+    end_epoch INTEGER,
+    door TEXT
+);
+CREATE INDEX IF NOT EXISTS access_periods_user_start ON access_periods (user, start_epoch);
+"""
+
+# Created once the door columns are known to be there, databases written before readings were
+# logged by door lack them until migrated
+_DOOR_INDEXES = """
+CREATE INDEX IF NOT EXISTS readings_door_epoch ON readings (door, epoch);
+CREATE INDEX IF NOT EXISTS access_periods_door_start ON access_periods (door, start_epoch);
+"""
+
+# Log columns in the order of the columns of the readings table
+_READING_COLUMNS = ('User', 'Epoch', 'Temperature (C)', 'Humidity (%)', 'Pressure (hPa)', 'Gas Resistance (Ohms)',
+                    'Door')
+
+
+def connect(db_path):
+    """
+    Open the log database, creating the tables if needed (and adding the door columns to
+    the tables of an older database), the database is put in WAL mode so the report can
+    read it while the subscriber is writing to it
+    """
+    connection = sqlite3.connect(db_path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(_SCHEMA)
+
+    with connection:
+        for table in ('readings', 'access_periods'):
+            columns = [row[1] for row in connection.execute("PRAGMA table_info({0})".format(table))]
+            if 'door' not in columns:
+                # The door of the rows already logged is not known, so it is left NULL
+                connection.execute("ALTER TABLE {0} ADD COLUMN door TEXT".format(table))
+    connection.executescript(_DOOR_INDEXES)
+    return connection
+
+
+def _connect_existing(db_path):
+    # Reading a database that is not there should not quietly create an empty one
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError("No such log database: '{0}'".format(db_path))
+
+    return connect(db_path)
+
+
+class SqliteLogWriter(BufferedLogWriter):
+    """
+    Writes the readings taken during access periods to a SQLite database, each batch of
+    buffered readings is inserted in a single transaction. The start and end of every
+    access period are recorded in a table of their own as they happen, an access period
+    is known by its door, user and start epoch, so the end of one that was started by an
+    earlier run of the subscriber (the latest one of the user at the door still open in
+    the database) is recorded against the right row. The database is opened by the first
+    write (a SQLite connection can only be used by the thread that opened it, and that
+    is the log writer thread when run by a BackgroundLogWriter)
+    """
+    def __init__(self, db_path='bme680_data.db', flush_rows=10, flush_interval=5.0):
+        super().__init__(flush_rows, flush_interval)
+        self.db_path = db_path
+
+        self.connection = None
+        self.open_periods = {}  # (door, user) -> start epoch of the access period under way
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = connect(self.db_path)
+
+            # Access periods left open by an earlier run, only the latest of each user at each door
+            # can still be under way, any older ones were never ended (the run stopped before they were)
+            self.open_periods = {(door, user): start_time for door, user, start_time in self.connection.execute(
+                "SELECT door, user, MAX(start_epoch) FROM access_periods WHERE end_epoch IS NULL "
+                "GROUP BY door, user")}
+
+        return self.connection
+
+    def start_access_period(self, user, start_time, door=None):
+        connection = self._connect()
+        with connection:
+            connection.execute("INSERT INTO access_periods (user, start_epoch, door) VALUES (?, ?, ?)",
+                               (user, start_time, door))
+        self.open_periods[(door, user)] = start_time
+
+    def end_access_period(self, user, end_time, door=None):
+        self.flush()
+
+        connection = self._connect()
+        start_time = self.open_periods.pop((door, user), None)
+        if start_time is None:
+            # Its start was never recorded, so there is no access period to end
+            return
+
+        with connection:
+            connection.execute("UPDATE access_periods SET end_epoch = ? "
+                               "WHERE door IS ? AND user IS ? AND start_epoch = ? AND end_epoch IS NULL",
+                               (end_time, door, user, start_time))
+
+    def _write_pending(self):
+        connection = self._connect()
+        with connection:
+            connection.executemany("INSERT INTO readings VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   self.pending.rows(_READING_COLUMNS))
+
+    def close(self):
+        self.flush()
+
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def _where(door=None, user=None, start=None, end=None, epoch_column='epoch'):
+    conditions = []
+    parameters = []
+
+    if door is not None:
+        conditions.append("door = ?")
+        parameters.append(door)
+    if user is not None:
+        conditions.append("user = ?")
+        parameters.append(user)
+    if start is not None:
+        conditions.append("{0} >= ?".format(epoch_column))
+        parameters.append(start)
+    if end is not None:
+        conditions.append("{0} < ?".format(epoch_column))
+        parameters.append(end)
+
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), parameters
+
+
+def query_readings(db_path, door=None, user=None, start=None, end=None):
+    """
+    Return the readings logged at a door for a user (or all of them) between the start and
+    end epoch seconds as a DataFrame with the same columns as the csv log, the (user, epoch)
+    and (door, epoch) indexes mean only the matching rows are read
+    """
+    import pandas as pd
+
+    where, parameters = _where(door, user, start, end)
+    connection = _connect_existing(db_path)
+    try:
+        rows = connection.execute("SELECT user, epoch, temperature, humidity FROM readings" + where +
+                                  " ORDER BY epoch", parameters).fetchall()
+    finally:
+        connection.close()
+
+    return pd.DataFrame(rows, columns=['User', 'Epoch', 'Temperature (C)', 'Humidity (%)'])
+
+
+def query_access_periods(db_path, door=None, user=None, start=None, end=None):
+    """
+    Return the access periods recorded at a door for a user (or all of them) that started
+    between the start and end epoch seconds, as a list of (user, start_epoch, end_epoch)
+    tuples, the end is None for an access period that has not ended yet
+    """
+    where, parameters = _where(door, user, start, end, epoch_column='start_epoch')
+    connection = _connect_existing(db_path)
+    try:
+        return connection.execute("SELECT user, start_epoch, end_epoch FROM access_periods" + where +
+                                  " ORDER BY start_epoch", parameters).fetchall()
+    finally:
+        connection.close()
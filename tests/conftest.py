@@ -0,0 +1,10 @@
+# File: conftest.py
+# Notes: The modules under test live at the top of the repository rather than in a package, so it
+#        is put on the path for the tests
+
+
+# Imports
+import os.path
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,45 @@
+# File: test_access_drivers.py
+# Notes: Tests of the request sources of the publisher's drivers
+
+
+# Imports
+from access_drivers import replay_requests, script_requests
+
+
+def _write_log(tmp_path, rows):
+    log_path = tmp_path / "log.csv"
+    log_path.write_text("User,Epoch,Temperature (C),Humidity (%)\n" +
+                        "".join("{0},{1},24.5,45.0\n".format(*row) if row else ",,,\n" for row in rows))
+    return str(log_path)
+
+
+def test_replay_exit_before_next_enter(tmp_path):
+    # A's period ends at 101 (so A leaves at 102) and B's starts at 102
+    log_path = _write_log(tmp_path, [("A", 100), ("A", 101), None, ("B", 102), ("B", 103), None])
+
+    requests = [(action, user) for _, action, user, _ in replay_requests(log_path, speed=0)]
+
+    assert requests == [('enter', 'A'), ('exit', 'A'), ('enter', 'B'), ('exit', 'B')]
+
+
+def test_replay_delays(tmp_path):
+    log_path = _write_log(tmp_path, [("A", 100), ("A", 104), None, ("B", 110), None])
+
+    delays = [delay for delay, _, _, _ in replay_requests(log_path, speed=2.0)]
+
+    assert delays == [0.0, 2.5, 2.5, 0.5]
+
+
+def test_replay_empty_log(tmp_path):
+    log_path = tmp_path / "empty.csv"
+    log_path.write_text("")
+
+    assert list(replay_requests(str(log_path))) == []
+
+
+def test_script_requests(tmp_path):
+    script_path = tmp_path / "script.txt"
+    script_path.write_text("# A comment\nenter MJ235AA\nwait 1.5\nexit MJ235AA door-2\n")
+
+    assert list(script_requests(str(script_path))) == [(0.0, 'enter', 'MJ235AA', None),
+                                                         (1.5, 'exit', 'MJ235AA', 'door-2')]
@@ -0,0 +1,40 @@
+# File: test_access_events.py
+# Notes: Tests of the binary access event payload
+
+
+# Imports
+import pytest
+from access_events import AccessEvent, decode_event, encode_event
+
+
+@pytest.mark.parametrize('door, user, action, epoch_ms, seq', [
+    ('cet235-bi10sg', 'MJ235AA', 'enter', 1700000000123, 0),
+    ('d2', 'CK523BB', 'exit', 0, 2 ** 32 - 1),
+    ('', '', 'enter', -1000, 7),
+    ('porte-été', 'Zürich', 'exit', 1700000000000, 42),
+])
+def test_round_trip(door, user, action, epoch_ms, seq):
+    assert decode_event(encode_event(door, user, action, epoch_ms, seq)) == \
+        AccessEvent(door, user, action, epoch_ms, seq)
+
+
+def test_seq_wraps():
+    assert decode_event(encode_event('d', 'u', 'enter', 0, 2 ** 32 + 5)).seq == 5
+
+
+def test_too_long():
+    with pytest.raises(ValueError):
+        encode_event('d' * 256, 'u', 'enter', 0, 0)
+
+
+@pytest.mark.parametrize('payload', [
+    b'',
+    b'\x01\x01',
+    b'\x02' + encode_event('d', 'u', 'enter', 0, 0)[1:],
+    encode_event('d', 'u', 'enter', 0, 0)[:1] + b'\x09' + encode_event('d', 'u', 'enter', 0, 0)[2:],
+    encode_event('d', 'u', 'enter', 0, 0) + b'x',
+    encode_event('d', 'u', 'enter', 0, 0)[:-1],
+])
+def test_bad_payloads(payload):
+    with pytest.raises(ValueError):
+        decode_event(payload)
@@ -0,0 +1,114 @@
+# File: test_authorization.py
+# Notes: Tests of the user codes store and the reloading of its codes file
+
+
+# Imports
+import os
+import pytest
+from authorization import AuthorizationStore, BloomFilter
+
+
+@pytest.fixture(params=[False, True], ids=['dict', 'bloom'])
+def store_at(request, tmp_path):
+    codes_path = tmp_path / "codes.txt"
+
+    def store_at(text):
+        codes_path.write_bytes(text)
+        return AuthorizationStore(str(codes_path), bloom_filter=request.param, reload_interval=None), codes_path
+
+    return store_at
+
+
+def _append(path, text):
+    with open(str(path), 'ab') as f:
+        f.write(text)
+
+
+def test_windows(store_at):
+    store, _ = store_at(b"# codes\nA\nB,100,200\nC,,150\nD,150\n")
+
+    assert store.is_valid('A')
+    assert [store.is_valid('B', now) for now in (99, 100, 199, 200)] == [False, True, True, False]
+    assert store.is_valid('C', 149) and not store.is_valid('C', 150)
+    assert not store.is_valid('D', 149) and store.is_valid('D', 150)
+    assert not store.is_valid('E')
+    assert len(store) == 4
+
+
+def test_incremental_reload(store_at):
+    store, path = store_at(b"A\nB\n")
+    assert store.is_valid('A')
+
+    _append(path, b"C\n-A\nB,100,200\n")
+    assert store.reload() == 3
+    assert store.reloads == 1
+    assert store.is_valid('C')
+    assert not store.is_valid('A')
+    assert not store.is_valid('B', 300)
+
+    # Nothing appended, nothing read
+    assert store.reload() == 0
+    assert store.lines_read == 5
+
+
+def test_partial_line_read_once_complete(store_at):
+    store, path = store_at(b"A\n")
+    assert store.is_valid('A')
+
+    _append(path, b"B")
+    assert store.reload() == 0
+    assert not store.is_valid('B')
+
+    _append(path, b"\n")
+    assert store.reload() == 1
+    assert store.is_valid('B')
+
+
+def test_replaced_file_read_again(store_at, tmp_path):
+    store, path = store_at(b"A\nB\n")
+    assert store.is_valid('A')
+
+    replacement = tmp_path / "new.txt"
+    replacement.write_bytes(b"C\n")
+    os.replace(str(replacement), str(path))
+
+    store.reload()
+    assert store.is_valid('C')
+    assert not store.is_valid('A')
+
+
+def test_bad_lines_skipped(store_at):
+    store, path = store_at(b"A\nB,soon\n,100\n\xff\xfe\nC\n")
+
+    assert store.is_valid('A') and store.is_valid('C')
+    assert not store.is_valid('B')
+    assert store.bad_lines == 3
+    assert store.lines_read == 2
+
+    # A bad line appended later is skipped without holding up the lines after it
+    _append(path, b"D,x,y\nE\n")
+    assert store.reload() == 1
+    assert store.is_valid('E')
+    assert store.bad_lines == 4
+
+
+def test_reload_interval(tmp_path):
+    path = tmp_path / "codes.txt"
+    path.write_bytes(b"A\n")
+    store = AuthorizationStore(str(path), reload_interval=0.0)
+    assert store.is_valid('A')
+
+    # is_valid() reloads the file once the interval has passed
+    _append(path, b"B\n")
+    assert store.is_valid('B')
+
+
+def test_bloom_filter():
+    bloom_filter = BloomFilter(1000)
+    codes = ["U{0:04d}".format(i) for i in range(1000)]
+    for code in codes:
+        bloom_filter.add(code)
+
+    assert all(code in bloom_filter for code in codes)
+    false_positives = sum("X{0:04d}".format(i) in bloom_filter for i in range(10000))
+    assert false_positives < 300
@@ -0,0 +1,111 @@
+# File: test_door_access.py
+# Notes: Tests of the routing of door messages to the access period state of their door
+
+
+# Imports
+import pytest
+from access_events import encode_event
+from door_access import DoorTable, door_topic, split_door_topic
+
+
+def _event(table, door, user, action, seq, epoch=1700000000):
+    return table.handle(door_topic(door, 'event'), encode_event(door, user, action, epoch * 1000, seq))
+
+
+def test_enter_and_exit():
+    table = DoorTable()
+
+    assert _event(table, 'd1', 'A', 'enter', 0)[0] == 'enter'
+    assert list(table.active) == ['d1']
+    assert table.active['d1'].user_code == 'A'
+
+    event, access_period, epoch = _event(table, 'd1', 'A', 'exit', 1, epoch=1700000010)
+    assert (event, access_period.door, epoch) == ('exit', 'd1', 1700000010)
+    assert not table.active
+    assert (table.duplicate_events, table.missed_events, table.restarts) == (0, 0, 0)
+
+
+def test_duplicate_dropped():
+    table = DoorTable()
+    _event(table, 'd1', 'A', 'enter', 5)
+
+    assert _event(table, 'd1', 'A', 'enter', 5) is None
+    assert table.duplicate_events == 1
+    assert table.restarts == 0
+
+
+def test_restart():
+    table = DoorTable()
+    _event(table, 'd1', 'A', 'enter', 5)
+    _event(table, 'd1', 'A', 'exit', 6)
+
+    # The publisher restarted and numbers its events from 0 again, the event is still acted on
+    assert _event(table, 'd1', 'B', 'enter', 0)[0] == 'enter'
+    assert table.active['d1'].user_code == 'B'
+    assert (table.restarts, table.duplicate_events) == (1, 0)
+
+    # Going backwards is a restart too, as is the same number for a different event
+    _event(table, 'd1', 'B', 'exit', 1)
+    _event(table, 'd1', 'C', 'enter', 1)
+    assert table.active['d1'].user_code == 'C'
+    assert (table.restarts, table.missed_events) == (2, 0)
+
+
+def test_gap():
+    table = DoorTable()
+    _event(table, 'd1', 'A', 'enter', 1)
+    _event(table, 'd1', 'A', 'exit', 4)
+
+    assert table.missed_events == 1
+    assert not table.active
+
+
+def test_seq_wraps():
+    table = DoorTable()
+    _event(table, 'd1', 'A', 'enter', 2 ** 32 - 1)
+    _event(table, 'd1', 'A', 'exit', 0)
+
+    assert (table.missed_events, table.restarts) == (0, 0)
+
+
+def test_doors_kept_apart():
+    table = DoorTable()
+    _event(table, 'd1', 'A', 'enter', 0)
+    _event(table, 'd2', 'B', 'enter', 0)
+    _event(table, 'd1', 'A', 'exit', 1)
+
+    assert list(table.active) == ['d2']
+    assert len(table) == 2
+
+
+def test_door_mismatch_rejected():
+    table = DoorTable()
+
+    with pytest.raises(ValueError):
+        table.handle(door_topic('d1', 'event'), encode_event('d2', 'A', 'enter', 0, 0))
+    assert len(table) == 0
+
+
+def test_invalid_door_rejected():
+    table = DoorTable()
+
+    with pytest.raises(ValueError):
+        table.door('../etc')
+
+
+def test_legacy_topics():
+    table = DoorTable()
+    table.handle(door_topic('d1', 'user'), b'A')
+    event, access_period, epoch = table.handle(door_topic('d1', 'enter'), b'14/11/2023 22:13:20')
+
+    assert (event, epoch) == ('enter', 1700000000)
+    assert access_period.user_code == 'A'
+    assert 'd1' in table.active
+
+    assert DoorTable(legacy_topics=False).handle(door_topic('d1', 'user'), b'A') is None
+
+
+def test_split_door_topic():
+    assert split_door_topic('uos/d1/door/event') == ('d1', 'event')
+    assert split_door_topic('uos/d1/door/other') is None
+    assert split_door_topic('uos/d1/window/event') is None
@@ -0,0 +1,78 @@
+# File: test_generate_report.py
+# Notes: Tests of the incremental report, which must end up with the same access periods as the
+#        full report however the log was split between runs
+
+
+# Imports
+import pandas as pd
+import pytest
+from generate_report_2 import (find_access_periods, prepare_readings, print_access_period_summary,
+                               process_access_periods, run_incremental)
+
+HEADER = "User,Epoch,Temperature (C),Humidity (%)\n"
+
+# Access periods of A and B, interleaved, with a blank separator row after each
+ROWS = ["A,100,24.5,45.0", "A,101,24.9,44.0", "B,101,25.5,50.0", "A,102,25.1,43.0", "B,102,25.0,51.0", ",,,",
+        "A,110,23.0,40.0", "A,111,23.5,41.0", ",,,", "B,120,26.0,55.0", "B,121,26.5,54.0", "B,122,26.1,53.0", ",,,"]
+
+
+def _text(rows):
+    return "".join(row + "\n" for row in rows)
+
+
+def _summary_lines(report):
+    # The full report without the readings of each access period, which is what the summary holds
+    return [line for line in report.splitlines() if not line.startswith(("  Readings:", "    Timestamp:"))]
+
+
+@pytest.mark.parametrize('splits', [[], [3], [4, 8], [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]],
+                         ids=['one run', 'period split', 'two splits', 'every row'])
+def test_incremental_matches_full_report(tmp_path, capsys, splits):
+    log_path = tmp_path / "log.csv"
+    checkpoint_path = str(tmp_path / "log.csv.report.json")
+    log_path.write_text(HEADER)
+
+    for start, end in zip([0] + splits, splits + [len(ROWS)]):
+        with open(str(log_path), 'a') as f:
+            f.write(_text(ROWS[start:end]))
+        tracker = run_incremental(str(log_path), checkpoint_path)
+
+    print_access_period_summary(tracker)
+    incremental = capsys.readouterr().out
+
+    process_access_periods(prepare_readings(pd.read_csv(str(log_path))))
+    full = capsys.readouterr().out
+
+    assert _summary_lines(incremental) == _summary_lines(full)
+
+    _, periods = find_access_periods(prepare_readings(pd.read_csv(str(log_path))))
+    assert sum(len(tracker.access_periods(user)) for user in tracker.staff_members) == len(periods) == 4
+
+
+def test_partial_row_read_next_run(tmp_path):
+    log_path = tmp_path / "log.csv"
+    checkpoint_path = str(tmp_path / "log.csv.report.json")
+
+    # The last row is still being written, so only the rows before it are used
+    log_path.write_text(HEADER + _text(ROWS[:2]) + "A,10")
+    tracker = run_incremental(str(log_path), checkpoint_path)
+    assert tracker.access_periods('A')[0]['End Time'] == pd.Timestamp(101, unit='s')
+
+    with open(str(log_path), 'a') as f:
+        f.write("2,25.1,43.0\n")
+    tracker = run_incremental(str(log_path), checkpoint_path)
+    assert [period['End Time'] for period in tracker.access_periods('A')] == [pd.Timestamp(102, unit='s')]
+
+
+def test_replaced_log_read_again(tmp_path):
+    log_path = tmp_path / "log.csv"
+    checkpoint_path = str(tmp_path / "log.csv.report.json")
+
+    log_path.write_text(HEADER + _text(ROWS))
+    run_incremental(str(log_path), checkpoint_path)
+
+    log_path.write_text(HEADER + _text(ROWS[:2]))
+    tracker = run_incremental(str(log_path), checkpoint_path)
+
+    assert tracker.staff_members == ['A']
+    assert len(tracker.access_periods('A')) == 1
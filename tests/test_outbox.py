@@ -0,0 +1,110 @@
+# File: test_outbox.py
+# Notes: Tests of the outbound message backlog kept while the MQTT connection is down
+
+
+# Imports
+from outbox import Outbox
+
+
+class FakeLink:
+    """
+    The MQTT connection an Outbox sends on, up or down as the test sets it, it can also
+    be made to fail after a number of messages
+    """
+    def __init__(self):
+        self.up = True
+        self.fail_after = None
+        self.sent = []
+
+    def connected(self):
+        return self.up
+
+    def send(self, topic, payload):
+        if self.fail_after is not None and len(self.sent) >= self.fail_after:
+            raise OSError("connection lost")
+        self.sent.append((topic, payload))
+        return True
+
+
+def _outbox(tmp_path, link, **kwargs):
+    return Outbox(str(tmp_path / "outbox.db"), link.send, link.connected, **kwargs)
+
+
+def test_sent_straight_away(tmp_path):
+    link = FakeLink()
+    outbox = _outbox(tmp_path, link)
+
+    assert outbox.publish("t", "a")
+    assert link.sent == [("t", b"a")]
+    assert outbox.backlog == 0
+    assert not (tmp_path / "outbox.db").exists()
+
+
+def test_order_kept_through_outage(tmp_path):
+    link = FakeLink()
+    outbox = _outbox(tmp_path, link, batch_size=2)
+
+    outbox.publish("t", "1")
+    link.up = False
+    outbox.publish("t", "2")
+    outbox.publish("t", "3")
+    link.up = True
+
+    # A message published while there is a backlog goes to the back of it, not out first
+    assert not outbox.publish("t", "4")
+    assert outbox.drain() == 3
+    outbox.publish("t", "5")
+
+    assert [payload for _, payload in link.sent] == [b"1", b"2", b"3", b"4", b"5"]
+    assert outbox.backlog == 0
+    assert (outbox.queued, outbox.drained) == (3, 3)
+
+
+def test_drain_stops_at_failed_send(tmp_path):
+    link = FakeLink()
+    link.up = False
+    outbox = _outbox(tmp_path, link, batch_size=10)
+    for i in range(5):
+        outbox.publish("t", str(i))
+
+    link.up = True
+    link.fail_after = 2
+    assert outbox.drain() == 2
+    assert outbox.backlog == 3
+
+    link.fail_after = None
+    assert outbox.drain() == 3
+    assert [payload for _, payload in link.sent] == [b"0", b"1", b"2", b"3", b"4"]
+
+
+def test_cap_drops_oldest(tmp_path):
+    link = FakeLink()
+    link.up = False
+    outbox = _outbox(tmp_path, link, max_messages=3)
+    for i in range(5):
+        outbox.publish("t", str(i))
+
+    assert (outbox.backlog, outbox.dropped, outbox.max_backlog) == (3, 2, 3)
+
+    link.up = True
+    outbox.drain()
+    assert [payload for _, payload in link.sent] == [b"2", b"3", b"4"]
+
+
+def test_backlog_survives_restart(tmp_path):
+    link = FakeLink()
+    link.up = False
+    outbox = _outbox(tmp_path, link)
+    outbox.publish("t", "1")
+    outbox.publish("t", "2")
+    outbox.close()
+
+    link.up = True
+    outbox = _outbox(tmp_path, link)
+    assert outbox.backlog == 2
+
+    # The backlog left by the earlier run is sent before anything new
+    outbox.publish("t", "3")
+    outbox.drain()
+    assert [payload for _, payload in link.sent] == [b"1", b"2", b"3"]
+    outbox.close()
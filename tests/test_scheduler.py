@@ -0,0 +1,108 @@
+# File: test_scheduler.py
+# Notes: Tests of the fixed rate task scheduler, run against a fake clock so the deadlines are exact
+
+
+# Imports
+import pytest
+import scheduler
+from scheduler import Scheduler
+
+
+class FakeClock:
+    """
+    Stands in for time.monotonic() and time.sleep(), time only moves when slept or
+    advanced by a task
+    """
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(scheduler.time, 'sleep', clock.sleep)
+    return clock
+
+
+def _run(tasks, runs):
+    # Run the tasks until the first of them has run the given number of times
+    sched = Scheduler()
+    for name, period, fn in tasks:
+        sched.add(name, period, fn)
+    sched.run(lambda: sched.tasks[0].runs >= runs)
+    return sched
+
+
+def test_deadline_grid(clock):
+    started = []
+
+    def work():
+        started.append(clock.now - 1000.0)
+        clock.now += 0.3
+
+    task = _run([("work", 1.0, work)], 4).tasks[0]
+
+    # Time spent running does not push the following runs back
+    assert started == pytest.approx([0.0, 1.0, 2.0, 3.0])
+    assert (task.overruns, task.skipped) == (0, 0)
+
+
+def test_overrun_skips_missed_runs(clock):
+    started = []
+
+    def work():
+        started.append(clock.now - 1000.0)
+        clock.now += 2.5 if len(started) == 2 else 0.1
+
+    task = _run([("work", 1.0, work)], 4).tasks[0]
+
+    # The run due at 1 finishes at 3.5, the run due at 2 and 3 are skipped and the next is at 4
+    assert started == pytest.approx([0.0, 1.0, 4.0, 5.0])
+    assert task.overruns == 1
+    assert task.skipped == 2
+    assert task.deadline == pytest.approx(1006.0)
+
+
+def test_tasks_at_their_own_rates(clock):
+    fast = []
+    slow = []
+
+    sched = _run([("slow", 1.0, lambda: slow.append(clock.now - 1000.0)),
+                  ("fast", 0.25, lambda: fast.append(clock.now - 1000.0))], 3)
+
+    assert slow == pytest.approx([0.0, 1.0, 2.0])
+    assert fast == pytest.approx([0.0, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 1.75])
+    assert sched.tasks[1].max_lateness == pytest.approx(0.0)
+
+
+def test_zero_period_runs_back_to_back(clock):
+    started = []
+
+    def work():
+        started.append(clock.now - 1000.0)
+        clock.now += 0.5
+
+    task = _run([("work", 0, work)], 3).tasks[0]
+
+    assert started == pytest.approx([0.0, 0.5, 1.0])
+    assert task.overruns == 0
+
+
+def test_finishing_on_the_next_deadline_skips_nothing(clock):
+    started = []
+
+    def work():
+        started.append(clock.now - 1000.0)
+        clock.now += 1.0 if len(started) == 1 else 0.1
+
+    task = _run([("work", 1.0, work)], 3).tasks[0]
+
+    assert started == pytest.approx([0.0, 1.0, 2.0])
+    assert (task.overruns, task.skipped) == (0, 0)
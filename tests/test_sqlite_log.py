@@ -0,0 +1,97 @@
+# File: test_sqlite_log.py
+# Notes: Tests of the SQLite storage backend of the sensor log
+
+
+# Imports
+import sqlite3
+from sqlite_log import SqliteLogWriter, connect, query_access_periods, query_readings
+
+
+def test_access_period_ended_after_restart(tmp_path):
+    db_path = str(tmp_path / "log.db")
+
+    # The first run stops while A's second access period is under way, the first was never ended
+    writer = SqliteLogWriter(db_path)
+    writer.start_access_period('A', 100)
+    writer.start_access_period('A', 200)
+    writer.close()
+
+    writer = SqliteLogWriter(db_path)
+    writer.end_access_period('A', 250)
+    writer.close()
+
+    assert query_access_periods(db_path) == [('A', 100, None), ('A', 200, 250)]
+
+
+def test_access_period_end_without_start(tmp_path):
+    db_path = str(tmp_path / "log.db")
+
+    writer = SqliteLogWriter(db_path)
+    writer.start_access_period('A', 100)
+    writer.end_access_period('A', 150)
+    writer.end_access_period('A', 160)
+    writer.close()
+
+    assert query_access_periods(db_path) == [('A', 100, 150)]
+
+
+def test_access_periods_by_door(tmp_path):
+    db_path = str(tmp_path / "log.db")
+
+    # A is let in at both doors, ending the period at one door leaves the other under way
+    writer = SqliteLogWriter(db_path)
+    writer.start_access_period('A', 100, door='front')
+    writer.start_access_period('A', 110, door='back')
+    writer.end_access_period('A', 150, door='front')
+    writer.close()
+
+    writer = SqliteLogWriter(db_path)
+    writer.end_access_period('A', 170, door='back')
+    writer.close()
+
+    assert query_access_periods(db_path, door='front') == [('A', 100, 150)]
+    assert query_access_periods(db_path, door='back') == [('A', 110, 170)]
+
+
+def test_query_readings_by_door(tmp_path):
+    db_path = str(tmp_path / "log.db")
+
+    writer = SqliteLogWriter(db_path)
+    writer.write('A', 100, 24.5, 45.0, door='front')
+    writer.write('B', 101, 25.0, 46.0, door='back')
+    writer.write('A', 102, 24.6, 45.1, door='front')
+    writer.close()
+
+    df = query_readings(db_path, door='front')
+
+    assert list(df['User']) == ['A', 'A']
+    assert list(df['Epoch']) == [100, 102]
+    assert len(query_readings(db_path)) == 3
+
+
+def test_migrate_database_without_doors(tmp_path):
+    db_path = str(tmp_path / "log.db")
+
+    # The tables as they were before readings were logged by door
+    connection = sqlite3.connect(db_path)
+    connection.executescript("""
+        CREATE TABLE readings (user TEXT NOT NULL, epoch INTEGER NOT NULL, temperature REAL, humidity REAL,
+                               pressure REAL, gas_resistance REAL);
+        CREATE TABLE access_periods (id INTEGER PRIMARY KEY, user TEXT, start_epoch INTEGER NOT NULL,
+                                     end_epoch INTEGER);
+        INSERT INTO readings VALUES ('A', 100, 24.5, 45.0, NULL, NULL);
+        INSERT INTO access_periods (user, start_epoch) VALUES ('A', 100);
+    """)
+    connection.commit()
+    connection.close()
+
+    connect(db_path).close()
+
+    writer = SqliteLogWriter(db_path)
+    writer.write('B', 200, 25.0, 46.0, door='front')
+    writer.end_access_period('A', 150)
+    writer.close()
+
+    assert list(query_readings(db_path)['User']) == ['A', 'B']
+    assert list(query_readings(db_path, door='front')['User']) == ['B']
+    assert query_access_periods(db_path) == [('A', 100, 150)]
@@ -0,0 +1,124 @@
+# File: timestamps.py
+# Notes: Conversions between the "dd/mm/YYYY HH:MM:SS" timestamps shown on the OLED and sent over
+#        MQTT, the RTC date time tuples and the epoch seconds stored in the sensor log
+
+
+# Imports
+import calendar
+import time
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+# Format of the timestamps displayed on the OLED, sent by the publisher and written to legacy logs
+TIMESTAMP_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+_EPOCH = datetime(1970, 1, 1)
+_SECONDS_PER_DAY = 86400
+
+
+def epoch_from_rtc(date_time):
+    """
+    Convert a date time tuple, as returned by RTC.datetime(), into whole epoch seconds,
+    the RTC holds wall clock time so it is converted as if it was UTC
+    """
+    return calendar.timegm((date_time[0], date_time[1], date_time[2], date_time[4], date_time[5], date_time[6]))
+
+
+def epoch_ms_from_rtc(date_time):
+    """
+    Convert a date time tuple, as returned by RTC.datetime(), into epoch milliseconds, the
+    last item of the tuple holds the microseconds
+    """
+    return epoch_from_rtc(date_time) * 1000 + date_time[7] // 1000
+
+
+@lru_cache(maxsize=1024)
+def _day_epoch(year, month, day):
+    # Readings arrive every second or so, so the same few dates are converted over and over,
+    # date() is only here to reject impossible dates
+    date(year, month, day)
+    return calendar.timegm((year, month, day, 0, 0, 0))
+
+
+def parse_timestamp(text):
+    """
+    Parse a "dd/mm/YYYY HH:MM:SS" timestamp into epoch seconds, the fixed format is
+    picked apart by position rather than by strptime()
+    """
+    if (len(text) != 19 or text[2] != '/' or text[5] != '/' or text[10] != ' ' or text[13] != ':' or
+            text[16] != ':'):
+        raise ValueError("time data {0!r} does not match format {1!r}".format(text, TIMESTAMP_FORMAT))
+
+    hours, minutes, seconds = int(text[11:13]), int(text[14:16]), int(text[17:19])
+    if hours > 23 or minutes > 59 or seconds > 59:
+        raise ValueError("time data {0!r} is out of range".format(text))
+
+    return _day_epoch(int(text[6:10]), int(text[3:5]), int(text[0:2])) + hours * 3600 + minutes * 60 + seconds
+
+
+def parse_timestamps(texts):
+    """
+    Parse a whole column of "dd/mm/YYYY HH:MM:SS" timestamps into a numpy array of epoch
+    seconds. The digits are picked out of all the timestamps at once and each distinct
+    date is only converted once. Returns None if any timestamp does not match the format
+    exactly, so the caller can fall back to a parser that reports what is wrong with it
+    """
+    # numpy is only needed here, so it is not imported until a column is parsed
+    import numpy as np
+
+    try:
+        # One extra byte per timestamp so that any longer than 19 characters are noticed
+        chars = np.asarray(texts, dtype='S20').view(np.uint8).reshape(-1, 20)
+    except (UnicodeEncodeError, ValueError, TypeError):
+        return None
+
+    if ((chars[:, [2, 5]] != ord('/')).any() or (chars[:, 10] != ord(' ')).any() or
+            (chars[:, [13, 16]] != ord(':')).any() or chars[:, 19].any()):
+        return None
+
+    digits = (chars[:, [0, 1, 3, 4, 6, 7, 8, 9, 11, 12, 14, 15, 17, 18]] - ord('0')).astype(np.int64)
+    if (digits > 9).any():
+        return None
+
+    days = digits[:, 0] * 10 + digits[:, 1]
+    months = digits[:, 2] * 10 + digits[:, 3]
+    years = digits[:, 4] * 1000 + digits[:, 5] * 100 + digits[:, 6] * 10 + digits[:, 7]
+    hours = digits[:, 8] * 10 + digits[:, 9]
+    minutes = digits[:, 10] * 10 + digits[:, 11]
+    seconds = digits[:, 12] * 10 + digits[:, 13]
+    if (hours > 23).any() or (minutes > 59).any() or (seconds > 59).any():
+        return None
+
+    dates, date_index = np.unique(years * 10000 + months * 100 + days, return_inverse=True)
+    try:
+        date_epochs = np.array([_day_epoch(int(d) // 10000, int(d) // 100 % 100, int(d) % 100) for d in dates],
+                               dtype=np.int64)
+    except ValueError:
+        return None
+
+    return date_epochs[date_index.reshape(-1)] + hours * 3600 + minutes * 60 + seconds
+
+
+def parse_datetime(text):
+    """
+    Parse a "dd/mm/YYYY HH:MM:SS" timestamp into a datetime, gives the same result as
+    datetime.strptime(text, TIMESTAMP_FORMAT)
+    """
+    return datetime_from_epoch(parse_timestamp(text))
+
+
+def datetime_from_epoch(epoch):
+    return _EPOCH + timedelta(seconds=epoch)
+
+
+@lru_cache(maxsize=1024)
+def _day_text(day):
+    return time.strftime("%d/%m/%Y", time.gmtime(day * _SECONDS_PER_DAY))
+
+
+def format_timestamp(epoch):
+    """
+    Format epoch seconds as a "dd/mm/YYYY HH:MM:SS" timestamp
+    """
+    day, seconds = divmod(int(epoch), _SECONDS_PER_DAY)
+    return "{0} {1:02d}:{2:02d}:{3:02d}".format(_day_text(day), seconds // 3600, seconds // 60 % 60, seconds % 60)